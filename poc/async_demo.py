@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Asyncio Worker Runtime for the Anti-Stampede + DLQ + Idempotency POC
+Runs the idempotent and DLQ recovery workers as coroutines on one event loop
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime
+
+from async_emulators import AsyncLocalSQS, AsyncLocalDynamoDB
+from comprehensive_demo import ComprehensivePOC
+from metrics import METRICS
+from robust_emulators import ConditionalCheckFailedException
+
+class AsyncComprehensivePOC(ComprehensivePOC):
+    def __init__(self, max_in_flight=1000, **options):
+        # Handlers claim keys directly without a read, so there is nothing to cache.
+        # Logging only enqueues records, so handlers never block the event loop on stdout
+        super().__init__(use_idempotency_cache=False, **options)
+        # Upper bound on messages being processed concurrently per worker
+        self.max_in_flight = max_in_flight
+
+    async def claim_idempotency_key_async(self, idempotency_key):
+        """Atomically claim a message for processing; returns a lease token or None for duplicates"""
+        lease_token = str(uuid.uuid4())
+        now = int(time.time())
+        try:
+            await AsyncLocalDynamoDB.put_item(
+                self.table_name,
+                {
+                    'idempotency_key': {'S': idempotency_key},
+                    'status': {'S': 'IN_PROGRESS'},
+                    'lease_owner': {'S': lease_token},
+                    'lease_expires_at': {'N': str(now + self.lease_seconds)},
+                    'ttl': {'N': str(now + 86400)}  # 24h TTL
+                },
+                condition_expression='attribute_not_exists(idempotency_key) OR lease_expires_at < :now',
+                expression_attribute_values={':now': {'N': str(now)}}
+            )
+            return lease_token
+        except ConditionalCheckFailedException:
+            return None
+
+    async def complete_idempotency_key_async(self, idempotency_key, lease_token, result):
+        """Record the processing result, provided we still own the claim; returns whether it was stored"""
+        try:
+            await AsyncLocalDynamoDB.update_item(
+                self.table_name,
+                {'idempotency_key': {'S': idempotency_key}},
+                'SET #status = :completed, processed_at = :processed_at, #result = :result '
+                'REMOVE lease_owner, lease_expires_at',
+                expression_attribute_values={
+                    ':completed': {'S': 'COMPLETED'},
+                    ':processed_at': {'S': datetime.now().isoformat()},
+                    ':result': {'S': result},
+                    ':owner': {'S': lease_token}
+                },
+                expression_attribute_names={'#status': 'status', '#result': 'result'},
+                condition_expression='lease_owner = :owner'
+            )
+            return True
+        except ConditionalCheckFailedException:
+            self.log.warning('lease_lost', "WARNING Lease lost before completion: %s", idempotency_key,
+                             idempotency_key=idempotency_key)
+        except Exception as e:
+            self.log.error('idempotency_store_failed', "ERROR Failed to store idempotency result: %s", e,
+                           error=str(e), idempotency_key=idempotency_key)
+        return False
+
+    async def release_idempotency_key_async(self, idempotency_key, lease_token):
+        """Drop our claim after a failure so the retried delivery can claim it again"""
+        try:
+            await AsyncLocalDynamoDB.delete_item(
+                self.table_name,
+                {'idempotency_key': {'S': idempotency_key}},
+                condition_expression='lease_owner = :owner',
+                expression_attribute_values={':owner': {'S': lease_token}}
+            )
+        except ConditionalCheckFailedException:
+            pass  # lease already expired and was taken over
+        except Exception as e:
+            self.log.error('idempotency_release_failed', "ERROR Failed to release idempotency claim: %s", e,
+                           error=str(e), idempotency_key=idempotency_key)
+
+    async def process_message_async(self, message_data):
+        """Simulate message processing; waits yield the event loop instead of a thread"""
+        difficulty = message_data.get('processing_difficulty', 'easy')
+        event_type = message_data.get('event_type')
+
+        if difficulty == 'easy':
+            await asyncio.sleep(0.01)
+        elif difficulty == 'medium':
+            await asyncio.sleep(0.03)
+        elif difficulty == 'hard':
+            await asyncio.sleep(0.08)
+        elif difficulty == 'error':
+            raise Exception(f"Intentional processing error for {event_type}")
+
+        # Random failures (10% chance)
+        if random.random() < 0.10:
+            raise Exception(f"Random processing failure for {event_type}")
+
+        return f"Processed {event_type} for student {message_data.get('student_id')}"
+
+    async def handle_message(self, message):
+        """Idempotent processing of a single message"""
+        receipt_handle = message['ReceiptHandle']
+        try:
+            message_data = json.loads(message['Body'])
+        except Exception as e:
+            self.log.warning('message_unparseable', "Message parsing error: %s", e, error=str(e))
+            await AsyncLocalSQS.delete_message(self.main_queue, receipt_handle)
+            return
+
+        idempotency_key = message_data.get('idempotency_key')
+        if not idempotency_key:
+            idempotency_key = hashlib.md5(message['Body'].encode()).hexdigest()[:12]
+
+        lease_token = await self.claim_idempotency_key_async(idempotency_key)
+        if lease_token is None:
+            record = (await AsyncLocalDynamoDB.get_item(self.table_name,
+                                                        {'idempotency_key': {'S': idempotency_key}})).get('Item')
+            if record is None or record.get('status', {}).get('S') != 'COMPLETED':
+                # Live claim of another handler, which may still fail: leave the message
+                # to come back after its visibility timeout
+                self.log.message('claim_in_progress', "IDEMPOTENCY: IN PROGRESS elsewhere: %s -> "
+                                 "retry after visibility timeout", idempotency_key, idempotency_key=idempotency_key)
+                self.stats.increment('claims_in_progress')
+                return
+            self.log.message('duplicate_skipped', "IDEMPOTENCY: DUPLICATE detected: %s -> skipping", idempotency_key,
+                             idempotency_key=idempotency_key)
+            self.stats.increment('duplicates_detected')
+            await AsyncLocalSQS.delete_message(self.main_queue, receipt_handle)
+            return
+
+        try:
+            self.log.message('processing', "PROCESSING: %s | %s | %s", idempotency_key, message_data['event_type'],
+                             message_data.get('processing_difficulty'), idempotency_key=idempotency_key)
+            started = time.perf_counter()
+            result = await asyncio.wait_for(self.process_message_async(message_data), self.message_timeout)
+            if METRICS.enabled:
+                self.message_latency.observe(time.perf_counter() - started)
+
+            if not await self.complete_idempotency_key_async(idempotency_key, lease_token, result):
+                return  # the new owner's delivery settles the message
+            await AsyncLocalSQS.delete_message(self.main_queue, receipt_handle)
+            self.stats.increment('messages_processed')
+
+            self.log.message('processed', "SUCCESS: %.50s...", result, idempotency_key=idempotency_key)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = f"timed out after {self.message_timeout}s"
+            self.log.message('processing_failed', "PROCESSING FAILED: %s - %s (will retry via DLQ)", idempotency_key, e,
+                             level=logging.WARNING, idempotency_key=idempotency_key, error=str(e))
+            self.stats.increment('processing_errors')
+            await self.release_idempotency_key_async(idempotency_key, lease_token)
+            # Don't delete - let message retry and eventually go to DLQ
+
+    async def handle_dlq_message(self, message):
+        """Apply the recovery strategy for a single DLQ message"""
+        try:
+            retry = self.plan_dlq_recovery(message)
+            if retry is not None:
+                entry, _ = retry
+                # Same redrive rate cap as the threaded worker, waited out without blocking the loop
+                wait = self.redrive_bucket.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await AsyncLocalSQS.send_message(self.main_queue, entry['MessageBody'], entry['MessageAttributes'],
+                                                 delay_seconds=entry['DelaySeconds'])
+                self.stats.increment('dlq_messages_recovered')
+
+            await AsyncLocalSQS.delete_message(self.dlq_queue, message['ReceiptHandle'])
+        except Exception as e:
+            self.log.error('dlq_processing_error', "DLQ processing error: %s", e, error=str(e))
+
+    async def _consume(self, queue_url, max_messages, wait_time, handler):
+        """Single long-polling receiver fanning messages out to bounded handler tasks"""
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+
+        def on_done(task):
+            tasks.discard(task)
+            in_flight.release()
+
+        while self.running:
+            try:
+                response = await AsyncLocalSQS.receive_message(
+                    queue_url,
+                    max_messages=max_messages,
+                    wait_time=wait_time
+                )
+                for message in response.get('Messages', []):
+                    await in_flight.acquire()
+                    task = asyncio.create_task(handler(message))
+                    tasks.add(task)
+                    task.add_done_callback(on_done)
+            except Exception as e:
+                if self.running:
+                    self.log.error('worker_error', "Async worker error: %s", e, error=str(e))
+                await asyncio.sleep(1)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def idempotent_worker_async(self):
+        """Async worker demonstrating idempotency pattern"""
+        self.log.info('worker_started', "\n=== PATTERN 2: Async Idempotent Worker starting (max %d in flight) ===",
+                      self.max_in_flight, worker='idempotent', max_in_flight=self.max_in_flight)
+        await self._consume(self.main_queue, 10, 1, self.handle_message)
+
+    async def dlq_recovery_worker_async(self):
+        """Async DLQ worker demonstrating recovery pattern"""
+        self.log.info('worker_started', "\n=== PATTERN 3: Async DLQ Recovery Worker starting ===",
+                      worker='dlq_recovery')
+        await self._consume(self.dlq_queue, 5, 2, self.handle_dlq_message)
+
+    async def run_async_demo(self, total_messages=200, drain_seconds=15):
+        """Run the demonstration with both workers on a single event loop"""
+        workers = [
+            asyncio.create_task(self.idempotent_worker_async()),
+            asyncio.create_task(self.dlq_recovery_worker_async()),
+        ]
+
+        # The producer is synchronous; run it on a thread so its sends exercise
+        # the cross-thread wake-up of the async long pollers
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.anti_stampede_producer, total_messages, 10)
+
+        self.log.info('producer_done', "\nProducer finished. Letting workers process remaining messages...")
+        await asyncio.sleep(drain_seconds)
+
+        self.log.info('stopping', "\nStopping workers...")
+        self.running = False
+        await asyncio.gather(*workers)
+
+        self.print_final_results()
+
+if __name__ == "__main__":
+    poc = AsyncComprehensivePOC()
+    asyncio.run(poc.run_async_demo())
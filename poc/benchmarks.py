@@ -0,0 +1,1199 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the local emulators and worker runtimes
+
+Usage:
+    python benchmarks.py async-vs-threads [--messages N] [--threads N] [--max-in-flight N]
+    python benchmarks.py table-query [--students N] [--evaluations N] [--queries N]
+    python benchmarks.py idempotency-cache [--batches N] [--batch-size N]
+    python benchmarks.py contention [--seconds S] [--shards N] [--max-threads N]
+    python benchmarks.py multiprocess [--messages N] [--max-processes N] [--cpu-iterations N]
+    python benchmarks.py persistence [--sizes N,N,...]
+    python benchmarks.py memory [--messages N] [--items N]
+    python benchmarks.py producer [--messages N] [--consumer-rate N] [--target-depth N]
+    python benchmarks.py fifo [--messages N] [--consumers N] [--groups N,N,...] [--work-ms MS]
+    python benchmarks.py logging [--messages N] [--threads N]
+    python benchmarks.py consolidation [--evaluations N] [--per-student N] [--new-per-student N]
+                                       [--chunk-size N] [--interrupt-after N] [--shards N]
+    python benchmarks.py tiering [--items N] [--days N] [--hot-days N] [--tenants N] [--shards N]
+    python benchmarks.py redrive [--messages N] [--outage S] [--max-attempts N] [--base-delay S]
+                                 [--max-delay S] [--rate N]
+    python benchmarks.py fairness [--small-tenants N] [--small-rate N] [--noise N] [--capacity N]
+                                  [--consumers N] [--seconds S]
+    python benchmarks.py cdc [--evaluations N] [--per-student N] [--changes N] [--rounds N]
+                             [--stream-shards N] [--shards N] [--puts N]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+
+from cold_storage import DAY, enable_tiering
+from change_stream import StreamConsumer
+from grade_consolidation import DEFAULT_RULES, GradeConsolidationEngine, RunningGrades
+from rate_control import TokenBucket, backoff_delay
+from robust_emulators import EmulatorRegistry, LocalDynamoDB, LocalSQS, SimpleQueue, SimpleTable
+
+@contextlib.contextmanager
+def _quiet():
+    """Silence the per-message worker output while measuring"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def _seed_messages(queue_url, total_messages, batch_size=10):
+    """Enqueue demo-shaped messages (no duplicates, no intentional errors)"""
+    for batch_num in range(0, total_messages, batch_size):
+        entries = []
+        for i in range(batch_num, min(batch_num + batch_size, total_messages)):
+            message = {
+                'student_id': f'student_{random.randint(1000, 9999)}',
+                'event_type': random.choice(['login', 'submit_assignment', 'view_grade', 'chat_message']),
+                'timestamp': int(time.time()),
+                'idempotency_key': f'bench_{i}',
+                'processing_difficulty': random.choice(['easy', 'medium', 'hard'])
+            }
+            entries.append({'Id': str(i), 'MessageBody': json.dumps(message)})
+        LocalSQS.send_message_batch(queue_url, entries)
+
+def _queues_drained(*names):
+    for name in names:
+        attributes = EmulatorRegistry.get_queue(name).attributes()
+        if attributes['ApproximateNumberOfMessages'] != '0' or attributes['ApproximateNumberOfMessagesNotVisible'] != '0':
+            return False
+    return True
+
+def _prepare():
+    # Retry failed messages quickly so the run is dominated by processing, not timeouts
+    EmulatorRegistry.get_queue('anti-stampede-poc').visibility_timeout = 0.2
+
+def bench_threads(total_messages, threads):
+    from comprehensive_demo import ComprehensivePOC
+    with _quiet():
+        poc = ComprehensivePOC()
+        poc.log_pipeline.flush()
+    _prepare()
+    _seed_messages(poc.main_queue, total_messages)
+
+    start = time.perf_counter()
+    with _quiet():
+        workers = [threading.Thread(target=poc.idempotent_worker) for _ in range(threads)]
+        workers.append(threading.Thread(target=poc.dlq_recovery_worker))
+        for worker in workers:
+            worker.start()
+        while not _queues_drained('anti-stampede-poc', 'anti-stampede-poc-dlq'):
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        poc.running = False
+        for worker in workers:
+            worker.join()
+        poc.log_pipeline.flush()
+    return elapsed, poc.stats
+
+def bench_async(total_messages, max_in_flight):
+    from async_demo import AsyncComprehensivePOC
+    with _quiet():
+        poc = AsyncComprehensivePOC(max_in_flight=max_in_flight)
+        poc.log_pipeline.flush()
+    _prepare()
+    _seed_messages(poc.main_queue, total_messages)
+
+    async def run():
+        start = time.perf_counter()
+        workers = [
+            asyncio.create_task(poc.idempotent_worker_async()),
+            asyncio.create_task(poc.dlq_recovery_worker_async()),
+        ]
+        while not _queues_drained('anti-stampede-poc', 'anti-stampede-poc-dlq'):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        poc.running = False
+        await asyncio.gather(*workers)
+        return elapsed
+
+    with _quiet():
+        elapsed = asyncio.run(run())
+        poc.log_pipeline.flush()
+    return elapsed, poc.stats
+
+def _report(label, total_messages, elapsed, stats):
+    print(f"   {label:<28} {elapsed:8.2f}s  {total_messages / elapsed:10.1f} msg/sec  "
+          f"(processed: {stats['messages_processed']}, errors retried: {stats['processing_errors']})")
+
+def run_async_vs_threads(args):
+    print(f"ASYNC vs THREAD-POOL WORKERS: {args.messages} messages")
+    elapsed, stats = bench_threads(args.messages, args.threads)
+    _report(f"threads ({args.threads} worker)", args.messages, elapsed, stats)
+    elapsed, stats = bench_async(args.messages, args.max_in_flight)
+    _report(f"asyncio ({args.max_in_flight} in flight)", args.messages, elapsed, stats)
+
+SUBJECTS = ['matematicas', 'espanol', 'ciencias', 'historia']
+PERIODS = ['Q1_2024', 'Q2_2024', 'Q3_2024', 'Q4_2024']
+
+def _seed_evaluations(table_name, students, evaluations):
+    """Load ADR-003 shaped evaluation items: PK=TENANT#...#STUDENT#..., SK=EVAL#subject#period#..."""
+    for student in range(students):
+        pk = {'S': f'TENANT#school_{student % 10}#STUDENT#student_{student}'}
+        for evaluation in range(evaluations):
+            subject = SUBJECTS[evaluation % len(SUBJECTS)]
+            period = PERIODS[(evaluation // len(SUBJECTS)) % len(PERIODS)]
+            LocalDynamoDB.put_item(table_name, {
+                'PK': pk,
+                'SK': {'S': f'EVAL#{subject}#{period}#exam_{evaluation:04d}'},
+                'score': {'N': str(random.randint(50, 100))}
+            })
+
+def run_table_query(args):
+    EmulatorRegistry.create_table('bench-grades', partition_key='PK', sort_key='SK')
+    table = EmulatorRegistry.get_table('bench-grades')
+    _seed_evaluations('bench-grades', args.students, args.evaluations)
+    print(f"TABLE QUERY: {args.students * args.evaluations} items, {args.queries} queries "
+          f"(evaluations of one student in one subject and period)")
+
+    targets = []
+    for _ in range(args.queries):
+        student = random.randrange(args.students)
+        targets.append((f'TENANT#school_{student % 10}#STUDENT#student_{student}',
+                        f'EVAL#{random.choice(SUBJECTS)}#{random.choice(PERIODS)}#'))
+
+    start = time.perf_counter()
+    found = 0
+    for pk, prefix in targets:
+        response = LocalDynamoDB.query(
+            'bench-grades', 'PK = :pk AND begins_with(SK, :prefix)',
+            {':pk': {'S': pk}, ':prefix': {'S': prefix}}
+        )
+        found += response['Count']
+    elapsed = time.perf_counter() - start
+    print(f"   {'sorted index query':<28} {elapsed:8.3f}s  {args.queries / elapsed:10.1f} queries/sec  (items: {found})")
+
+    start = time.perf_counter()
+    found = 0
+    for pk, prefix in targets:
+        found += sum(1 for item in list(table.items.values())
+                     if item['PK'] == pk and item['SK'].startswith(prefix))
+    elapsed = time.perf_counter() - start
+    print(f"   {'full table scan':<28} {elapsed:8.3f}s  {args.queries / elapsed:10.1f} queries/sec  (items: {found})")
+
+def _duplicate_stream(batches, batch_size):
+    """Batches of keys where duplicates cluster in time, like the demo producer's"""
+    stream = []
+    previous = []
+    for batch_num in range(batches):
+        keys = []
+        for i in range(batch_size):
+            roll = random.random()
+            if roll < 0.25 and keys:
+                keys.append(keys[-1])  # duplicate of the previous message
+            elif roll < 0.40 and previous:
+                keys.append(random.choice(previous))  # redelivery from a recent batch
+            else:
+                keys.append(f'msg_{batch_num}_{i}')
+        stream.append(keys)
+        previous = keys
+    return stream
+
+def bench_idempotency_lookups(stream, use_cache):
+    from comprehensive_demo import ComprehensivePOC
+    with _quiet():
+        poc = ComprehensivePOC(use_idempotency_cache=use_cache)
+
+    table_reads = 0
+    start = time.perf_counter()
+    for keys in stream:
+        unique = set(keys)
+        records = poc.fetch_idempotency_records(keys)
+        claims = [(key, poc.claim_idempotency_key(key)) for key in unique if key not in records]
+        poc.store_idempotency_results([(key, lease_token, 'ok') for key, lease_token in claims if lease_token])
+        table_reads += len(unique)
+    elapsed = time.perf_counter() - start
+    if poc.idempotency_cache:
+        table_reads = poc.idempotency_cache.stats['misses']
+    return elapsed, table_reads, poc.idempotency_cache
+
+def run_idempotency_cache(args):
+    stream = _duplicate_stream(args.batches, args.batch_size)
+    lookups = sum(len(set(keys)) for keys in stream)
+    print(f"IDEMPOTENCY CACHE: {args.batches} batches of {args.batch_size}, {lookups} key lookups")
+    for label, use_cache in (('table only', False), ('LRU/TTL cache', True)):
+        elapsed, table_reads, cache = bench_idempotency_lookups(stream, use_cache)
+        hit_rate = f", hit rate {cache.hit_rate() * 100:.1f}%" if cache else ""
+        print(f"   {label:<28} {elapsed:8.3f}s  table key reads: {table_reads}{hit_rate}")
+
+def _table_worker(table_name, seconds, barrier, counts, index):
+    """Mixed idempotency-style traffic: claim-like puts, lookups and batch lookups"""
+    rng = random.Random(index)
+    operations = 0
+    barrier.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            key = {'idempotency_key': {'S': f'key_{rng.randrange(100000)}'}}
+            roll = rng.random()
+            if roll < 0.45:
+                LocalDynamoDB.put_item(table_name, dict(key, result={'S': 'ok'}))
+            elif roll < 0.95:
+                LocalDynamoDB.get_item(table_name, key)
+            else:
+                LocalDynamoDB.batch_get_item({table_name: {'Keys': [
+                    {'idempotency_key': {'S': f'key_{rng.randrange(100000)}'}} for _ in range(10)
+                ]}})
+        operations += 100
+    counts[index] = operations
+
+def bench_contention(shards, threads, seconds):
+    table_name = f'bench-contention-{shards}'
+    EmulatorRegistry.create_table(table_name, shards=shards)
+    counts = [0] * threads
+    barrier = threading.Barrier(threads)
+    workers = [threading.Thread(target=_table_worker, args=(table_name, seconds, barrier, counts, i))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+def run_contention(args):
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    build = 'GIL' if gil else 'free-threaded'
+    print(f"TABLE CONTENTION: Python {sys.version.split()[0]} ({build} build), {args.seconds}s per run")
+    print(f"   {'threads':>7}  {'single lock':>16}  {f'{args.shards} shards':>16}")
+    threads = 1
+    while threads <= args.max_threads:
+        single = bench_contention(1, threads, args.seconds)
+        sharded = bench_contention(args.shards, threads, args.seconds)
+        print(f"   {threads:>7}  {single:>12.0f} op/s  {sharded:>12.0f} op/s")
+        threads *= 2
+
+def _serve_emulators(socket_path, ready):
+    from queue_server import EmulatorServer
+    from robust_emulators import setup_local_infrastructure
+    with _quiet():
+        setup_local_infrastructure()
+    with EmulatorServer(socket_path) as server:
+        ready.set()
+        server.serve_forever()
+
+def _cpu_bound_worker(socket_path, cpu_iterations):
+    """Worker process running the demo's idempotent worker with CPU-bound processing"""
+    from comprehensive_demo import ComprehensivePOC
+
+    class CpuBoundPOC(ComprehensivePOC):
+        def process_message(self, message_data):
+            digest = message_data['idempotency_key'].encode()
+            for _ in range(cpu_iterations):
+                digest = hashlib.sha256(digest).digest()
+            return f"Processed {message_data['event_type']} ({digest.hex()[:8]})"
+
+    with _quiet():
+        CpuBoundPOC(server_socket=socket_path).idempotent_worker()
+
+def bench_multiprocess(processes, total_messages, cpu_iterations):
+    from queue_server import connect, disconnect
+    socket_path = os.path.join(tempfile.mkdtemp(), 'emulators.sock')
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=_serve_emulators, args=(socket_path, ready), daemon=True)
+    server.start()
+    ready.wait()
+
+    client = connect(socket_path)
+    try:
+        main_queue = 'local://sqs/anti-stampede-poc'
+        # Seed the backlog with pipelined batch sends: one round trip for all of them
+        calls = []
+        for batch_num in range(0, total_messages, 10):
+            entries = [{'Id': str(i), 'MessageBody': json.dumps({
+                'student_id': f'student_{i}', 'event_type': 'submit_assignment', 'idempotency_key': f'bench_{i}'
+            })} for i in range(batch_num, min(batch_num + 10, total_messages))]
+            calls.append(('sqs.send_message_batch', (main_queue, entries), {}))
+        client.pipeline(calls)
+
+        start = time.perf_counter()
+        workers = [multiprocessing.Process(target=_cpu_bound_worker, args=(socket_path, cpu_iterations), daemon=True)
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        while True:
+            attributes = LocalSQS.get_queue_attributes(main_queue)['Attributes']
+            if attributes['ApproximateNumberOfMessages'] == '0' and \
+                    attributes['ApproximateNumberOfMessagesNotVisible'] == '0':
+                break
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+    finally:
+        disconnect()
+        for process in [*workers, server]:
+            process.terminate()
+            process.join()
+    return elapsed
+
+def run_multiprocess(args):
+    print(f"MULTI-PROCESS WORKERS: {args.messages} messages, {args.cpu_iterations} sha256 rounds each, "
+          f"{os.cpu_count()} CPUs")
+    baseline = None
+    processes = 1
+    while processes <= args.max_processes:
+        elapsed = bench_multiprocess(processes, args.messages, args.cpu_iterations)
+        baseline = baseline or elapsed
+        print(f"   {f'{processes} process(es)':<28} {elapsed:8.2f}s  {args.messages / elapsed:10.1f} msg/sec  "
+              f"(speedup x{baseline / elapsed:.2f})")
+        processes *= 2
+
+def _persisted_items(directory, items, snapshot):
+    """Write items through a persisted table; returns (logical bytes, persistence stats)"""
+    from persistence import EmulatorPersistence
+    EmulatorRegistry.tables = {}
+    EmulatorRegistry.create_table('bench-durable')
+    persistence = EmulatorPersistence(directory, snapshot_interval=3600)
+    persistence.start()
+    logical_bytes = 0
+    expires = str(int(time.time()) + 86400)
+    tail = len(items) // 100  # writes after the snapshot that recovery must replay
+    for i, key in enumerate(items):
+        item = {'idempotency_key': {'S': key}, 'result': {'S': 'processed'}, 'ttl': {'N': expires}}
+        logical_bytes += len(json.dumps(item))
+        LocalDynamoDB.put_item('bench-durable', item)
+        if snapshot and i == len(items) - tail:
+            persistence.snapshot()
+    persistence.close()
+    return logical_bytes, persistence.stats()
+
+def _recover(directory):
+    from persistence import EmulatorPersistence
+    EmulatorRegistry.tables = {}
+    EmulatorRegistry.create_table('bench-durable')
+    return EmulatorPersistence(directory).recover()
+
+def run_persistence(args):
+    sizes = [int(size) for size in args.sizes.split(',')]
+    print("PERSISTENCE: write amplification and recovery time (1% of writes after the last snapshot)")
+    print(f"   {'items':>9}  {'logical MB':>10}  {'WAL MB':>8}  {'snapshot MB':>11}  {'write amp':>9}  "
+          f"{'recover (snapshot)':>18}  {'recover (log only)':>18}")
+    for size in sizes:
+        items = [f'key_{i}' for i in range(size)]
+        snapshot_dir = tempfile.mkdtemp()
+        log_dir = tempfile.mkdtemp()
+        try:
+            logical_bytes, stats = _persisted_items(snapshot_dir, items, snapshot=True)
+            _persisted_items(log_dir, items, snapshot=False)
+            with_snapshot = _recover(snapshot_dir)
+            log_only = _recover(log_dir)
+        finally:
+            shutil.rmtree(snapshot_dir)
+            shutil.rmtree(log_dir)
+        amplification = (stats['wal_bytes'] + stats['snapshot_bytes']) / logical_bytes
+        print(f"   {size:>9}  {logical_bytes / 1e6:>10.1f}  {stats['wal_bytes'] / 1e6:>8.1f}  "
+              f"{stats['snapshot_bytes'] / 1e6:>11.1f}  {amplification:>8.2f}x  "
+              f"{with_snapshot['seconds']:>17.2f}s  {log_only['seconds']:>17.2f}s")
+
+def _traced_bytes(build):
+    """Bytes still allocated by build()'s result once it returns"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return allocated
+
+def _message_body(i):
+    return json.dumps({'student_id': f'student_{i % 10000}', 'event_type': 'submit_assignment',
+                       'timestamp': 1700000000 + i, 'idempotency_key': f'msg_{i}'})
+
+def _idempotency_item(i):
+    return {'idempotency_key': {'S': f'key_{i}'}, 'status': {'S': 'COMPLETED'},
+            'result': {'S': 'processed'}, 'processed_at': {'S': '2024-01-01T00:00:00'},
+            'ttl': {'N': str(1700000000 + i)}}
+
+def _legacy_queue(count):
+    """Message layout before compaction: one boto-shaped dict per queued message"""
+    messages = deque()
+    for i in range(count):
+        messages.append({'Id': str(uuid.uuid4()), 'Body': _message_body(i),
+                         'ReceiptHandle': str(uuid.uuid4()), 'MessageAttributes': {}})
+    return messages
+
+def _compact_queue(count):
+    queue = SimpleQueue('bench-memory')
+    for start in range(0, count, 10):
+        queue.send_message_batch([{'Id': str(i), 'MessageBody': _message_body(i)}
+                                  for i in range(start, min(start + 10, count))])
+    return queue
+
+def _legacy_table(count):
+    """Item layout before compaction: wire items with one type dict per attribute"""
+    return {f'key_{i}': _idempotency_item(i) for i in range(count)}
+
+def _compact_table(count):
+    table = SimpleTable('bench-memory')
+    for start in range(0, count, 25):
+        table.batch_write([{'PutRequest': {'Item': _idempotency_item(i)}}
+                           for i in range(start, min(start + 25, count))])
+    return table
+
+def run_memory(args):
+    print("MEMORY: bytes held per queued message / stored idempotency item")
+    for label, count, legacy, compact in (('queue messages', args.messages, _legacy_queue, _compact_queue),
+                                          ('table items', args.items, _legacy_table, _compact_table)):
+        before = _traced_bytes(lambda: legacy(count))
+        after = _traced_bytes(lambda: compact(count))
+        print(f"   {label:<16} {count:>9}  dict layout {before / count:7.0f} B  "
+              f"compact {after / count:7.0f} B  ({after / before:.0%} of before, "
+              f"{(before - after) / 1e6:.0f} MB saved)")
+
+def _capped_consumer(queue_url, capacity, stop):
+    """Drain a queue at no more than capacity msg/sec, like a fixed-size worker fleet"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        messages = LocalSQS.receive_message(queue_url, max_messages=10, wait_time=0.1).get('Messages', [])
+        if messages:
+            LocalSQS.delete_message_batch(queue_url, [{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                                                      for i, message in enumerate(messages)])
+            time.sleep(max(0.0, len(messages) / capacity - (time.perf_counter() - started)))
+
+def bench_producer(pacing, total_messages, consumer_rate, target_depth):
+    """Produce against a capped consumer; returns (elapsed, peak depth, time to drain)"""
+    from rate_control import AimdController, TokenBucket
+    EmulatorRegistry.queues = {}
+    queue_url = EmulatorRegistry.create_queue('bench-producer')
+    stop = threading.Event()
+    consumer = threading.Thread(target=_capped_consumer, args=(queue_url, consumer_rate, stop))
+    consumer.start()
+
+    bucket = TokenBucket(rate=200, burst=20)
+    controller = AimdController(bucket, target_depth=target_depth)
+    peak_depth = 0
+    start = time.perf_counter()
+    for batch_num in range(0, total_messages, 10):
+        attributes = LocalSQS.get_queue_attributes(queue_url)['Attributes']
+        depth = int(attributes['ApproximateNumberOfMessages']) + \
+            int(attributes['ApproximateNumberOfMessagesNotVisible'])
+        peak_depth = max(peak_depth, depth)
+        if pacing == 'adaptive':
+            controller.observe(depth)
+            bucket.acquire(10)
+        LocalSQS.send_message_batch(queue_url, [{'Id': str(i), 'MessageBody': f'message {batch_num + i}'}
+                                                for i in range(10)])
+        if pacing == 'fixed':
+            time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    while not _queues_drained('bench-producer'):
+        time.sleep(0.01)
+    drained = time.perf_counter() - start
+    stop.set()
+    consumer.join()
+    return elapsed, peak_depth, drained
+
+def run_producer(args):
+    print(f"PRODUCER PACING: {args.messages} messages, consumer capacity {args.consumer_rate} msg/sec, "
+          f"target depth {args.target_depth}")
+    for pacing, label in (('none', 'unpaced'), ('fixed', 'fixed 50ms sleep per batch'), ('adaptive', 'AIMD token bucket')):
+        elapsed, peak_depth, drained = bench_producer(pacing, args.messages, args.consumer_rate, args.target_depth)
+        print(f"   {label:<28} {args.messages / elapsed:8.1f} msg/sec sent  peak depth {peak_depth:6d}  "
+              f"all consumed after {drained:6.2f}s")
+
+def _fifo_consumer(queue_url, work_seconds, stop, last_sequence, violations):
+    """Process batches message by message, checking per-group order"""
+    while not stop.is_set():
+        messages = LocalSQS.receive_message(queue_url, max_messages=10, wait_time=0.1).get('Messages', [])
+        for message in messages:
+            time.sleep(work_seconds)
+            if 'Attributes' in message:
+                group_id = message['Attributes']['MessageGroupId']
+                sequence = int(message['Attributes']['SequenceNumber'])
+                if sequence <= last_sequence.get(group_id, -1):
+                    violations.append(group_id)
+                last_sequence[group_id] = sequence
+        if messages:
+            LocalSQS.delete_message_batch(queue_url, [{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                                                      for i, message in enumerate(messages)])
+
+def bench_fifo(groups, total_messages, consumers, work_seconds):
+    """Drain time with consumer threads; groups=None is a standard queue. Returns
+    (elapsed, order violations, duplicates dropped)
+    """
+    EmulatorRegistry.queues = {}
+    queue_url = EmulatorRegistry.create_queue('bench-fifo', fifo=groups is not None,
+                                              content_based_deduplication=True)
+    for batch_num in range(0, total_messages, 10):
+        entries = []
+        for i in range(batch_num, min(batch_num + 10, total_messages)):
+            # Every tenth send repeats the previous body; FIFO drops it at send time
+            body = f'message {i - 1 if i % 10 == 9 else i}'
+            entry = {'Id': str(i), 'MessageBody': body}
+            if groups is not None:
+                entry['MessageGroupId'] = f'group_{i % groups}'
+            entries.append(entry)
+        LocalSQS.send_message_batch(queue_url, entries)
+
+    stop = threading.Event()
+    last_sequence = {}
+    violations = []
+    threads = [threading.Thread(target=_fifo_consumer, args=(queue_url, work_seconds, stop, last_sequence, violations))
+               for _ in range(consumers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    while not _queues_drained('bench-fifo'):
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return elapsed, len(violations), getattr(EmulatorRegistry.get_queue('bench-fifo'), 'duplicates_dropped', 0)
+
+def run_fifo(args):
+    work_seconds = args.work_ms / 1000
+    print(f"FIFO vs STANDARD: {args.messages} sends (10% duplicate bodies), {args.consumers} consumers, "
+          f"{args.work_ms}ms work per message")
+    elapsed, _, _ = bench_fifo(None, args.messages, args.consumers, work_seconds)
+    print(f"   {'standard':<28} {elapsed:8.2f}s  {args.messages / elapsed:10.1f} msg/sec  "
+          f"(duplicates delivered: {args.messages // 10})")
+    for groups in [int(groups) for groups in args.groups.split(',')]:
+        elapsed, violations, dropped = bench_fifo(groups, args.messages, args.consumers, work_seconds)
+        delivered = args.messages - dropped
+        print(f"   {f'fifo, {groups} group(s)':<28} {elapsed:8.2f}s  {delivered / elapsed:10.1f} msg/sec  "
+              f"(duplicates dropped: {dropped}, order violations: {violations})")
+
+def bench_logging(mode, asynchronous, sample_rate, total_messages, threads, log_path):
+    """Drain a backlog with instant processing, so worker output is a large share of
+    per-message cost; returns (elapsed, seconds until the log caught up, lines written)
+    """
+    from comprehensive_demo import ComprehensivePOC
+    from structured_log import configure_logging
+
+    class InstantPOC(ComprehensivePOC):
+        def process_message(self, message_data):
+            return f"Processed {message_data.get('event_type')} for student {message_data.get('student_id')}"
+
+    with _quiet():
+        poc = InstantPOC(use_idempotency_cache=False)
+        poc.log_pipeline.flush()
+    with open(log_path, 'w') as log_file:
+        poc.log_pipeline = configure_logging('poc', mode, stream=log_file, asynchronous=asynchronous,
+                                             sample_rate=sample_rate)
+        poc.log = poc.log_pipeline.log
+        _seed_messages(poc.main_queue, total_messages)
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=poc.idempotent_worker) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        while not _queues_drained('anti-stampede-poc'):
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        poc.running = False
+        poc.log_pipeline.flush()
+        caught_up = time.perf_counter() - start
+        for worker in workers:
+            worker.join()
+        poc.log_pipeline.close()
+    return elapsed, caught_up - elapsed, poc.log_pipeline.stats()['written']
+
+def run_logging(args):
+    print(f"WORKER LOGGING: {args.messages} messages, {args.threads} worker threads, instant processing, "
+          f"log written to a file")
+    log_path = os.path.join(tempfile.mkdtemp(), 'worker.log')
+    baseline = None
+    for label, mode, asynchronous, sample_rate in (
+            ('synchronous per-line writes', 'console', False, 1.0),
+            ('queued + batched, console', 'console', True, 1.0),
+            ('queued + batched, json', 'json', True, 1.0),
+            ('queued + batched, json 1%', 'json', True, 0.01),
+            ('quiet (aggregates only)', 'quiet', True, 1.0)):
+        elapsed, lag, written = bench_logging(mode, asynchronous, sample_rate, args.messages, args.threads, log_path)
+        rate = args.messages / elapsed
+        baseline = baseline or rate
+        print(f"   {label:<30} {elapsed:7.2f}s  {rate:9.1f} msg/sec  (x{rate / baseline:.2f}, "
+              f"{written:.0f} lines, log caught up +{lag:.2f}s)")
+    shutil.rmtree(os.path.dirname(log_path))
+
+EVALUATION_TYPES = ('exam', 'homework', 'quiz')
+
+def _evaluation_item(pk, evaluation, score):
+    """Unconsolidated ADR-003 evaluation number evaluation of a student"""
+    subject = SUBJECTS[evaluation % len(SUBJECTS)]
+    period = PERIODS[(evaluation // len(SUBJECTS)) % len(PERIODS)]
+    evaluation_type = EVALUATION_TYPES[evaluation % len(EVALUATION_TYPES)]
+    return {
+        'PK': {'S': pk},
+        'SK': {'S': f'EVAL#{subject}#{period}#{evaluation_type}_{evaluation:04d}'},
+        'evaluation_type': {'S': evaluation_type},
+        'score': {'N': str(score)},
+        'consolidated': {'BOOL': False}
+    }
+
+def _seed_pending_evaluations(table_name, students, per_student, first=0, expected=None):
+    """Unconsolidated ADR-003 evaluations written with BatchWriteItem; expected collects
+    (pk, grade sk) -> {type: [sum, count]} for checking the consolidated grades
+    """
+    batch = []
+    for student in range(students):
+        pk = f'TENANT#school_{student % 10}#STUDENT#student_{student}'
+        for evaluation in range(first, first + per_student):
+            score = random.randint(50, 100)
+            item = _evaluation_item(pk, evaluation, score)
+            batch.append({'PutRequest': {'Item': item}})
+            if expected is not None:
+                _, subject, period, _ = item['SK']['S'].split('#', 3)
+                totals = expected.setdefault((pk, f'GRADE#{subject}#{period}'), {}).setdefault(
+                    item['evaluation_type']['S'], [0, 0])
+                totals[0] += score
+                totals[1] += 1
+            if len(batch) == 25:
+                LocalDynamoDB.batch_write_item({table_name: batch})
+                batch = []
+    if batch:
+        LocalDynamoDB.batch_write_item({table_name: batch})
+
+def _python_grades(expected):
+    """The same weighted grades computed one group at a time in plain Python"""
+    weights = DEFAULT_RULES['weights']
+    grades = {}
+    for key, types in expected.items():
+        weighted = sum(weights[name] * total / count for name, (total, count) in types.items())
+        grades[key] = round(weighted / sum(weights[name] for name in types), DEFAULT_RULES['decimals'])
+    return grades
+
+def _check_grades(table_name, expected):
+    """Mismatched grades (score or evaluation count) and evaluations still pending"""
+    grades = _python_grades(expected)
+    keys = [{'PK': {'S': pk}, 'SK': {'S': sk}} for pk, sk in grades]
+    mismatched = 0
+    for start in range(0, len(keys), 100):
+        response = LocalDynamoDB.batch_get_item({table_name: {'Keys': keys[start:start + 100]}})
+        found = response['Responses'][table_name]
+        mismatched += len(keys[start:start + 100]) - len(found)  # missing grades
+        for item in found:
+            group = (item['PK']['S'], item['SK']['S'])
+            if abs(float(item['consolidated_score']['N']) - grades[group]) > 1e-9 or \
+                    int(item['evaluation_count']['N']) != sum(count for _, count in expected[group].values()):
+                mismatched += 1
+    pending, last_key = 0, None
+    while True:
+        response = LocalDynamoDB.scan(table_name, 'consolidated = :false', {':false': {'BOOL': False}},
+                                      limit=10000, exclusive_start_key=last_key)
+        pending += response['Count']
+        last_key = response.get('LastEvaluatedKey')
+        if last_key is None:
+            return mismatched, pending
+
+def _print_consolidation(label, summary):
+    rate = summary['evaluations'] / summary['seconds'] if summary['seconds'] else 0.0
+    phases = ', '.join(f"{phase} {seconds:.1f}s" for phase, seconds in summary['timings'].items())
+    print(f"   {label:<22} {summary['status']:<8} {summary['chunks']:3d} chunks  "
+          f"{summary['evaluations']:8d} evaluations  {summary['seconds']:7.1f}s  {rate:9.0f} eval/sec  ({phases})")
+
+def _crash_and_resume(shards):
+    """Mismatched grades and pending evaluations after a run killed halfway through the
+    flag writes of its second chunk (its grades written, half its flags not) is resumed
+    """
+    EmulatorRegistry.create_table('bench-consolidation-crash', partition_key='PK', sort_key='SK', shards=shards)
+    expected = {}
+    _seed_pending_evaluations('bench-consolidation-crash', 50, 24, expected=expected)
+    engine = GradeConsolidationEngine('bench-consolidation-crash', page_size=100, chunk_size=500)
+    flag = engine._flag
+    chunks = []
+
+    def crashing_flag(evaluations):
+        chunks.append(len(evaluations))
+        if len(chunks) < 2:
+            return flag(evaluations)
+        flag(evaluations[:len(evaluations) // 2])
+        raise RuntimeError("crashed mid-write")
+
+    engine._flag = crashing_flag
+    try:
+        engine.run()
+    except RuntimeError:
+        pass
+    GradeConsolidationEngine('bench-consolidation-crash', page_size=100, chunk_size=500).run()
+    return _check_grades('bench-consolidation-crash', expected)
+
+def run_consolidation(args):
+    EmulatorRegistry.create_table('bench-consolidation', partition_key='PK', sort_key='SK', shards=args.shards)
+    students = max(1, args.evaluations // args.per_student)
+    expected = {}
+    start = time.perf_counter()
+    _seed_pending_evaluations('bench-consolidation', students, args.per_student, expected=expected)
+    evaluations = students * args.per_student
+    print(f"GRADE CONSOLIDATION: {evaluations} pending evaluations, {students} students, {len(expected)} grades, "
+          f"chunks of {args.chunk_size} items (seeded in {time.perf_counter() - start:.1f}s)")
+
+    # An invocation cut short after a few chunks, then the one that resumes it
+    first = GradeConsolidationEngine('bench-consolidation', chunk_size=args.chunk_size).run(
+        max_chunks=args.interrupt_after)
+    _print_consolidation('interrupted run', first)
+    second = GradeConsolidationEngine('bench-consolidation', chunk_size=args.chunk_size).run()
+    _print_consolidation('resumed run', second)
+    mismatched, pending = _check_grades('bench-consolidation', expected)
+    print(f"   check: {mismatched} grades differ from a per-group Python computation, {pending} evaluations pending")
+
+    total_seconds = first['seconds'] + second['seconds']
+    print(f"   full run {total_seconds:.1f}s of the 900s Lambda limit "
+          f"({'fits' if total_seconds < 900 else 'needs the time budget and a resumed invocation'})")
+
+    # The nightly case: only the evaluations added since the last run are read back into memory
+    _seed_pending_evaluations('bench-consolidation', students, args.new_per_student, first=args.per_student,
+                              expected=expected)
+    nightly = GradeConsolidationEngine('bench-consolidation', chunk_size=args.chunk_size).run()
+    _print_consolidation('incremental run', nightly)
+    mismatched, pending = _check_grades('bench-consolidation', expected)
+    print(f"   check: {mismatched} grades differ, {pending} evaluations pending")
+
+    mismatched, pending = _crash_and_resume(args.shards)
+    print(f"   crash mid-write, then resume: {mismatched} grades differ, {pending} evaluations pending")
+
+    start = time.perf_counter()
+    _python_grades(expected)
+    python_seconds = time.perf_counter() - start
+    vectorized_seconds = first['timings']['compute'] + second['timings']['compute']
+    print(f"   grade arithmetic: vectorized {vectorized_seconds:.2f}s vs per-group Python {python_seconds:.2f}s "
+          f"(python aggregates from precomputed sums, so it excludes grouping)")
+
+def run_tiering(args):
+    EmulatorRegistry.create_table('bench-events', partition_key='PK', sort_key='SK', shards=args.shards)
+    now = time.time()
+    students = max(1, args.items // args.days)
+    for student in range(students):
+        pk = {'S': f'TENANT#school_{student % args.tenants}#STUDENT#student_{student}'}
+        for day in range(args.days):
+            LocalDynamoDB.put_item('bench-events', {
+                'PK': pk,
+                'SK': {'S': f'EVENT#{day:04d}#{uuid.uuid4().hex[:8]}'},
+                'timestamp': {'N': str(int(now - day * 86400 - random.randint(0, 86399)))},
+                'event_type': {'S': random.choice(['login', 'submit_assignment', 'view_grade', 'chat_message'])},
+                'duration_ms': {'N': str(random.randint(10, 5000))},
+                'device': {'S': random.choice(['web', 'ios', 'android'])}
+            })
+    table = EmulatorRegistry.get_table('bench-events')
+    before = table.expiry_stats()['live']
+    print(f"HOT/COLD TIERING: {before} events over {args.days} days, {args.tenants} tenants, "
+          f"{args.hot_days} days kept hot")
+
+    directory = tempfile.mkdtemp()
+    try:
+        tiering = enable_tiering('bench-events', directory, interval=None, max_age=args.hot_days * DAY)
+        start = time.perf_counter()
+        moved = tiering.run_once()
+        elapsed = time.perf_counter() - start
+        stats = tiering.stats()
+        print(f"   moved {moved} items in {elapsed:.1f}s ({moved / elapsed:.0f} items/sec): "
+              f"{table.expiry_stats()['live']} items left hot, {stats['files_written']:.0f} files, "
+              f"{stats['bytes_written'] / 1e6:.1f} MB on disk ({stats['raw_bytes'] / stats['bytes_written']:.1f}x "
+              f"smaller than the uncompressed columns)")
+
+        day = time.strftime('%Y-%m-%d', time.gmtime(now - (args.hot_days + 15) * DAY))
+        student = random.randrange(students)
+        pk = {'S': f'TENANT#school_{student % args.tenants}#STUDENT#student_{student}'}
+        for label, options in (
+                ('one tenant, one day, 2 columns', dict(tenant='school_3', start_date=day, end_date=day,
+                                                        projection_expression='PK, event_type')),
+                ('one tenant, one day, all columns', dict(tenant='school_3', start_date=day, end_date=day)),
+                ('one tenant, all days, 2 columns', dict(tenant='school_3', projection_expression='PK, event_type')),
+                ('one student, full history', dict(partition_key_value=pk)),
+                ('everything, filtered (no pruning)', dict(filter_expression='device = :device',
+                                                           expression_attribute_values={':device': {'S': 'ios'}},
+                                                           projection_expression='PK, device'))):
+            elapsed = float('inf')
+            for _ in range(3):  # best of three: the first read also warms the page cache
+                start = time.perf_counter()
+                result = LocalDynamoDB.read_items('bench-events', **options)
+                elapsed = min(elapsed, time.perf_counter() - start)
+            print(f"   {label:<36} {elapsed * 1000:9.1f}ms  {result['Count']:7d} items "
+                  f"({result['HotCount']} hot), {result['FilesScanned']} files read, "
+                  f"{result['FilesPruned']} pruned by key range")
+
+        # Client deletes of cold events only leave tombstones; the next pass purges the rows
+        cold = LocalDynamoDB.read_items('bench-events', tenant='school_3', start_date=day, end_date=day)['Items']
+        start = time.perf_counter()
+        for item in cold:
+            LocalDynamoDB.delete_item('bench-events', {'PK': item['PK'], 'SK': item['SK']})
+        delete_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        tiering.run_once()
+        purge_seconds = time.perf_counter() - start
+        left = LocalDynamoDB.read_items('bench-events', tenant='school_3', start_date=day, end_date=day)['Count']
+        print(f"   deleted {len(cold)} cold events in {delete_seconds * 1000:.1f}ms "
+              f"({delete_seconds / max(1, len(cold)) * 1e6:.1f}us each), purged "
+              f"{tiering.stats()['rows_purged']:.0f} rows in {purge_seconds:.2f}s, {len(tiering.tombstones)} "
+              f"tombstones left, {left} of them still read")
+        tiering.close()
+    finally:
+        shutil.rmtree(directory)
+
+def _redrive_trial(strategy, messages, outage, max_attempts, base_delay, max_delay, rate):
+    """Messages failing while a downstream is down for outage seconds, recovered from the
+    DLQ either immediately or with backoff and a rate cap; returns the outcome counts
+    """
+    main = EmulatorRegistry.create_queue('bench-redrive', dlq_name='bench-redrive-dlq', max_receive_count=2,
+                                         visibility_timeout=0)  # a failed message is dead-lettered on its next receive
+    dlq = EmulatorRegistry.create_queue('bench-redrive-dlq')
+    for start in range(0, messages, 10):
+        LocalSQS.send_message_batch(main, [{'Id': str(i), 'MessageBody': json.dumps({'id': i, 'retry_attempt': 0})}
+                                           for i in range(start, min(start + 10, messages))])
+    counts = {'failed_attempts': 0, 'processed': 0, 'given_up': 0}
+    lock = threading.Lock()
+    started = time.time()
+    recovered_at = started + outage
+    stop = threading.Event()
+
+    def consume():
+        while not stop.is_set():
+            for message in LocalSQS.receive_message(main, max_messages=10, wait_time=0.1).get('Messages', []):
+                with lock:
+                    if time.time() < recovered_at:
+                        counts['failed_attempts'] += 1
+                        continue
+                    counts['processed'] += 1
+                LocalSQS.delete_message(main, message['ReceiptHandle'])
+
+    def recover():
+        bucket = TokenBucket(rate, rate)
+        while not stop.is_set():
+            received = LocalSQS.receive_message(dlq, max_messages=10, wait_time=0.1).get('Messages', [])
+            entries = []
+            for message in received:
+                body = json.loads(message['Body'])
+                attempt = body['retry_attempt']
+                if attempt >= max_attempts:
+                    with lock:
+                        counts['given_up'] += 1
+                    continue
+                body['retry_attempt'] = attempt + 1
+                entry = {'Id': message['Id'], 'MessageBody': json.dumps(body)}
+                if strategy == 'backoff':
+                    entry['DelaySeconds'] = backoff_delay(attempt, base_delay, max_delay)
+                entries.append(entry)
+            if entries:
+                if strategy == 'backoff':
+                    bucket.acquire(len(entries))
+                LocalSQS.send_message_batch(main, entries)
+            if received:
+                LocalSQS.delete_message_batch(dlq, [{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                                                    for i, message in enumerate(received)])
+
+    threads = [threading.Thread(target=consume), threading.Thread(target=recover)]
+    for thread in threads:
+        thread.start()
+    while counts['processed'] + counts['given_up'] < messages and time.time() - started < 120:
+        time.sleep(0.05)
+    drained = time.time() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return dict(counts, seconds=drained)
+
+def run_redrive(args):
+    print(f"DLQ REDRIVE: {args.messages} messages failing during a {args.outage:.0f}s downstream outage, "
+          f"{args.max_attempts} recovery attempts each")
+    for label, strategy in (('immediate resend', 'immediate'),
+                            (f'backoff + {args.rate:.0f} msg/s cap', 'backoff')):
+        result = _redrive_trial(strategy, args.messages, args.outage, args.max_attempts,
+                                args.base_delay, args.max_delay, args.rate)
+        print(f"   {label:<26} {result['failed_attempts']:7d} failed attempts during the outage, "
+              f"{result['processed']:5d} processed, {result['given_up']:5d} given up, "
+              f"done after {result['seconds']:.1f}s")
+
+    dlq = EmulatorRegistry.create_queue('bench-redrive-dlq')
+    EmulatorRegistry.create_queue('bench-redrive', dlq_name='bench-redrive-dlq')
+    for start in range(0, args.messages, 10):
+        LocalSQS.send_message_batch(dlq, [{'Id': str(i), 'MessageBody': str(i)}
+                                          for i in range(start, min(start + 10, args.messages))])
+    start = time.perf_counter()
+    moved = LocalSQS.redrive_messages(dlq, max_messages_per_second=args.rate)['MovedMessages']
+    elapsed = time.perf_counter() - start
+    print(f"   bulk redrive_messages          {moved} moved in {elapsed:.2f}s "
+          f"(cap {args.rate:.0f} msg/sec after a burst of {args.rate:.0f})")
+
+def _fairness_trial(fair, small_tenants, small_rate, noisy_rate, capacity, consumers, seconds):
+    """Small tenants sending small_rate msg/sec each next to a noisy one sending noisy_rate,
+    drained at capacity msg/sec in total; returns send-to-receive latencies per tenant
+    """
+    EmulatorRegistry.queues = {}
+    queue_url = EmulatorRegistry.create_queue('bench-fairness', fair=fair)
+    rates = {f'school_{i}': small_rate for i in range(small_tenants)}
+    if noisy_rate:
+        rates['school_noisy'] = noisy_rate
+    latencies = {tenant: [] for tenant in rates}
+    stop = threading.Event()
+
+    def produce():
+        sent = dict.fromkeys(rates, 0)
+        started = time.time()
+        while time.time() - started < seconds:
+            elapsed = time.time() - started
+            for tenant, rate in rates.items():
+                due = int(rate * elapsed) - sent[tenant]
+                for start in range(0, due, 10):
+                    entries = [{'Id': str(i), 'MessageBody': json.dumps({'tenant': tenant, 'sent': time.time()}),
+                                'MessageAttributes': {'school_id': {'DataType': 'String', 'StringValue': tenant}}}
+                               for i in range(min(10, due - start))]
+                    LocalSQS.send_message_batch(queue_url, entries)
+                sent[tenant] += max(due, 0)
+            time.sleep(0.005)
+
+    def consume():
+        while not stop.is_set():
+            started = time.perf_counter()
+            messages = LocalSQS.receive_message(queue_url, max_messages=10, wait_time=0.1).get('Messages', [])
+            received = time.time()
+            for message in messages:
+                body = json.loads(message['Body'])
+                latencies[body['tenant']].append(received - body['sent'])
+            if messages:
+                LocalSQS.delete_message_batch(queue_url, [{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                                                          for i, message in enumerate(messages)])
+                time.sleep(max(0.0, len(messages) * consumers / capacity - (time.perf_counter() - started)))
+
+    threads = [threading.Thread(target=consume) for _ in range(consumers)]
+    for thread in threads:
+        thread.start()
+    produce()
+    while not _queues_drained('bench-fairness'):
+        time.sleep(0.01)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+def _latency_summary(values):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0, 0.0
+    return (ordered[len(ordered) // 2] * 1000,
+            ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000)
+
+def run_fairness(args):
+    noisy_rate = args.small_rate * args.noise
+    print(f"TENANT FAIRNESS: {args.small_tenants} small tenants at {args.small_rate:.0f} msg/sec each, "
+          f"a noisy tenant at {noisy_rate:.0f} msg/sec ({args.noise:.0f}x), consumers capped at "
+          f"{args.capacity:.0f} msg/sec, {args.seconds:.0f}s of traffic")
+    for fair, noisy, label in ((False, False, 'oldest-first, quiet'), (False, True, 'oldest-first, noisy'),
+                               (True, False, 'fair, quiet'), (True, True, 'fair, noisy')):
+        latencies = _fairness_trial(fair, args.small_tenants, args.small_rate, noisy_rate if noisy else 0,
+                                    args.capacity, args.consumers, args.seconds)
+        small_p50, small_p99 = _latency_summary([latency for tenant, values in latencies.items()
+                                                 if tenant != 'school_noisy' for latency in values])
+        line = f"   {label:<22} small tenants p50 {small_p50:8.1f}ms  p99 {small_p99:8.1f}ms"
+        if noisy:
+            noisy_p50, noisy_p99 = _latency_summary(latencies['school_noisy'])
+            line += f"   noisy tenant p50 {noisy_p50:8.1f}ms  p99 {noisy_p99:8.1f}ms"
+        print(line)
+
+def _bench_stream_writes(puts, stream_shards):
+    """put_item calls per second on a fresh table, with or without a change stream"""
+    EmulatorRegistry.create_table('bench-cdc-writes', partition_key='PK', sort_key='SK')
+    if stream_shards:
+        EmulatorRegistry.get_table('bench-cdc-writes').enable_stream(stream_shards, capacity=puts)
+    items = [_evaluation_item(f'TENANT#school_{i % 10}#STUDENT#student_{i // 40}', i % 40, 50 + i % 51)
+             for i in range(puts)]
+    start = time.perf_counter()
+    for item in items:
+        LocalDynamoDB.put_item('bench-cdc-writes', item)
+    return puts / (time.perf_counter() - start)
+
+def _apply_evaluation_changes(table_name, evaluations, changes):
+    """changes random writes: 70% new evaluations, 20% score corrections, 10% deletes;
+    evaluations is student -> evaluation numbers stored, kept current
+    """
+    requests = []
+    students = list(evaluations)
+    for _ in range(changes):
+        student = random.choice(students)
+        stored = evaluations[student]
+        pk = f'TENANT#school_{student % 10}#STUDENT#student_{student}'
+        kind = random.random()
+        if kind < 0.7 or not stored:
+            evaluation = max(stored, default=-1) + 1
+            stored.append(evaluation)
+        elif kind < 0.9:
+            evaluation = random.choice(stored)
+        else:
+            index = random.randrange(len(stored))
+            evaluation = stored[index]
+            stored[index] = stored[-1]
+            stored.pop()
+            requests.append({'DeleteRequest': {'Key': {key: value for key, value in
+                                                       _evaluation_item(pk, evaluation, 0).items()
+                                                       if key in ('PK', 'SK')}}})
+            continue
+        requests.append({'PutRequest': {'Item': _evaluation_item(pk, evaluation, random.randint(50, 100))}})
+    for start in range(0, len(requests), 25):
+        LocalDynamoDB.batch_write_item({table_name: requests[start:start + 25]})
+
+def run_cdc(args):
+    students = max(1, args.evaluations // args.per_student)
+    stream_shards = args.shards if args.shards > 1 else args.stream_shards
+    print(f"CHANGE DATA CAPTURE: {students * args.per_student} evaluations, {students} students, "
+          f"{args.rounds} rounds of {args.changes} writes, {stream_shards} stream shards")
+
+    # Best of 3, alternating, so both sides see the same heap and GC state
+    plain = streamed = 0.0
+    for _ in range(3):
+        plain = max(plain, _bench_stream_writes(args.puts, 0))
+        streamed = max(streamed, _bench_stream_writes(args.puts, stream_shards))
+    print(f"   put_item without stream {plain:10.0f}/sec, with stream {streamed:10.0f}/sec "
+          f"({(plain / streamed - 1) * 100:+.1f}% per write)")
+
+    table = EmulatorRegistry.create_table('bench-cdc', partition_key='PK', sort_key='SK', shards=args.shards)
+    _seed_pending_evaluations('bench-cdc', students, args.per_student)
+    table.enable_stream(None if args.shards > 1 else stream_shards,
+                        capacity=max(100000, args.changes * 2))
+    running = RunningGrades('bench-cdc')
+    start = time.perf_counter()
+    scanned = running.rebuild()
+    running.take_changed()
+    print(f"   initial full build      {time.perf_counter() - start:8.2f}s  ({scanned} items scanned, "
+          f"{len(running.totals)} grades)")
+    consumer = StreamConsumer('bench-cdc', running.apply, iterator_type='LATEST')
+    evaluations = {student: list(range(args.per_student)) for student in range(students)}
+
+    incremental_total = full_total = 0.0
+    for round_number in range(1, args.rounds + 1):
+        _apply_evaluation_changes('bench-cdc', evaluations, args.changes)
+        start = time.perf_counter()
+        handled = consumer.poll()
+        changed = running.take_changed()
+        incremental = time.perf_counter() - start
+        full = RunningGrades('bench-cdc')
+        start = time.perf_counter()
+        full.rebuild()
+        recomputed = full.grades()
+        full_seconds = time.perf_counter() - start
+        mismatched = sum(1 for group, grade in running.grades().items() if recomputed.get(group) != grade) + \
+            len(recomputed.keys() - running.totals.keys())
+        incremental_total += incremental
+        full_total += full_seconds
+        print(f"   round {round_number}: incremental {incremental * 1000:8.1f}ms ({handled} records, "
+              f"{len(changed)} grades changed)  full recompute {full_seconds:6.2f}s  "
+              f"{full_seconds / incremental:7.0f}x  mismatches {mismatched}")
+    print(f"   per write: incremental {incremental_total / (args.rounds * args.changes) * 1e6:.1f}us, "
+          f"full recompute every {args.changes} writes {full_total / (args.rounds * args.changes) * 1e6:.1f}us")
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulator and worker benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    async_parser = subparsers.add_parser('async-vs-threads', help="Async runtime vs thread-pool demo workers")
+    async_parser.add_argument('--messages', type=int, default=2000)
+    async_parser.add_argument('--threads', type=int, default=1, help="Idempotent worker threads (demo uses 1)")
+    async_parser.add_argument('--max-in-flight', type=int, default=1000)
+    async_parser.set_defaults(func=run_async_vs_threads)
+
+    query_parser = subparsers.add_parser('table-query', help="PK/SK prefix queries vs a full table scan")
+    query_parser.add_argument('--students', type=int, default=1000)
+    query_parser.add_argument('--evaluations', type=int, default=64)
+    query_parser.add_argument('--queries', type=int, default=200)
+    query_parser.set_defaults(func=run_table_query)
+
+    cache_parser = subparsers.add_parser('idempotency-cache', help="Idempotency lookups with and without the cache")
+    cache_parser.add_argument('--batches', type=int, default=5000)
+    cache_parser.add_argument('--batch-size', type=int, default=10)
+    cache_parser.set_defaults(func=run_idempotency_cache)
+
+    contention_parser = subparsers.add_parser('contention', help="Single-lock vs sharded table across 1-32 threads")
+    contention_parser.add_argument('--seconds', type=float, default=1.0)
+    contention_parser.add_argument('--shards', type=int, default=16)
+    contention_parser.add_argument('--max-threads', type=int, default=32)
+    contention_parser.set_defaults(func=run_contention)
+
+    multiprocess_parser = subparsers.add_parser('multiprocess', help="Worker processes sharing an emulator server")
+    multiprocess_parser.add_argument('--messages', type=int, default=2000)
+    multiprocess_parser.add_argument('--max-processes', type=int, default=os.cpu_count() or 1)
+    multiprocess_parser.add_argument('--cpu-iterations', type=int, default=20000)
+    multiprocess_parser.set_defaults(func=run_multiprocess)
+
+    persistence_parser = subparsers.add_parser('persistence', help="WAL/snapshot write amplification and recovery time")
+    persistence_parser.add_argument('--sizes', default='10000,100000,1000000')
+    persistence_parser.set_defaults(func=run_persistence)
+
+    memory_parser = subparsers.add_parser('memory', help="Per-message / per-item memory, dict vs compact layout")
+    memory_parser.add_argument('--messages', type=int, default=1000000)
+    memory_parser.add_argument('--items', type=int, default=1000000)
+    memory_parser.set_defaults(func=run_memory)
+
+    producer_parser = subparsers.add_parser('producer', help="Unpaced vs fixed-sleep vs adaptive producer pacing")
+    producer_parser.add_argument('--messages', type=int, default=5000)
+    producer_parser.add_argument('--consumer-rate', type=int, default=500)
+    producer_parser.add_argument('--target-depth', type=int, default=100)
+    producer_parser.set_defaults(func=run_producer)
+
+    fifo_parser = subparsers.add_parser('fifo', help="FIFO vs standard queue throughput as message groups vary")
+    fifo_parser.add_argument('--messages', type=int, default=2000)
+    fifo_parser.add_argument('--consumers', type=int, default=8)
+    fifo_parser.add_argument('--groups', default='1,2,4,8,16,64')
+    fifo_parser.add_argument('--work-ms', type=float, default=2.0)
+    fifo_parser.set_defaults(func=run_fifo)
+
+    logging_parser = subparsers.add_parser('logging', help="Synchronous vs queued/batched/sampled/quiet worker logging")
+    logging_parser.add_argument('--messages', type=int, default=20000)
+    logging_parser.add_argument('--threads', type=int, default=4)
+    logging_parser.set_defaults(func=run_logging)
+
+    consolidation_parser = subparsers.add_parser('consolidation', help="Vectorized, resumable grade consolidation")
+    consolidation_parser.add_argument('--evaluations', type=int, default=1000000)
+    consolidation_parser.add_argument('--per-student', type=int, default=40)
+    consolidation_parser.add_argument('--new-per-student', type=int, default=2)
+    consolidation_parser.add_argument('--chunk-size', type=int, default=50000)
+    consolidation_parser.add_argument('--interrupt-after', type=int, default=3, help="Chunks before the first run stops")
+    consolidation_parser.add_argument('--shards', type=int, default=1)
+    consolidation_parser.set_defaults(func=run_consolidation)
+
+    tiering_parser = subparsers.add_parser('tiering', help="Hot/cold tiering: items moved, disk size, pruned reads")
+    tiering_parser.add_argument('--items', type=int, default=1000000)
+    tiering_parser.add_argument('--days', type=int, default=120)
+    tiering_parser.add_argument('--hot-days', type=int, default=30)
+    tiering_parser.add_argument('--tenants', type=int, default=10)
+    tiering_parser.add_argument('--shards', type=int, default=1)
+    tiering_parser.set_defaults(func=run_tiering)
+
+    redrive_parser = subparsers.add_parser('redrive', help="DLQ recovery during an outage: immediate vs backoff")
+    redrive_parser.add_argument('--messages', type=int, default=1000)
+    redrive_parser.add_argument('--outage', type=float, default=3.0)
+    redrive_parser.add_argument('--max-attempts', type=int, default=5)
+    redrive_parser.add_argument('--base-delay', type=float, default=0.5)
+    redrive_parser.add_argument('--max-delay', type=float, default=8.0)
+    redrive_parser.add_argument('--rate', type=float, default=500)
+    redrive_parser.set_defaults(func=run_redrive)
+
+    fairness_parser = subparsers.add_parser('fairness', help="Small tenants' latency next to a noisy tenant")
+    fairness_parser.add_argument('--small-tenants', type=int, default=5)
+    fairness_parser.add_argument('--small-rate', type=float, default=10.0, help="msg/sec per small tenant")
+    fairness_parser.add_argument('--noise', type=float, default=100.0, help="Noisy tenant's load, x a small one")
+    fairness_parser.add_argument('--capacity', type=float, default=600.0, help="Total consumer msg/sec")
+    fairness_parser.add_argument('--consumers', type=int, default=4)
+    fairness_parser.add_argument('--seconds', type=float, default=4.0)
+    fairness_parser.set_defaults(func=run_fairness)
+
+    cdc_parser = subparsers.add_parser('cdc', help="Stream-fed running grades vs periodic full recomputation")
+    cdc_parser.add_argument('--evaluations', type=int, default=200000)
+    cdc_parser.add_argument('--per-student', type=int, default=40)
+    cdc_parser.add_argument('--changes', type=int, default=2000, help="Writes between two recomputations")
+    cdc_parser.add_argument('--rounds', type=int, default=5)
+    cdc_parser.add_argument('--stream-shards', type=int, default=4)
+    cdc_parser.add_argument('--shards', type=int, default=1, help="Table shards (each is one stream shard)")
+    cdc_parser.add_argument('--puts', type=int, default=100000, help="Writes timed for the stream overhead")
+    cdc_parser.set_defaults(func=run_cdc)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
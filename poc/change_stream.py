@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Change Stream Consumers - Incremental views over a table's change stream,
+the DynamoDB Streams alternative ADR-007 weighs against the nightly scan
+
+CRITICAL FEATURES IMPLEMENTED:
+
+1. ORDERED, BATCHED READS:
+   - One shard iterator per stream shard; every change to a partition key is
+     in one shard in write order, so per-student state never sees two writes
+     to the same student out of order (ADR-007's ordering concern)
+   - Records are read batch_size at a time and handed to the handler as one
+     batch, so a burst of writes costs one handler call, not one per write
+
+2. RESUMABLE POSITIONS:
+   - checkpoint() returns the shard iterator of the next read per shard (the
+     emulator's iterators do not expire); a consumer created from it
+     continues right after the last record handled
+   - A handler that raises leaves the iterator in place: the batch is read
+     and handled again on the next poll
+   - A consumer that falls further behind than the ring buffer holds gets
+     TrimmedDataAccessException and has to rebuild its view from a full scan
+
+HOW IT WORKS:
+- SimpleTable.enable_stream() starts recording; records carry eventName
+  (INSERT / MODIFY / REMOVE) and dynamodb.Keys / OldImage / NewImage, and
+  removals by TTL expiry, eviction or tiering carry a Service userIdentity
+- StreamConsumer(table_name, handler).poll() reads every shard to its end;
+  start(interval) polls on a background thread
+- grade_consolidation.RunningGrades is a handler that keeps per-student
+  grades current as evaluations are written
+"""
+
+import threading
+from typing import Callable, Dict, List
+
+from robust_emulators import LocalDynamoDBStreams
+
+class StreamConsumer:
+    def __init__(self, table_name: str, handler: Callable[[List[Dict]], None], batch_size: int = 1000,
+                 iterator_type: str = 'TRIM_HORIZON', checkpoint: Dict[str, str] = None):
+        self.table_name = table_name
+        self.handler = handler  # handler(records) for each batch read, in sequence order per shard
+        self.batch_size = batch_size  # records per GetRecords call, at most 1000
+        self.iterators = dict(checkpoint or {})  # shard id -> shard iterator of the next read
+        for shard in LocalDynamoDBStreams.describe_stream(table_name)['StreamDescription']['Shards']:
+            if shard['ShardId'] not in self.iterators:
+                self.iterators[shard['ShardId']] = LocalDynamoDBStreams.get_shard_iterator(
+                    table_name, shard['ShardId'], iterator_type)['ShardIterator']
+        self._stop = threading.Event()
+        self._poller = None
+
+    def seek(self, iterator_type: str = 'LATEST'):
+        """Move every shard iterator to the trim horizon or the latest record, e.g.
+        LATEST before rebuilding a view with a full scan
+        """
+        for shard_id in self.iterators:
+            self.iterators[shard_id] = LocalDynamoDBStreams.get_shard_iterator(
+                self.table_name, shard_id, iterator_type)['ShardIterator']
+
+    def poll(self) -> int:
+        """Hand every record not yet handled to the handler, shard by shard; returns
+        the number of records handled
+        """
+        handled = 0
+        for shard_id, iterator in self.iterators.items():
+            while True:
+                response = LocalDynamoDBStreams.get_records(iterator, self.batch_size)
+                records = response['Records']
+                if records:
+                    self.handler(records)
+                    handled += len(records)
+                iterator = self.iterators[shard_id] = response['NextShardIterator']
+                if len(records) < self.batch_size:
+                    break
+        return handled
+
+    def checkpoint(self) -> Dict[str, str]:
+        """Shard iterators to pass to a new consumer so it continues after this one"""
+        return dict(self.iterators)
+
+    def start(self, interval: float = 1.0):
+        """Run poll every interval seconds on a background thread"""
+        if self._poller is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"STREAM CONSUMER ERROR ({self.table_name}): {e}")
+
+        self._poller = threading.Thread(target=run, name=f"stream-{self.table_name}", daemon=True)
+        self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Cold Storage - ADR-009's hot/cold tiering for the emulated tables: items past
+a configurable age move out of memory into compressed columnar files
+
+CRITICAL FEATURES IMPLEMENTED:
+
+1. BOUNDED HOT MEMORY:
+   - A background task moves items whose timestamp attribute is older than
+     max_age out of the table (the table keeps an age heap, so finding them
+     is O(k log n), not a scan)
+   - Items are written to disk before they leave the table; an item rewritten
+     in the meantime keeps its new copy in the table
+   - Client deletes on the table leave a tombstone (appended, buffered, to
+     deleted-keys.jsonl next to the files) that hides the cold copies tiered
+     out before it; each mover pass rewrites the files holding deleted rows
+     without them and forgets those tombstones, so they do not pile up
+
+2. COMPRESSED, PARTITIONED COLUMNAR FILES:
+   - Partitioned by tenant and day: <dir>/<table>/tenant=<t>/date=<YYYY-MM-DD>/
+     (ADR-009's year/month/school_id layout at day granularity)
+   - Each file stores every attribute as its own zlib-compressed column, rows
+     sorted by primary key, with a header of column offsets and the file's
+     partition key range
+
+3. UNIFIED READS (LocalDynamoDB.read_items):
+   - The hot table is read first; cold partitions are pruned by tenant and
+     date directory, then by each file's partition key range
+   - Only the projected columns (plus the ones the filter and dedup need) are
+     read and decompressed
+   - A key found hot hides its older cold copies, also when the date bounds
+     skip reading the hot table (each cold key is then looked up hot)
+   - Files are read newest first across partitions, so a key's newest cold
+     copy hides the older ones even when they fall on different days
+
+HOW IT WORKS:
+- write_column_file / read_column_file: the file format
+- Tiering: the mover, partition layout and tiered read path for one table
+- enable_tiering(): age tracking on the table, registration in
+  EmulatorRegistry.cold_tiers, and the periodic mover thread
+
+Files are one per (tenant, day) per tiering pass; compacting small files is
+left to a later pass, as S3 + Athena deployments do.
+"""
+
+import bisect
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from metrics import METRICS, CounterSet
+from robust_emulators import EmulatorRegistry, unpack_item
+
+COLUMN_FILE_MAGIC = b'PCOL1\n'
+DAY = 86400
+_HEADER_LENGTH = struct.Struct('>I')
+
+def write_column_file(path: str, items: List[Dict], partition_key: str, compression_level: int = 6) -> Tuple[int, int]:
+    """Write wire items as a columnar file (via a temp file renamed into place);
+    returns (file bytes, uncompressed column bytes)
+    """
+    columns = {}
+    for row, item in enumerate(items):
+        for name, value in item.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * len(items)
+            column[row] = value
+
+    blocks = []
+    header_columns = {}
+    offset = raw_bytes = 0
+    for name, values in columns.items():
+        kinds = {next(iter(value)) for value in values if value is not None}
+        if kinds in ({'S'}, {'N'}):
+            # Single-type column: bare strings compress far better than type dicts
+            kind = kinds.pop()
+            values = [value[kind] if value is not None else None for value in values]
+        else:
+            kind = 'W'  # mixed or non-scalar: wire values as they are
+        raw = json.dumps(values, separators=(',', ':')).encode()
+        block = zlib.compress(raw, compression_level)
+        header_columns[name] = {'type': kind, 'offset': offset, 'length': len(block)}
+        blocks.append(block)
+        offset += len(block)
+        raw_bytes += len(raw)
+
+    keys = [item[partition_key]['S'] for item in items if 'S' in item.get(partition_key, {})]
+    header = json.dumps({
+        'rows': len(items),
+        'columns': header_columns,
+        'partition_key_range': [min(keys), max(keys)] if len(keys) == len(items) and keys else None
+    }, separators=(',', ':')).encode()
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(COLUMN_FILE_MAGIC)
+        file.write(_HEADER_LENGTH.pack(len(header)))
+        file.write(header)
+        for block in blocks:
+            file.write(block)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return len(COLUMN_FILE_MAGIC) + _HEADER_LENGTH.size + len(header) + offset, raw_bytes
+
+def read_column_header(file) -> Dict:
+    if file.read(len(COLUMN_FILE_MAGIC)) != COLUMN_FILE_MAGIC:
+        raise Exception(f"Not a column file: {file.name}")
+    header = json.loads(file.read(_HEADER_LENGTH.unpack(file.read(_HEADER_LENGTH.size))[0]))
+    header['data_start'] = file.tell()
+    return header
+
+def read_column_file(path: str, columns: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Wire items of a column file, with only the named columns (all when None)"""
+    with open(path, 'rb') as file:
+        return read_columns(file, read_column_header(file), columns)
+
+def read_columns(file, header: Dict, columns: Optional[List[str]] = None) -> Iterator[Dict]:
+    """read_column_file over an open file whose header was read, so that a file replaced
+    in the meantime is still read whole from the one handle
+    """
+    names = [name for name in (columns if columns is not None else header['columns'])
+             if name in header['columns']]
+    decoded = []
+    for name in names:
+        entry = header['columns'][name]
+        file.seek(header['data_start'] + entry['offset'])
+        values = json.loads(zlib.decompress(file.read(entry['length'])))
+        kind = entry['type']
+        if kind != 'W':
+            values = [{kind: value} if value is not None else None for value in values]
+        decoded.append((name, values))
+    return _rows(header['rows'], decoded)
+
+def _rows(count: int, decoded: List[Tuple[str, list]]) -> Iterator[Dict]:
+    for row in range(count):
+        item = {}
+        for name, values in decoded:
+            value = values[row]
+            if value is not None:
+                item[name] = value
+        yield item
+
+def _key_values(item: Dict, key_attributes: List[str]) -> tuple:
+    return tuple(next(iter(item[name].values())) for name in key_attributes)
+
+def tenant_from_key(item: Dict, partition_key: str) -> str:
+    """ADR-003 tenant of an item: TENANT#<t>#... partition keys, else a tenant_id attribute"""
+    pk = item.get(partition_key, {}).get('S', '')
+    if pk.startswith('TENANT#'):
+        return pk.split('#', 2)[1]
+    return item.get('tenant_id', {}).get('S', '_none')
+
+class Tiering:
+    def __init__(self, table_name: str, directory: str, max_age: float = 30 * DAY,
+                 timestamp_attribute: str = 'timestamp', tenant_of: Callable[[Dict, str], str] = tenant_from_key,
+                 batch_size: int = 50000, compression_level: int = 6):
+        self.table_name = table_name
+        self.directory = os.path.join(directory, table_name)
+        self.max_age = max_age  # seconds an item stays hot
+        self.timestamp_attribute = timestamp_attribute  # epoch seconds (N)
+        self.tenant_of = tenant_of
+        self.batch_size = batch_size  # items moved per tier_out call
+        self.compression_level = compression_level
+        self.counters = CounterSet(METRICS, f'tiering_{table_name}',
+                                   ['moved', 'files_written', 'bytes_written', 'raw_bytes',
+                                    'files_scanned', 'files_pruned', 'tombstones', 'rows_purged'])
+        self.file_sequence = 0
+        self.write_lock = threading.Lock()  # one mover at a time
+        self._stop = threading.Event()
+        self._mover = None
+        os.makedirs(self.directory, exist_ok=True)
+        # Key values -> time_ns of the latest client delete; cold copies in files whose
+        # items were taken from the table before it are deleted. Replaced, never
+        # mutated, by a purge, so a read keeps a consistent view
+        self.tombstones = {}
+        self.tombstone_path = os.path.join(self.directory, 'deleted-keys.jsonl')
+        self.tombstone_lock = threading.Lock()
+        if os.path.exists(self.tombstone_path):
+            with open(self.tombstone_path) as file:
+                for line in file:
+                    key, deleted_at = json.loads(line)
+                    self.tombstones[tuple(key)] = deleted_at
+        self.tombstone_file = open(self.tombstone_path, 'a')  # buffered: flushed by each pass and close()
+
+    def _table(self):
+        table = EmulatorRegistry.get_table(self.table_name)
+        if table is None:
+            raise Exception(f"Table not found: {self.table_name}")
+        return table
+
+    def _date_of(self, item: Dict) -> Optional[str]:
+        value = item.get(self.timestamp_attribute, {}).get('N')
+        if value is None:
+            return None
+        return datetime.fromtimestamp(float(value), timezone.utc).strftime('%Y-%m-%d')
+
+    def _partition_path(self, tenant: str, date: str) -> str:
+        return os.path.join(self.directory, f"tenant={quote(tenant, safe='')}", f"date={date}")
+
+    def _key_attributes(self) -> List[str]:
+        table = self._table()
+        return [table.partition_key] + ([table.sort_key] if table.sort_key else [])
+
+    def record_delete(self, key: Dict):
+        """The table's delete watcher: tombstone a key deleted by a client"""
+        key_values = _key_values(key, self._key_attributes())
+        deleted_at = time.time_ns()
+        with self.tombstone_lock:
+            self.tombstones[key_values] = deleted_at
+            self.tombstone_file.write(json.dumps([list(key_values), deleted_at]) + '\n')
+        self.counters.increment('tombstones')
+
+    def _purge_tombstones(self) -> int:
+        """Rewrite the files holding rows deleted after they were tiered out without
+        them, then forget the tombstones applied; returns the number of rows dropped
+        """
+        with self.tombstone_lock:
+            self.tombstone_file.flush()
+            pending = dict(self.tombstones)
+        if not pending:
+            return 0
+        key_attributes = self._key_attributes()
+        newest = max(pending.values())
+        partition_keys = sorted({str(key[0]) for key in pending})
+        purged = 0
+        for _, _, path in self.partitions():
+            for name in os.listdir(path):
+                if not name.endswith('.col') or int(name.split('-')[1]) >= newest:
+                    continue
+                taken_at = int(name.split('-')[1])
+                file_path = os.path.join(path, name)
+                with open(file_path, 'rb') as file:
+                    header = read_column_header(file)
+                    key_range = header['partition_key_range']
+                    if key_range and bisect.bisect_left(partition_keys, key_range[0]) == \
+                            bisect.bisect_right(partition_keys, key_range[1]):
+                        continue  # no deleted partition key in the file's range
+                    deleted = [pending.get(_key_values(item, key_attributes), 0) > taken_at
+                               for item in read_columns(file, header, key_attributes)]
+                    if not any(deleted):
+                        continue
+                    kept = [item for item, gone in zip(read_columns(file, header), deleted) if not gone]
+                # Replaced whole: a read has the old file open or opens the new one
+                if kept:
+                    write_column_file(file_path, kept, key_attributes[0], self.compression_level)
+                else:
+                    os.remove(file_path)
+                purged += len(deleted) - len(kept)
+        with self.tombstone_lock:
+            self.tombstones = {key: deleted_at for key, deleted_at in self.tombstones.items()
+                               if pending.get(key) != deleted_at}
+            self._rewrite_tombstones()
+        self.counters.increment('rows_purged', purged)
+        return purged
+
+    def _rewrite_tombstones(self):
+        """Replace deleted-keys.jsonl with the live tombstones (tombstone_lock held)"""
+        self.tombstone_file.close()
+        temp_path = f"{self.tombstone_path}.tmp"
+        with open(temp_path, 'w') as file:
+            for key_values, deleted_at in self.tombstones.items():
+                file.write(json.dumps([list(key_values), deleted_at]) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.tombstone_path)
+        self.tombstone_file = open(self.tombstone_path, 'a')
+
+    # Moving items out
+
+    def _write(self, packed_items: List[Dict], taken_at: int):
+        """tier_out's writer: one file per (tenant, day) in the batch, named by the time_ns
+        the items were taken from the table (tombstones compare against it)
+        """
+        table = self._table()
+        key_attributes = self._key_attributes()
+        partitions = {}
+        for packed in packed_items:
+            item = unpack_item(packed)
+            partitions.setdefault((self.tenant_of(item, table.partition_key), self._date_of(item)), []).append(item)
+        for (tenant, date), items in partitions.items():
+            items.sort(key=lambda item: _key_values(item, key_attributes))
+            path = self._partition_path(tenant, date)
+            os.makedirs(path, exist_ok=True)
+            self.file_sequence += 1
+            file_bytes, raw_bytes = write_column_file(
+                os.path.join(path, f"part-{taken_at:020d}-{self.file_sequence:06d}.col"),
+                items, table.partition_key, self.compression_level)
+            self.counters.increment('files_written')
+            self.counters.increment('bytes_written', file_bytes)
+            self.counters.increment('raw_bytes', raw_bytes)
+
+    def run_once(self, now: float = None) -> int:
+        """Move every item older than max_age to cold storage, then purge deleted rows
+        from the files; returns the number moved
+        """
+        cutoff = (now if now is not None else time.time()) - self.max_age
+        table = self._table()
+        moved = 0
+        with self.write_lock:
+            while True:
+                taken_at = time.time_ns()  # before tier_out takes the items
+                batch = table.tier_out(cutoff, lambda items: self._write(items, taken_at), self.batch_size)
+                if batch == 0:
+                    break
+                moved += batch
+            self._purge_tombstones()
+        self.counters.increment('moved', moved)
+        return moved
+
+    def start(self, interval: float = 3600.0):
+        """Run run_once every interval seconds on a background thread"""
+        if self._mover is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"TIERING ERROR ({self.table_name}): {e}")
+
+        self._mover = threading.Thread(target=run, name=f"tiering-{self.table_name}", daemon=True)
+        self._mover.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._mover is not None:
+            self._mover.join()
+            self._mover = None
+
+    def close(self):
+        """Stop the mover, stop recording deletes and write out the buffered tombstones"""
+        self.stop()
+        table = EmulatorRegistry.get_table(self.table_name)
+        if table is not None and EmulatorRegistry.cold_tiers.get(self.table_name) is self:
+            table.watch_deletes(None)  # not when enable_tiering replaced this tier
+        with self.tombstone_lock:
+            self.tombstone_file.close()
+
+    # Reading
+
+    def partitions(self, tenant: str = None, start_date: str = None,
+                   end_date: str = None) -> List[Tuple[str, str, str]]:
+        """(tenant, date, directory) of the cold partitions within the bounds"""
+        selected = []
+        tenant_dirs = [f"tenant={quote(tenant, safe='')}"] if tenant is not None else sorted(os.listdir(self.directory))
+        for tenant_dir in tenant_dirs:
+            tenant_path = os.path.join(self.directory, tenant_dir)
+            if not os.path.isdir(tenant_path):
+                continue
+            for date_dir in sorted(os.listdir(tenant_path)):
+                date = date_dir[len('date='):]
+                if (start_date and date < start_date) or (end_date and date > end_date):
+                    continue
+                selected.append((unquote(tenant_dir[len('tenant='):]), date, os.path.join(tenant_path, date_dir)))
+        return selected
+
+    def _hot_items(self, partition_key_value: Optional[Dict]) -> Iterator[Dict]:
+        table = self._table()
+        last_key = None
+        while True:
+            if partition_key_value is not None:
+                page = table.query(partition_key_value, None, 1000, last_key)
+            else:
+                page = table.scan(1000, last_key)
+            yield from page['Items']
+            last_key = page.get('LastEvaluatedKey')
+            if last_key is None:
+                return
+
+    def read(self, tenant: str = None, start_date: str = None, end_date: str = None,
+             partition_key_value: Dict = None, condition=None, condition_attributes: List[str] = (),
+             projection: List[str] = None, limit: int = None) -> Dict:
+        """Items within the bounds from the hot table, then from cold files, newest copy
+        of a key first; see LocalDynamoDB.read_items
+        """
+        table = self._table()
+        key_attributes = self._key_attributes()
+        dated = start_date is not None or end_date is not None
+        if partition_key_value is not None:
+            tenant_of_key = self.tenant_of({table.partition_key: partition_key_value}, table.partition_key)
+            if tenant is not None and tenant != tenant_of_key:
+                return {'Items': [], 'Count': 0, 'HotCount': 0, 'ColdCount': 0, 'FilesScanned': 0, 'FilesPruned': 0}
+            tenant = tenant_of_key
+
+        def project(item):
+            if projection is None:
+                return item
+            return {name: item[name] for name in projection if name in item}
+
+        items = []
+        seen = set()  # keys read hot, or already returned from a newer cold file
+        hot_items = self._hot_items(partition_key_value)
+        hot_skipped = False
+        oldest = table.oldest_timestamp()
+        if end_date is not None and (oldest is None or
+                                     end_date < datetime.fromtimestamp(oldest, timezone.utc).strftime('%Y-%m-%d')):
+            # The range ended before anything still hot: no hot item is returned, but
+            # hot copies from outside the range must still hide their cold ones
+            hot_items = ()
+            hot_skipped = True
+        for item in hot_items:
+            seen.add(_key_values(item, key_attributes))
+            if tenant is not None and self.tenant_of(item, table.partition_key) != tenant:
+                continue
+            if dated:
+                date = self._date_of(item)
+                if date is None or (start_date and date < start_date) or (end_date and date > end_date):
+                    continue
+            if condition is None or condition(item):
+                items.append(project(item))
+                if limit is not None and len(items) >= limit:
+                    break
+        hot_count = len(items)
+
+        columns = None
+        if projection is not None:
+            columns = list(dict.fromkeys(key_attributes + list(projection) + list(condition_attributes)))
+        pk_string = partition_key_value.get('S') if partition_key_value is not None else None
+        tombstones = self.tombstones  # before the listing: a purge replaces files first
+        files = [(name, os.path.join(path, name)) for _, _, path in self.partitions(tenant, start_date, end_date)
+                 for name in os.listdir(path) if name.endswith('.col')]
+        files.sort(reverse=True)  # newest file first, whatever its partition
+        scanned = pruned = 0
+        for name, file_path in files:
+            if limit is not None and len(items) >= limit:
+                break
+            try:
+                file = open(file_path, 'rb')
+            except FileNotFoundError:
+                continue  # every row was deleted by a purge since the listing
+            with file:
+                header = read_column_header(file)
+                key_range = header['partition_key_range']
+                if pk_string is not None and key_range and not key_range[0] <= pk_string <= key_range[1]:
+                    pruned += 1
+                    continue
+                rows = read_columns(file, header, columns)
+            scanned += 1
+            taken_at = int(name.split('-')[1])
+            for item in rows:
+                if partition_key_value is not None and item.get(table.partition_key) != partition_key_value:
+                    continue
+                key = _key_values(item, key_attributes)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if tombstones.get(key, 0) > taken_at:
+                    continue  # deleted after this copy was tiered out
+                if hot_skipped and \
+                        table.get_item({attribute: item[attribute] for attribute in key_attributes}).get('Item'):
+                    continue  # a newer copy is still hot
+                if condition is None or condition(item):
+                    items.append(project(item))
+                    if limit is not None and len(items) >= limit:
+                        break
+        self.counters.increment('files_scanned', scanned)
+        self.counters.increment('files_pruned', pruned)
+        return {'Items': items, 'Count': len(items), 'HotCount': hot_count, 'ColdCount': len(items) - hot_count,
+                'FilesScanned': scanned, 'FilesPruned': pruned}
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self.counters.items())
+
+def enable_tiering(table_name: str, directory: str, interval: float = 3600.0, **options) -> Tiering:
+    """Track item age on the table, register its cold tier for LocalDynamoDB.read_items
+    and start moving items older than max_age every interval seconds
+    (interval=None: no background mover, call run_once yourself)
+    """
+    tiering = Tiering(table_name, directory, **options)
+    tiering._table().track_age(tiering.timestamp_attribute)
+    tiering._table().watch_deletes(tiering.record_delete)
+    with EmulatorRegistry._lock:
+        previous = EmulatorRegistry.cold_tiers.get(table_name)
+        EmulatorRegistry.cold_tiers = {**EmulatorRegistry.cold_tiers, table_name: tiering}
+    if previous is not None:
+        previous.close()
+    if interval is not None:
+        tiering.start(interval)
+    return tiering
@@ -2,50 +2,134 @@
 """
 Comprehensive Anti-Stampede + DLQ + Idempotency POC
 Demonstrates all three critical distributed systems patterns working together
+
+Per received batch, idempotency records are looked up with one BatchGetItem;
+claims and completions are conditional writes (BatchWriteItem carries no
+conditions), one per key, sent together as a pipeline.
 """
 
+import argparse
 import json
+import logging
+import os
 import time
 import random
 import threading
+import uuid
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-from robust_emulators import setup_local_infrastructure, LocalSQS, LocalDynamoDB
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from robust_emulators import setup_local_infrastructure, EmulatorRegistry, LocalSQS, LocalDynamoDB, ConditionalCheckFailedException, pipelined
 import hashlib
+from idempotency_cache import IdempotencyCache
+from rate_control import AimdController, TokenBucket, backoff_delay
+from metrics import METRICS, CounterSet
+from structured_log import LOG_MODES, configure_logging
 
 class ComprehensivePOC:
-    def __init__(self):
-        setup_local_infrastructure()
+    def __init__(self, use_idempotency_cache=True, server_socket=None, batch_concurrency=10, message_timeout=None,
+                 producer_target_depth=100, metrics_enabled=True, log_mode='console', log_sample_rate=1.0,
+                 log_max_per_second=None, progress_interval=1.0, dlq_redrive_rate=50, retry_base_delay=0.5,
+                 retry_max_delay=8.0, max_retry_attempts=3, fair_scheduling=False, tenants=10):
+        if dlq_redrive_rate <= 0:
+            raise Exception(f"dlq_redrive_rate must be positive (messages per second), got {dlq_redrive_rate}")
+        if server_socket:
+            # Multi-process mode: queues and tables live in a shared emulator server
+            from queue_server import connect
+            connect(server_socket)
+        else:
+            setup_local_infrastructure(fair_scheduling)
         
         self.main_queue = 'local://sqs/anti-stampede-poc'
         self.dlq_queue = 'local://sqs/anti-stampede-poc-dlq'
         self.table_name = 'poc-idempotency'
+        self.lease_seconds = 30  # how long an in-progress claim blocks other workers
+        self.running_claims = set()  # keys of timed-out messages still running here, claim held
+        self.tenants = tenants  # messages carry a school_id attribute, school_0..school_<tenants-1>
         
-        # Statistics tracking
-        self.stats = {
-            'messages_produced': 0,
-            'messages_processed': 0,
-            'duplicates_detected': 0,
-            'processing_errors': 0,
-            'dlq_messages_recovered': 0,
-            'dlq_messages_discarded': 0
-        }
+        # Read-through/write-through cache of completed keys; None disables it
+        self.idempotency_cache = IdempotencyCache(max_entries=10000, negative_ttl=1.0) if use_idempotency_cache else None
+        
+        # Messages of one received batch are processed concurrently, at most
+        # batch_concurrency at a time; a message still running message_timeout
+        # seconds after its batch started is reported as failed. The default stays
+        # inside the main queue's visibility timeout, so a batch settles before its
+        # messages can be received again
+        self.batch_executor = ThreadPoolExecutor(max_workers=batch_concurrency, thread_name_prefix='batch-item')
+        if message_timeout is None:
+            attributes = LocalSQS.get_queue_attributes(self.main_queue)['Attributes']
+            message_timeout = 0.75 * float(attributes['VisibilityTimeout'])
+        self.message_timeout = message_timeout
+        
+        # The producer adapts its send rate to keep the main queue's backlog
+        # (visible + in-flight messages) around this depth
+        self.producer_target_depth = producer_target_depth
+        self.rate_controller = None
+        
+        # Recovered DLQ messages go back at most dlq_redrive_rate per second, each
+        # delayed by jittered exponential backoff on its retry_attempt; after
+        # max_retry_attempts recoveries a message is discarded
+        self.redrive_bucket = TokenBucket(rate=dlq_redrive_rate, burst=dlq_redrive_rate)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.max_retry_attempts = max_retry_attempts
+        
+        # Statistics tracking: sharded counters, safe to bump from every worker thread
+        self.stats = CounterSet(METRICS, 'poc', [
+            'messages_produced',
+            'messages_processed',
+            'duplicates_detected',
+            'claims_in_progress',
+            'processing_errors',
+            'dlq_messages_recovered',
+            'dlq_messages_discarded',
+            'dlq_retries_exhausted'
+        ])
+        
+        # Latency histograms and queue gauges (queue depth, DLQ depth, age of the
+        # oldest message); emulator calls record their own per-operation latency
+        if metrics_enabled:
+            METRICS.enable()
+        self.batch_latency = METRICS.histogram('worker_batch_seconds', worker='idempotent')
+        self.message_latency = METRICS.histogram('process_message_seconds')
+        self.register_queue_gauges()
+        
+        # Worker output goes through a non-blocking, batched log pipeline; per-message
+        # lines can be sampled or rate limited, and quiet mode replaces them with
+        # aggregates logged every progress_interval seconds
+        self.log_pipeline = configure_logging('poc', log_mode, sample_rate=log_sample_rate,
+                                              max_per_second=log_max_per_second)
+        self.log = self.log_pipeline.log
+        if log_mode == 'quiet':
+            self.log_pipeline.report_every(progress_interval, lambda: dict(self.stats.items()))
         
         self.running = True
-        print("Comprehensive POC initialized")
+        self.log.info('initialized', "Comprehensive POC initialized")
     
     def anti_stampede_producer(self, total_messages=500, batch_size=10):
         """Producer demonstrating anti-stampede pattern"""
-        print(f"\n=== PATTERN 1: Anti-Stampede Producer ===")
-        print("CRITICAL FEATURE: Batch processing prevents overwhelming downstream systems")
-        print("HOW IT WORKS: Groups individual messages into batches before sending to queue")
-        print("PRODUCTION BENEFIT: Reduces API calls, improves throughput, prevents cascading failures")
-        print(f"Producing {total_messages} messages in batches of {batch_size}")
+        self.log.info('producer_started',
+                      "\n=== PATTERN 1: Anti-Stampede Producer ===\n"
+                      "CRITICAL FEATURE: Batch processing prevents overwhelming downstream systems\n"
+                      "HOW IT WORKS: Groups individual messages into batches before sending to queue\n"
+                      "PRODUCTION BENEFIT: Reduces API calls, improves throughput, prevents cascading failures\n"
+                      "Producing %d messages in batches of %d\n"
+                      "BACKPRESSURE: send rate adapts (AIMD) to keep queue depth under %d",
+                      total_messages, batch_size, self.producer_target_depth,
+                      total_messages=total_messages, batch_size=batch_size,
+                      target_depth=self.producer_target_depth)
         
+        # Start at the old fixed pace (one batch of 10 per 50ms) and let the controller tune it
+        bucket = TokenBucket(rate=200, burst=2 * batch_size)
+        self.rate_controller = AimdController(bucket, target_depth=self.producer_target_depth)
         start_time = time.time()
         
         # Create batches with some duplicates for idempotency testing
         for batch_num in range(0, total_messages, batch_size):
+            attributes = LocalSQS.get_queue_attributes(self.main_queue)['Attributes']
+            depth = int(attributes['ApproximateNumberOfMessages']) + \
+                int(attributes['ApproximateNumberOfMessagesNotVisible'])
+            send_rate = self.rate_controller.observe(depth)
+            
             entries = []
             
             for i in range(batch_size):
@@ -55,11 +139,14 @@ class ComprehensivePOC:
                 # 25% chance of creating a duplicate idempotency key
                 if random.random() < 0.25 and i > 0:
                     idempotency_key = f"msg_{batch_num}_{i-1}"  # Duplicate previous
-                    print(f"   Creating DUPLICATE for testing: {idempotency_key}")
+                    self.log.message('duplicate_created', "   Creating DUPLICATE for testing: %s", idempotency_key,
+                                     idempotency_key=idempotency_key)
                 else:
                     idempotency_key = f"msg_{batch_num}_{i}"
                 
+                school_id = f'school_{random.randrange(self.tenants)}'
                 message = {
+                    'school_id': school_id,
                     'student_id': f'student_{random.randint(1000, 9999)}',
                     'event_type': random.choice(['login', 'submit_assignment', 'view_grade', 'chat_message']),
                     'timestamp': int(time.time()),
@@ -72,53 +159,188 @@ class ComprehensivePOC:
                     'Id': f'{batch_num}_{i}',
                     'MessageBody': json.dumps(message),
                     'MessageAttributes': {
-                        'idempotency_key': {'StringValue': idempotency_key, 'DataType': 'String'}
+                        'idempotency_key': {'StringValue': idempotency_key, 'DataType': 'String'},
+                        'school_id': {'StringValue': school_id, 'DataType': 'String'}
                     }
                 })
             
-            # Anti-stampede: Send batch efficiently
+            # Anti-stampede: Send batch efficiently, paced by the adaptive rate limit
+            bucket.acquire(len(entries))
             response = LocalSQS.send_message_batch(self.main_queue, entries)
             sent = len(response.get('Successful', []))
-            self.stats['messages_produced'] += sent
+            self.stats.increment('messages_produced', sent)
             
             if batch_num % 50 == 0:
                 elapsed = time.time() - start_time
-                rate = self.stats['messages_produced'] / elapsed if elapsed > 0 else 0
-                print(f"   METRICS: Batch {batch_num//batch_size}: {sent} sent, total: {self.stats['messages_produced']}, rate: {rate:.1f} msg/sec")
-            
-            # Small delay to simulate realistic production rate
-            time.sleep(0.05)
+                produced = self.stats['messages_produced']
+                rate = produced / elapsed if elapsed > 0 else 0
+                self.log.message('producer_progress',
+                                 "   METRICS: Batch %d: %d sent, total: %d, rate: %.1f msg/sec, "
+                                 "send limit: %.0f msg/sec, queue depth: %d",
+                                 batch_num // batch_size, sent, produced, rate, send_rate, depth,
+                                 batch=batch_num // batch_size, produced=produced, rate=rate,
+                                 send_limit=send_rate, queue_depth=depth)
         
         elapsed_time = time.time() - start_time
-        print(f"ANTI-STAMPEDE COMPLETE: {self.stats['messages_produced']} messages in {elapsed_time:.2f}s ({self.stats['messages_produced']/elapsed_time:.1f} msg/sec)")
+        produced = self.stats['messages_produced']
+        self.log.info('producer_finished', "ANTI-STAMPEDE COMPLETE: %d messages in %.2fs (%.1f msg/sec)",
+                      produced, elapsed_time, produced / elapsed_time,
+                      produced=produced, seconds=elapsed_time)
+    
+    def register_queue_gauges(self):
+        """Gauges sampled at export: visible and in-flight depth of the main queue and
+        DLQ, plus the age of each queue's oldest message when the queues are local
+        """
+        for queue_url, role in ((self.main_queue, 'main'), (self.dlq_queue, 'dlq')):
+            for attribute, name in (('ApproximateNumberOfMessages', 'queue_visible_messages'),
+                                    ('ApproximateNumberOfMessagesNotVisible', 'queue_in_flight_messages')):
+                METRICS.gauge(name, self._queue_attribute_sampler(queue_url, attribute), queue=role)
+            queue = EmulatorRegistry.queues.get(queue_url)
+            if queue is not None and EmulatorRegistry.backend is None:
+                METRICS.gauge('queue_oldest_message_age_seconds', queue.oldest_message_age, queue=role)
+    
+    @staticmethod
+    def _queue_attribute_sampler(queue_url, attribute):
+        def sample():
+            return int(LocalSQS.get_queue_attributes(queue_url)['Attributes'][attribute])
+        return sample
     
-    def check_idempotency(self, idempotency_key):
-        """Check if message was already processed"""
+    def export_metrics(self, directory):
+        """Write metrics.prom (Prometheus text) and metrics.emf.jsonl (CloudWatch EMF)"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'metrics.prom'), 'w') as prom_file:
+            prom_file.write(METRICS.to_prometheus())
+        with open(os.path.join(directory, 'metrics.emf.jsonl'), 'w') as emf_file:
+            emf_file.writelines(line + '\n' for line in METRICS.to_emf())
+        print(f"Metrics exported to {directory}")
+    
+    def claim_idempotency_keys(self, idempotency_keys):
+        """Atomically claim messages for processing; returns {idempotency_key: lease token}
+        for the keys claimed, leaving out duplicates. The claims go out as one pipeline
+        """
+        now = int(time.time())
+        lease_tokens = {key: str(uuid.uuid4()) for key in idempotency_keys}
+        # One conditional write per key: succeeds for unseen keys and for claims whose
+        # lease expired (the claiming worker died); completed records have no lease
+        outcomes = pipelined([(LocalDynamoDB.put_item, (
+            self.table_name,
+            {
+                'idempotency_key': {'S': idempotency_key},
+                'status': {'S': 'IN_PROGRESS'},
+                'lease_owner': {'S': lease_token},
+                'lease_expires_at': {'N': str(now + self.lease_seconds)},
+                'ttl': {'N': str(now + 86400)}  # 24h TTL
+            }
+        ), {
+            'condition_expression': 'attribute_not_exists(idempotency_key) OR lease_expires_at < :now',
+            'expression_attribute_values': {':now': {'N': str(now)}}
+        }) for idempotency_key, lease_token in lease_tokens.items()], return_exceptions=True)
+        
+        claimed = {}
+        for (idempotency_key, lease_token), outcome in zip(lease_tokens.items(), outcomes):
+            if isinstance(outcome, ConditionalCheckFailedException):
+                continue
+            if isinstance(outcome, Exception):
+                raise outcome
+            claimed[idempotency_key] = lease_token
+            if self.idempotency_cache:
+                self.idempotency_cache.invalidate(idempotency_key)  # drop any "not seen" entry
+        return claimed
+    
+    def claim_idempotency_key(self, idempotency_key):
+        """Atomically claim a message for processing; returns a lease token or None for duplicates"""
+        return self.claim_idempotency_keys([idempotency_key]).get(idempotency_key)
+    
+    def fetch_idempotency_records(self, idempotency_keys):
+        """Look up the idempotency records of a whole batch with one batch-get"""
+        records = {}
+        missing = []
+        for key in set(idempotency_keys):
+            if self.idempotency_cache:
+                found, record = self.idempotency_cache.get(key)
+                if found:
+                    if record is not None:
+                        records[key] = record
+                    continue
+            missing.append(key)
+        if not missing:
+            return records
+        
+        request_items = {self.table_name: {'Keys': [{'idempotency_key': {'S': key}} for key in missing]}}
         try:
-            response = LocalDynamoDB.get_item(
-                self.table_name,
-                {'idempotency_key': {'S': idempotency_key}}
-            )
-            
-            if 'Item' in response:
-                processed_at = response['Item'].get('processed_at', {}).get('S', '')
-                return True, response['Item'].get('result', {}).get('S', 'duplicate')
-            return False, None
+            while request_items:
+                response = LocalDynamoDB.batch_get_item(request_items)
+                for item in response['Responses'].get(self.table_name, []):
+                    records[item['idempotency_key']['S']] = item
+                request_items = response['UnprocessedKeys']  # retry keys over the capacity limit
         except Exception as e:
-            print(f"ERROR Idempotency check failed: {e}")
-            return False, None
+            self.log.error('idempotency_check_failed', "ERROR Idempotency check failed: %s", e, error=str(e))
+            return records
+        
+        # Only completed records are final; in-progress claims may still be released
+        if self.idempotency_cache:
+            for key in missing:
+                record = records.get(key)
+                if record is None:
+                    self.idempotency_cache.put_missing(key)
+                elif record.get('status', {}).get('S') == 'COMPLETED':
+                    self.idempotency_cache.put(key, record)
+        return records
+    
+    def store_idempotency_results(self, results):
+        """Complete the (idempotency_key, lease_token, result) claims of a batch; returns
+        the keys whose results were stored
+        
+        Completion stays one owner-checked write per key (BatchWriteItem has no
+        conditions): a worker whose lease was taken over must not overwrite the new
+        owner's claim. The writes go out as one pipeline instead.
+        """
+        processed_at = datetime.now().isoformat()
+        outcomes = pipelined([(LocalDynamoDB.update_item, (
+            self.table_name,
+            {'idempotency_key': {'S': idempotency_key}},
+            'SET #status = :completed, processed_at = :processed_at, #result = :result '
+            'REMOVE lease_owner, lease_expires_at'
+        ), {
+            'expression_attribute_values': {
+                ':completed': {'S': 'COMPLETED'},
+                ':processed_at': {'S': processed_at},
+                ':result': {'S': result},
+                ':owner': {'S': lease_token}
+            },
+            'expression_attribute_names': {'#status': 'status', '#result': 'result'},
+            'condition_expression': 'lease_owner = :owner'
+        }) for idempotency_key, lease_token, result in results], return_exceptions=True)
+        
+        stored = []
+        for (idempotency_key, _, _), outcome in zip(results, outcomes):
+            if isinstance(outcome, ConditionalCheckFailedException):
+                # The lease expired and another worker claimed the key: its delivery completes it
+                self.log.warning('lease_lost', "WARNING Lease lost before completion: %s", idempotency_key,
+                                 idempotency_key=idempotency_key)
+            elif isinstance(outcome, Exception):
+                self.log.error('idempotency_store_failed', "ERROR Failed to store idempotency result: %s", outcome,
+                               error=str(outcome), idempotency_key=idempotency_key)
+            else:
+                stored.append(idempotency_key)
+                if self.idempotency_cache:
+                    self.idempotency_cache.put(idempotency_key, outcome['Attributes'])
+        return stored
     
-    def store_idempotency_result(self, idempotency_key, result):
-        """Store processing result for idempotency"""
+    def release_idempotency_key(self, idempotency_key, lease_token):
+        """Drop our claim after a failure so the retried delivery can claim it again"""
         try:
-            LocalDynamoDB.put_item(self.table_name, {
-                'idempotency_key': {'S': idempotency_key},
-                'processed_at': {'S': datetime.now().isoformat()},
-                'result': {'S': result},
-                'ttl': {'N': str(int(time.time()) + 86400)}  # 24h TTL
-            })
+            LocalDynamoDB.delete_item(
+                self.table_name,
+                {'idempotency_key': {'S': idempotency_key}},
+                condition_expression='lease_owner = :owner',
+                expression_attribute_values={':owner': {'S': lease_token}}
+            )
+        except ConditionalCheckFailedException:
+            pass  # lease already expired and was taken over
         except Exception as e:
-            print(f"ERROR Failed to store idempotency result: {e}")
+            self.log.error('idempotency_release_failed', "ERROR Failed to release idempotency claim: %s", e,
+                           error=str(e), idempotency_key=idempotency_key)
     
     def process_message(self, message_data):
         """Simulate message processing with potential failures"""
@@ -141,16 +363,71 @@ class ComprehensivePOC:
         
         return f"Processed {event_type} for student {message_data.get('student_id')}"
     
+    def _process_claimed(self, idempotency_key, message_data):
+        self.log.message('processing', "PROCESSING: %s | %s | %s", idempotency_key, message_data['event_type'],
+                         message_data.get('processing_difficulty'), idempotency_key=idempotency_key)
+        if not METRICS.enabled:
+            return self.process_message(message_data)
+        with self.message_latency.time():
+            return self.process_message(message_data)
+    
+    def _release_stopped(self, idempotency_key, lease_token):
+        self.release_idempotency_key(idempotency_key, lease_token)
+        self.running_claims.discard(idempotency_key)
+    
+    def process_batch(self, claimed):
+        """Process the claimed messages of one batch concurrently, reporting partial failures
+        
+        claimed holds (idempotency_key, message_data, receipt_handle, lease_token) entries.
+        Returns (completed, batch_item_failures) like Lambda's ReportBatchItemFailures:
+        (idempotency_key, lease_token, result, receipt_handle) of each success, and the receipt handles
+        of failed or timed-out messages. Claims of failed messages are released so they can be
+        retried at once; a timed-out message may still be running, so its claim is released
+        when it stops (at once if it never started) and no second delivery runs alongside it.
+        """
+        deadline = time.monotonic() + self.message_timeout
+        futures = [self.batch_executor.submit(self._process_claimed, idempotency_key, message_data)
+                   for idempotency_key, message_data, _, _ in claimed]
+        
+        completed = []
+        batch_item_failures = []
+        for (idempotency_key, message_data, receipt_handle, lease_token), future in zip(claimed, futures):
+            try:
+                result = future.result(timeout=max(0, deadline - time.monotonic()))
+                completed.append((idempotency_key, lease_token, result, receipt_handle))
+                self.log.message('processed', "SUCCESS: %.50s...", result, idempotency_key=idempotency_key)
+            except Exception as e:
+                timed_out = isinstance(e, FutureTimeoutError)
+                if timed_out:
+                    # A running straggler cannot be interrupted; its result is discarded
+                    future.cancel()
+                    e = f"timed out after {self.message_timeout}s"
+                self.log.message('processing_failed', "PROCESSING FAILED: %s - %s (will retry via DLQ)",
+                                 idempotency_key, e, level=logging.WARNING, idempotency_key=idempotency_key,
+                                 error=str(e))
+                self.stats.increment('processing_errors')
+                if timed_out:
+                    self.running_claims.add(idempotency_key)
+                    future.add_done_callback(lambda _, key=idempotency_key, token=lease_token:
+                                             self._release_stopped(key, token))
+                else:
+                    self.release_idempotency_key(idempotency_key, lease_token)
+                batch_item_failures.append(receipt_handle)
+        return completed, batch_item_failures
+    
     def idempotent_worker(self):
         """Worker demonstrating idempotency pattern"""
-        print(f"\n=== PATTERN 2: Idempotent Worker starting ===")
-        print("CRITICAL FEATURE: Prevents duplicate processing using idempotency keys")
-        print("HOW IT WORKS: Stores processing results in DynamoDB with unique keys")
-        print("PRODUCTION BENEFIT: Ensures exactly-once processing, prevents data corruption")
+        self.log.info('worker_started',
+                      "\n=== PATTERN 2: Idempotent Worker starting ===\n"
+                      "CRITICAL FEATURE: Prevents duplicate processing using idempotency keys\n"
+                      "HOW IT WORKS: Stores processing results in DynamoDB with unique keys\n"
+                      "PRODUCTION BENEFIT: Ensures exactly-once processing, prevents data corruption",
+                      worker='idempotent')
         
         while self.running:
             try:
-                # Anti-stampede: Process messages in batches
+                # Anti-stampede: Process messages in batches. Long polling blocks
+                # until messages arrive, so there is no sleep on an empty queue
                 response = LocalSQS.receive_message(
                     self.main_queue,
                     max_messages=10,  # Batch processing
@@ -159,135 +436,248 @@ class ComprehensivePOC:
                 
                 messages = response.get('Messages', [])
                 if not messages:
-                    time.sleep(0.5)
                     continue
                 
-                print(f"Processing batch of {len(messages)} messages...")
+                batch_started = time.perf_counter()
+                self.log.message('batch_received', "Processing batch of %d messages...", len(messages),
+                                 batch_size=len(messages))
                 
+                parsed = []
                 for message in messages:
                     try:
                         message_data = json.loads(message['Body'])
                         idempotency_key = message_data.get('idempotency_key')
-                        receipt_handle = message['ReceiptHandle']
-                        
                         if not idempotency_key:
                             idempotency_key = hashlib.md5(message['Body'].encode()).hexdigest()[:12]
-                        
-                        # Idempotency check
-                        is_duplicate, previous_result = self.check_idempotency(idempotency_key)
-                        
-                        if is_duplicate:
-                            print(f"IDEMPOTENCY: DUPLICATE detected: {idempotency_key} -> skipping")
-                            self.stats['duplicates_detected'] += 1
-                            LocalSQS.delete_message(self.main_queue, receipt_handle)
-                            continue
-                        
-                        # Process new message
-                        try:
-                            print(f"PROCESSING: {idempotency_key} | {message_data['event_type']} | {message_data.get('processing_difficulty')}")
-                            result = self.process_message(message_data)
-                            
-                            # Store successful result
-                            self.store_idempotency_result(idempotency_key, result)
-                            LocalSQS.delete_message(self.main_queue, receipt_handle)
-                            self.stats['messages_processed'] += 1
-                            
-                            print(f"SUCCESS: {result[:50]}...")
-                            
-                        except Exception as e:
-                            print(f"PROCESSING FAILED: {idempotency_key} - {e} (will retry via DLQ)")
-                            self.stats['processing_errors'] += 1
-                            # Don't delete - let message retry and eventually go to DLQ
-                            
+                        parsed.append((message, message_data, idempotency_key))
                     except Exception as e:
-                        print(f"Message parsing error: {e}")
-                        if 'receipt_handle' in locals():
-                            LocalSQS.delete_message(self.main_queue, receipt_handle)
+                        self.log.warning('message_unparseable', "Message parsing error: %s", e, error=str(e))
+                        LocalSQS.delete_message(self.main_queue, message['ReceiptHandle'])
+                
+                # Idempotency check for the whole batch in one call; completed keys and
+                # live claims of other workers are settled without a claim attempt
+                records = self.fetch_idempotency_records([key for _, _, key in parsed])
+                now = int(time.time())
+                
+                # The claims are the race-free guard for keys the batch-get saw as new (or
+                # whose lease expired); every distinct key is claimed once, in one pipeline
+                to_claim = []
+                for _, _, idempotency_key in parsed:
+                    record = records.get(idempotency_key)
+                    if record is None or ('lease_expires_at' in record and
+                                          int(record['lease_expires_at']['N']) < now):
+                        to_claim.append(idempotency_key)
+                lease_tokens = self.claim_idempotency_keys(list(dict.fromkeys(to_claim)))
+                claimed_keys = set(lease_tokens)
+                
+                claimed = []
+                acknowledged = []  # receipt handles deleted together at the end of the batch
+                repeats = {}  # claimed key -> receipt handles of its later messages in the batch
+                for message, message_data, idempotency_key in parsed:
+                    receipt_handle = message['ReceiptHandle']
+                    record = records.get(idempotency_key)
+                    # A key repeated within the batch is processed by its first message only
+                    lease_token = lease_tokens.pop(idempotency_key, None)
+                    
+                    if lease_token is None:
+                        if idempotency_key in claimed_keys:
+                            # Settled with the first message: acknowledged once its result is stored
+                            self.log.message('duplicate_in_batch', "IDEMPOTENCY: DUPLICATE in batch: %s -> "
+                                             "settled with its first message", idempotency_key,
+                                             idempotency_key=idempotency_key)
+                            repeats.setdefault(idempotency_key, []).append(receipt_handle)
+                            continue
+                        if idempotency_key in self.running_claims:
+                            # An earlier delivery timed out here and is still running: retry once it stops
+                            self.log.message('claim_still_running', "IDEMPOTENCY: STILL RUNNING here: %s -> "
+                                             "retry after visibility timeout", idempotency_key,
+                                             idempotency_key=idempotency_key)
+                            continue
+                        if record is None or record.get('status', {}).get('S') != 'COMPLETED':
+                            # Another worker holds a live claim (or took it since the batch-get) and
+                            # may still fail: keep the message, it is received again after its
+                            # visibility timeout and deleted then if that worker completed it
+                            self.log.message('claim_in_progress', "IDEMPOTENCY: IN PROGRESS elsewhere: %s -> "
+                                             "retry after visibility timeout", idempotency_key,
+                                             idempotency_key=idempotency_key)
+                            self.stats.increment('claims_in_progress')
+                            continue
+                        self.log.message('duplicate_skipped', "IDEMPOTENCY: DUPLICATE detected: %s -> skipping",
+                                         idempotency_key, idempotency_key=idempotency_key)
+                        self.stats.increment('duplicates_detected')
+                        acknowledged.append(receipt_handle)
+                        continue
+                    claimed.append((idempotency_key, message_data, receipt_handle, lease_token))
+                
+                # Batch latency is that of the slowest message rather than the sum of all.
+                # Failures are not deleted - they retry and eventually go to the DLQ
+                completed, batch_item_failures = self.process_batch(claimed)
+                if batch_item_failures:
+                    self.log.message('batch_item_failures', "BATCH ITEM FAILURES: %d of %d left for retry",
+                                     len(batch_item_failures), len(claimed), level=logging.WARNING,
+                                     failed=len(batch_item_failures), claimed=len(claimed))
+                
+                # Store successful results, then acknowledge the messages; a result whose
+                # lease was lost is dropped and its message left for the new owner to settle
+                if completed:
+                    stored = set(self.store_idempotency_results(
+                        [(key, lease_token, result) for key, lease_token, result, _ in completed]))
+                    acknowledged.extend(receipt_handle for key, _, _, receipt_handle in completed if key in stored)
+                    if stored:
+                        self.stats.increment('messages_processed', len(stored))
+                    # Repeats of a key whose first message failed come back with its retry
+                    settled = [receipt_handle for key in stored for receipt_handle in repeats.get(key, [])]
+                    if settled:
+                        acknowledged.extend(settled)
+                        self.stats.increment('duplicates_detected', len(settled))
+                if acknowledged:
+                    LocalSQS.delete_message_batch(self.main_queue, [
+                        {'Id': str(i), 'ReceiptHandle': receipt_handle}
+                        for i, receipt_handle in enumerate(acknowledged)
+                    ])
+                if METRICS.enabled:
+                    self.batch_latency.observe(time.perf_counter() - batch_started)
                 
                 # Print progress periodically
-                if self.stats['messages_processed'] % 25 == 0 and self.stats['messages_processed'] > 0:
-                    print(f"WORKER PROGRESS: {self.stats['messages_processed']} processed, {self.stats['duplicates_detected']} duplicates, {self.stats['processing_errors']} errors")
+                processed = self.stats['messages_processed']
+                if processed % 25 == 0 and processed > 0:
+                    duplicates, errors = self.stats['duplicates_detected'], self.stats['processing_errors']
+                    self.log.message('worker_progress', "WORKER PROGRESS: %d processed, %d duplicates, %d errors",
+                                     processed, duplicates, errors,
+                                     processed=processed, duplicates=duplicates, errors=errors)
                 
             except Exception as e:
                 if self.running:
-                    print(f"Worker error: {e}")
+                    self.log.error('worker_error', "Worker error: %s", e, worker='idempotent', error=str(e))
                 time.sleep(1)
     
     def dlq_recovery_worker(self):
         """DLQ worker demonstrating recovery pattern"""
-        print(f"\n=== PATTERN 3: DLQ Recovery Worker starting ===")
-        print("CRITICAL FEATURE: Smart recovery strategies for failed message processing")
-        print("HOW IT WORKS: Analyzes failure types and applies appropriate recovery logic")
-        print("PRODUCTION BENEFIT: Prevents message loss, implements circuit breaker patterns")
+        self.log.info('worker_started',
+                      "\n=== PATTERN 3: DLQ Recovery Worker starting ===\n"
+                      "CRITICAL FEATURE: Smart recovery strategies for failed message processing\n"
+                      "HOW IT WORKS: Analyzes failure types and applies appropriate recovery logic\n"
+                      "PRODUCTION BENEFIT: Prevents message loss, implements circuit breaker patterns",
+                      worker='dlq_recovery')
         
         while self.running:
             try:
                 response = LocalSQS.receive_message(
                     self.dlq_queue,
-                    max_messages=5,
+                    max_messages=10,
                     wait_time=2
                 )
                 
                 messages = response.get('Messages', [])
                 if not messages:
-                    time.sleep(1)
                     continue
                 
-                print(f"DLQ ANALYSIS: Found {len(messages)} failed messages requiring recovery")
+                self.log.message('dlq_batch_received', "DLQ ANALYSIS: Found %d failed messages requiring recovery",
+                                 len(messages), batch_size=len(messages))
                 
+                retries = []
+                settled = []
                 for message in messages:
                     try:
-                        message_data = json.loads(message['Body'])
-                        receipt_handle = message['ReceiptHandle']
-                        difficulty = message_data.get('processing_difficulty', 'unknown')
-                        event_type = message_data.get('event_type', 'unknown')
-                        idempotency_key = message_data.get('idempotency_key', 'unknown')
-                        
-                        print(f"FAILURE ANALYSIS: {idempotency_key} | {event_type} | difficulty: {difficulty}")
-                        
-                        # Recovery strategies based on failure type
-                        if difficulty == 'error':
-                            # Strategy 1: Discard permanent errors
-                            print(f"RECOVERY STRATEGY: DISCARD permanent error: {idempotency_key}")
-                            self.stats['dlq_messages_discarded'] += 1
-                            
-                        elif difficulty in ['hard', 'medium']:
-                            # Strategy 2: Retry with reduced difficulty
-                            print(f"RECOVERY STRATEGY: RETRY with reduced complexity: {idempotency_key}")
-                            message_data['processing_difficulty'] = 'easy'
-                            message_data['retry_attempt'] = message_data.get('retry_attempt', 0) + 1
-                            
-                            # Send back to main queue for retry
-                            LocalSQS.send_message(
-                                self.main_queue,
-                                json.dumps(message_data),
-                                {'retry_attempt': {'StringValue': str(message_data['retry_attempt']), 'DataType': 'Number'}}
-                            )
-                            self.stats['dlq_messages_recovered'] += 1
-                            
+                        retry = self.plan_dlq_recovery(message)
+                        if retry is not None:
+                            retries.append(retry)
                         else:
-                            # Strategy 3: Requeue unchanged (transient failures)
-                            print(f"RECOVERY STRATEGY: REQUEUE unchanged: {idempotency_key}")
-                            LocalSQS.send_message(self.main_queue, json.dumps(message_data))
-                            self.stats['dlq_messages_recovered'] += 1
-                        
-                        LocalSQS.delete_message(self.dlq_queue, receipt_handle)
-                        
+                            settled.append(message['ReceiptHandle'])
                     except Exception as e:
-                        print(f"DLQ processing error: {e}")
+                        self.log.error('dlq_processing_error', "DLQ processing error: %s", e, error=str(e))
+                
+                # Anti-stampede for retries: the DLQ drains at a capped rate and every
+                # retry is delivered after its own backoff, not all at once
+                if retries:
+                    self.redrive_bucket.acquire(len(retries))
+                    response = LocalSQS.send_message_batch(self.main_queue, [entry for entry, _ in retries])
+                    sent = {entry['Id'] for entry in response.get('Successful', [])}
+                    for entry, receipt_handle in retries:
+                        if entry['Id'] in sent:
+                            settled.append(receipt_handle)
+                    self.stats.increment('dlq_messages_recovered', len(sent))
+                if settled:
+                    LocalSQS.delete_message_batch(self.dlq_queue, [
+                        {'Id': str(i), 'ReceiptHandle': receipt_handle} for i, receipt_handle in enumerate(settled)
+                    ])
                 
                 # Print DLQ stats periodically
                 total_dlq_processed = self.stats['dlq_messages_recovered'] + self.stats['dlq_messages_discarded']
                 if total_dlq_processed % 5 == 0 and total_dlq_processed > 0:
-                    print(f"DLQ RECOVERY METRICS: {self.stats['dlq_messages_recovered']} recovered, {self.stats['dlq_messages_discarded']} discarded")
+                    recovered, discarded = self.stats['dlq_messages_recovered'], self.stats['dlq_messages_discarded']
+                    self.log.message('dlq_progress', "DLQ RECOVERY METRICS: %d recovered, %d discarded",
+                                     recovered, discarded, recovered=recovered, discarded=discarded)
                 
             except Exception as e:
                 if self.running:
-                    print(f"DLQ Worker error: {e}")
+                    self.log.error('worker_error', "DLQ Worker error: %s", e, worker='dlq_recovery', error=str(e))
                 time.sleep(2)
     
+    def plan_dlq_recovery(self, message):
+        """Recovery strategy for one DLQ message: a delayed send_message_batch entry
+        paired with the DLQ receipt handle, or None when the message is discarded
+        """
+        message_data = json.loads(message['Body'])
+        difficulty = message_data.get('processing_difficulty', 'unknown')
+        event_type = message_data.get('event_type', 'unknown')
+        idempotency_key = message_data.get('idempotency_key', 'unknown')
+        attempt = message_data.get('retry_attempt', 0)
+        
+        self.log.message('failure_analysis', "FAILURE ANALYSIS: %s | %s | difficulty: %s",
+                         idempotency_key, event_type, difficulty,
+                         idempotency_key=idempotency_key, difficulty=difficulty)
+        
+        # Recovery strategies based on failure type
+        if difficulty == 'error':
+            # Strategy 1: Discard permanent errors
+            self.log.message('dlq_discard', "RECOVERY STRATEGY: DISCARD permanent error: %s",
+                             idempotency_key, idempotency_key=idempotency_key)
+            self.stats.increment('dlq_messages_discarded')
+            return None
+        
+        if attempt >= self.max_retry_attempts:
+            # Strategy 2: Stop retrying what keeps failing
+            self.log.message('dlq_exhausted', "RECOVERY STRATEGY: DISCARD after %d retries: %s",
+                             attempt, idempotency_key, idempotency_key=idempotency_key, retry_attempt=attempt)
+            self.stats.increment('dlq_messages_discarded')
+            self.stats.increment('dlq_retries_exhausted')
+            return None
+        
+        if difficulty in ['hard', 'medium']:
+            # Strategy 3: Retry with reduced difficulty
+            self.log.message('dlq_retry', "RECOVERY STRATEGY: RETRY with reduced complexity: %s",
+                             idempotency_key, idempotency_key=idempotency_key)
+            message_data['processing_difficulty'] = 'easy'
+        else:
+            # Strategy 4: Requeue unchanged (transient failures)
+            self.log.message('dlq_requeue', "RECOVERY STRATEGY: REQUEUE unchanged: %s",
+                             idempotency_key, idempotency_key=idempotency_key)
+        
+        # Jittered exponential backoff: a downstream outage is not hit again by
+        # every failed message at once
+        message_data['retry_attempt'] = attempt + 1
+        delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+        self.log.message('dlq_backoff', "   BACKOFF: retry %d of %s in %.2fs",
+                         attempt + 1, idempotency_key, delay,
+                         idempotency_key=idempotency_key, retry_attempt=attempt + 1, delay=delay)
+        attributes = {
+            'retry_attempt': {'StringValue': str(message_data['retry_attempt']), 'DataType': 'Number'}
+        }
+        if 'school_id' in message_data:
+            # Retries stay in their tenant's sub-queue on a fair main queue
+            attributes['school_id'] = {'StringValue': message_data['school_id'], 'DataType': 'String'}
+        entry = {
+            'Id': message['Id'],
+            'MessageBody': json.dumps(message_data),
+            'MessageAttributes': attributes,
+            'DelaySeconds': delay
+        }
+        return entry, message['ReceiptHandle']
+    
     def run_comprehensive_demo(self):
         """Run the complete demonstration"""
+        self.log_pipeline.flush()  # keep queued log lines ahead of the banner
         print("=" * 70)
         print("COMPREHENSIVE ANTI-STAMPEDE + DLQ + IDEMPOTENCY POC")
         print("=" * 70)
@@ -312,13 +702,13 @@ class ComprehensivePOC:
             # Wait for producer to complete
             producer_future.result()
             
-            print(f"\nProducer finished. Letting workers process remaining messages...")
+            self.log.info('producer_done', "\nProducer finished. Letting workers process remaining messages...")
             
             # Let workers process for 15 seconds
             time.sleep(15)
             
             # Stop workers gracefully
-            print(f"\nStopping workers...")
+            self.log.info('stopping', "\nStopping workers...")
             self.running = False
             
             # Give workers time to finish current operations
@@ -327,8 +717,25 @@ class ComprehensivePOC:
         # Print comprehensive final statistics
         self.print_final_results()
     
+    def print_latency_summary(self):
+        """p50/p99 of the worker histograms and the busiest emulator operations"""
+        print(f"\nLATENCY (p50 / p99 / p999):")
+        histograms = [(name, METRICS.histogram(name, **labels)) for name, labels in (
+            ('worker_batch_seconds', {'worker': 'idempotent'}),
+            ('process_message_seconds', {}),
+        )]
+        for (_, name, labels), metric in sorted(list(METRICS.metrics.items()), key=lambda entry: entry[0][1:]):
+            if name == 'emulator_call_seconds':
+                histograms.append((f"{metric.labels['service']}.{metric.labels['operation']}", metric))
+        for label, histogram in histograms:
+            summary = histogram.summary()
+            if summary['count']:
+                print(f"   {label:<34} {summary['p50'] * 1000:8.2f} / {summary['p99'] * 1000:8.2f} / "
+                      f"{summary['p999'] * 1000:8.2f} ms  ({summary['count']} calls)")
+    
     def print_final_results(self):
         """Print comprehensive final statistics"""
+        self.log_pipeline.flush()
         print(f"\n" + "=" * 70)
         print(f"COMPREHENSIVE POC DEMONSTRATION COMPLETE")
         print(f"=" * 70)
@@ -337,9 +744,35 @@ class ComprehensivePOC:
         print(f"   Messages produced: {self.stats['messages_produced']}")
         print(f"   Messages processed successfully: {self.stats['messages_processed']}")
         print(f"   Duplicates detected and prevented: {self.stats['duplicates_detected']}")
+        print(f"   Deliveries deferred (claimed by another worker): {self.stats['claims_in_progress']}")
         print(f"   Processing errors (sent to DLQ): {self.stats['processing_errors']}")
         print(f"   DLQ messages recovered: {self.stats['dlq_messages_recovered']}")
-        print(f"   DLQ messages discarded: {self.stats['dlq_messages_discarded']}")
+        print(f"   DLQ messages discarded: {self.stats['dlq_messages_discarded']} "
+              f"({self.stats['dlq_retries_exhausted']} after {self.max_retry_attempts} retries)")
+        
+        table = EmulatorRegistry.get_table(self.table_name)
+        if table:
+            table_stats = table.expiry_stats()
+            print(f"   Idempotency table: {table_stats['live']} live, {table_stats['pending']} pending expiry, "
+                  f"{table_stats['expired']} expired, {table_stats['evicted']} evicted")
+        if self.rate_controller:
+            control = self.rate_controller.summary()
+            print(f"   Producer backpressure: final limit {control['rate']:.0f} msg/sec, peak queue depth "
+                  f"{control['peak_depth']} ({control['increases']} increases, {control['holds']} holds, "
+                  f"{control['decreases']} decreases)")
+        if self.idempotency_cache:
+            cache_stats = self.idempotency_cache.stats
+            print(f"   Idempotency cache: {self.idempotency_cache.hit_rate() * 100:.1f}% hit rate "
+                  f"({cache_stats['hits']} hits, {cache_stats['negative_hits']} negative hits, "
+                  f"{cache_stats['misses']} misses, {cache_stats['evictions']} evictions)")
+        log_stats = self.log_pipeline.stats()
+        suppressed = log_stats['sampled_out'] + log_stats['rate_limited'] + log_stats['dropped']
+        if suppressed:
+            print(f"   Log lines: {log_stats['written']:.0f} written in {log_stats['batches']:.0f} batches, "
+                  f"{log_stats['sampled_out']:.0f} sampled out, {log_stats['rate_limited']:.0f} rate limited, "
+                  f"{log_stats['dropped']:.0f} dropped (queue full)")
+        if METRICS.enabled:
+            self.print_latency_summary()
         
         total_successful = self.stats['messages_processed'] + self.stats['dlq_messages_recovered']
         success_rate = (total_successful / self.stats['messages_produced']) * 100 if self.stats['messages_produced'] > 0 else 0
@@ -372,5 +805,21 @@ class ComprehensivePOC:
         print(f"\nSUCCESS: All critical distributed systems patterns working together!")
 
 if __name__ == "__main__":
-    poc = ComprehensivePOC()
+    parser = argparse.ArgumentParser(description="Run the comprehensive POC demonstration")
+    parser.add_argument('--metrics-dir', help="Write Prometheus and CloudWatch EMF metrics here at the end")
+    parser.add_argument('--log-mode', choices=LOG_MODES, default='console',
+                        help="console: plain lines, json: structured lines, quiet: periodic aggregates only")
+    parser.add_argument('--log-sample-rate', type=float, default=1.0, help="Fraction of per-message lines kept")
+    parser.add_argument('--log-max-per-second', type=float, help="Cap on per-message lines per second")
+    parser.add_argument('--fair-scheduling', action='store_true',
+                        help="Serve the main queue round-robin per school_id instead of oldest-first")
+    parser.add_argument('--server-socket',
+                        help="Use the queues and tables of an emulator server (python queue_server.py) instead "
+                             "of in-process ones, e.g. shared with other worker processes")
+    args = parser.parse_args()
+    poc = ComprehensivePOC(server_socket=args.server_socket, log_mode=args.log_mode,
+                           log_sample_rate=args.log_sample_rate, log_max_per_second=args.log_max_per_second,
+                           fair_scheduling=args.fair_scheduling)
     poc.run_comprehensive_demo()
+    if args.metrics_dir:
+        poc.export_metrics(args.metrics_dir)
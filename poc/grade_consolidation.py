@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Grade Consolidation - ADR-007's nightly job over the emulated single table,
+vectorized with NumPy and resumable from a checkpoint
+
+CRITICAL FEATURES IMPLEMENTED:
+
+1. PAGED INPUT, VECTORIZED GRADES:
+   - Unconsolidated evaluations are read with a paged Scan filtered on
+     consolidated = false, a chunk of pages at a time
+   - Each chunk is loaded into NumPy arrays and grouped by
+     (tenant, student, subject, period) with per-type sums and counts
+     computed by bincount instead of a Python loop per group
+   - Weighted grade = tenant-weighted mean of the per-type averages,
+     renormalized over the types a student actually has, then rounded
+
+2. INCREMENTAL AND BATCHED OUTPUT:
+   - GRADE#subject#period items keep per-type sums and counts, so a later
+     run folds new evaluations into the stored grade instead of re-reading
+     evaluations that are already consolidated
+   - Existing grades are read with BatchGetItem and written with
+     BatchWriteItem (unprocessed items are retried)
+   - Consolidated flags are set with UpdateItem conditioned on the score and
+     type the chunk read, sent as pipelines of up to 1000 calls; an evaluation
+     rewritten meanwhile keeps its own write and stays pending instead of being
+     overwritten by the scanned copy
+
+3. CHECKPOINTED, RESUMABLE:
+   - A checkpoint item records the scan position after every chunk
+   - Every grade records the chunk that last changed it and the evaluations
+     (SK and score) it folded in, so replaying a chunk after a crash never
+     counts an evaluation twice, even one the replay reads into the next chunk,
+     and only flags the evaluations the grade has
+   - run(time_budget=...) stops between chunks, e.g. ahead of the Lambda
+     timeout; the next run resumes where it stopped
+
+HOW IT WORKS:
+- Items follow ADR-003: PK=TENANT#t#STUDENT#s, SK=EVAL#subject#period#id with
+  evaluation_type (S), score (N) and consolidated (BOOL)
+- Tenant rules live at PK=TENANT#t#CONFIG, SK=GRADING_RULES (weights map and
+  decimals); DEFAULT_RULES applies to tenants without one
+- GradeConsolidationEngine(table_name).run() consolidates everything pending
+- RunningGrades is the streaming alternative: a change_stream.StreamConsumer
+  handler that keeps the same grades current per write (SimpleTable.enable_stream)
+"""
+
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from robust_emulators import ConditionalCheckFailedException, LocalDynamoDB, pipelined
+
+DEFAULT_RULES = {'weights': {'exam': 0.7, 'homework': 0.2, 'quiz': 0.1}, 'decimals': 1}
+CHECKPOINT_KEY = {'PK': {'S': 'JOB#grade-consolidation'}, 'SK': {'S': 'CHECKPOINT'}}
+_BATCH_GET_LIMIT = 100  # DynamoDB BatchGetItem keys per call
+_BATCH_WRITE_LIMIT = 25  # DynamoDB BatchWriteItem requests per call
+_PIPELINE_LIMIT = 1000  # conditional updates sent per pipeline
+
+def load_rules(table_name: str, tenant: str) -> Dict:
+    """A tenant's grading rules from its config item, DEFAULT_RULES without one"""
+    item = LocalDynamoDB.get_item(table_name, {'PK': {'S': f'TENANT#{tenant}#CONFIG'},
+                                               'SK': {'S': 'GRADING_RULES'}}).get('Item')
+    if not item:
+        return DEFAULT_RULES
+    return {
+        'weights': {name: float(value['N']) for name, value in item['weights']['M'].items()},
+        'decimals': int(item.get('decimals', {'N': DEFAULT_RULES['decimals']})['N'])
+    }
+
+class GradeConsolidationEngine:
+    def __init__(self, table_name: str, page_size: int = 1000, chunk_size: int = 50000):
+        self.table_name = table_name
+        self.page_size = page_size  # items read per Scan call
+        self.chunk_size = chunk_size  # items read per chunk, consolidated together
+        self.rules_cache = {}  # tenant -> rules
+
+    # Table access
+
+    def _batch_get(self, keys: List[Dict]) -> List[Dict]:
+        items = []
+        for start in range(0, len(keys), _BATCH_GET_LIMIT):
+            request_items = {self.table_name: {'Keys': keys[start:start + _BATCH_GET_LIMIT]}}
+            while request_items:
+                response = LocalDynamoDB.batch_get_item(request_items)
+                items.extend(response['Responses'].get(self.table_name, []))
+                request_items = response['UnprocessedKeys']
+        return items
+
+    def _batch_put(self, items: List[Dict]):
+        for start in range(0, len(items), _BATCH_WRITE_LIMIT):
+            request_items = {self.table_name: [{'PutRequest': {'Item': item}}
+                                               for item in items[start:start + _BATCH_WRITE_LIMIT]]}
+            while request_items:
+                request_items = LocalDynamoDB.batch_write_item(request_items)['UnprocessedItems']
+
+    def _rules(self, tenant: str) -> Dict:
+        rules = self.rules_cache.get(tenant)
+        if rules is None:
+            rules = self.rules_cache[tenant] = load_rules(self.table_name, tenant)
+        return rules
+
+    def load_checkpoint(self) -> Dict:
+        item = LocalDynamoDB.get_item(self.table_name, CHECKPOINT_KEY).get('Item')
+        if not item:
+            return {'next_chunk': 1, 'last_key': None, 'status': 'COMPLETE'}
+        return {
+            'next_chunk': int(item['next_chunk']['N']),
+            'last_key': json.loads(item['last_key']['S']) if 'last_key' in item else None,
+            'status': item['status']['S']
+        }
+
+    def _save_checkpoint(self, next_chunk: int, last_key: Optional[Dict], status: str):
+        item = dict(CHECKPOINT_KEY, next_chunk={'N': str(next_chunk)}, status={'S': status},
+                    updated_at={'N': str(int(time.time()))})
+        if last_key:
+            item['last_key'] = {'S': json.dumps(last_key)}
+        LocalDynamoDB.put_item(self.table_name, item)
+
+    def _read_chunk(self, start_key: Optional[Dict]) -> Tuple[List[Dict], Optional[Dict], int]:
+        """Pending evaluations in the next chunk_size items read; returns (evaluations,
+        key to resume after, items read)
+
+        The boundary depends on items read, not items matched, so flags flipped before
+        a crash do not move it; grades written before a crash can move it earlier,
+        which consolidate() allows for.
+        """
+        evaluations = []
+        scanned = 0
+        last_key = start_key
+        while scanned < self.chunk_size:
+            response = LocalDynamoDB.scan(self.table_name, 'consolidated = :false', {':false': {'BOOL': False}},
+                                          limit=min(self.page_size, self.chunk_size - scanned),
+                                          exclusive_start_key=last_key)
+            evaluations.extend(response['Items'])
+            scanned += response['ScannedCount']
+            last_key = response.get('LastEvaluatedKey')
+            if last_key is None:
+                break
+        return evaluations, last_key, scanned
+
+    # Vectorized consolidation
+
+    @staticmethod
+    def _arrays(evaluations: List[Dict]):
+        """Group index, type index and score per evaluation, plus the group keys and type names"""
+        group_keys = []
+        types = []
+        scores = np.empty(len(evaluations))
+        for i, item in enumerate(evaluations):
+            _, subject, period, _ = item['SK']['S'].split('#', 3)
+            group_keys.append(f"{item['PK']['S']}\nGRADE#{subject}#{period}")
+            types.append(item['evaluation_type']['S'])
+            scores[i] = float(item['score']['N'])
+        groups, group_index = np.unique(np.array(group_keys), return_inverse=True)
+        type_names, type_index = np.unique(np.array(types), return_inverse=True)
+        return [key.split('\n') for key in groups.tolist()], group_index, type_names.tolist(), type_index, scores
+
+    def consolidate(self, evaluations: List[Dict], chunk: int) -> Dict:
+        """Fold one chunk of pending evaluations into their GRADE items and flag them"""
+        timings = {}
+        started = time.perf_counter()
+        group_keys, group_index, type_names, type_index, scores = self._arrays(evaluations)
+        group_count, type_count = len(group_keys), len(type_names)
+        cells = group_index * type_count + type_index
+        sums = np.bincount(cells, weights=scores, minlength=group_count * type_count).reshape(group_count, type_count)
+        counts = np.bincount(cells, minlength=group_count * type_count).reshape(group_count, type_count)
+        timings['load'] = time.perf_counter() - started
+
+        # Fold in the sums stored by earlier chunks; a grade that already carries this
+        # chunk (a replay after a crash) is left as it is
+        started = time.perf_counter()
+        position = {(pk, sk): i for i, (pk, sk) in enumerate(group_keys)}
+        applied = np.zeros(group_count, dtype=bool)
+        folded = {}  # group of a stored grade -> {evaluation SK: score} it last folded in
+        for item in self._batch_get([{'PK': {'S': pk}, 'SK': {'S': sk}} for pk, sk in group_keys]):
+            i = position[(item['PK']['S'], item['SK']['S'])]
+            folded[i] = {sk: float(score['N']) for sk, score in item.get('applied_evaluations', {})
+                         .get('M', {}).items()}
+            if int(item['applied_chunk']['N']) >= chunk:
+                applied[i] = True
+                continue
+            for attribute in item:
+                if not attribute.endswith('_count') or attribute == 'evaluation_count':
+                    continue
+                name = attribute[:-len('_count')]
+                if name not in type_names:  # only seen in earlier chunks
+                    type_names.append(name)
+                    sums = np.hstack([sums, np.zeros((group_count, 1))])
+                    counts = np.hstack([counts, np.zeros((group_count, 1), dtype=counts.dtype)])
+                t = type_names.index(name)
+                sums[i, t] += float(item[f'{name}_sum']['N'])
+                counts[i, t] += int(item[attribute]['N'])
+        # The grades an interrupted chunk wrote move the replay's boundary (they are
+        # scanned items too), so its last evaluations can land in this chunk: those a
+        # stored grade already folded in are in its sums, and are taken out of the chunk's
+        for item, i, t in zip(evaluations, group_index.tolist(), type_index.tolist()):
+            if i in folded and not applied[i] and folded[i].get(item['SK']['S']) == float(item['score']['N']):
+                sums[i, t] -= folded[i][item['SK']['S']]
+                counts[i, t] -= 1
+        timings['merge'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        tenant_names, tenant_index = np.unique(np.array([pk.split('#', 2)[1] for pk, _ in group_keys]),
+                                               return_inverse=True)
+        tenant_rules = [self._rules(tenant) for tenant in tenant_names.tolist()]
+        weights = np.array([[rules['weights'].get(name, 0.0) for name in type_names]
+                            for rules in tenant_rules])[tenant_index] * (counts > 0)
+        means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        total_weight = weights.sum(axis=1)
+        grades = np.divide((weights * means).sum(axis=1), total_weight,
+                           out=np.zeros(group_count), where=total_weight > 0)
+        scale = 10.0 ** np.array([rules['decimals'] for rules in tenant_rules])[tenant_index]
+        grades = np.round(grades * scale) / scale
+        timings['compute'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        now = str(int(time.time()))
+        totals = counts.sum(axis=1)
+        chunk_evaluations = [{} for _ in range(group_count)]  # group -> {evaluation SK: score value}
+        for item, i in zip(evaluations, group_index.tolist()):
+            chunk_evaluations[i][item['SK']['S']] = item['score']
+        grade_items = []
+        for i in np.flatnonzero(~applied).tolist():
+            pk, sk = group_keys[i]
+            item = {
+                'PK': {'S': pk},
+                'SK': {'S': sk},
+                'consolidated_score': {'N': repr(float(grades[i]))},
+                'evaluation_count': {'N': str(int(totals[i]))},
+                'applied_chunk': {'N': str(chunk)},
+                'applied_evaluations': {'M': chunk_evaluations[i]},
+                'last_calculated': {'N': now}
+            }
+            for t in np.flatnonzero(counts[i]).tolist():
+                item[f'{type_names[t]}_sum'] = {'N': repr(float(sums[i, t]))}
+                item[f'{type_names[t]}_count'] = {'N': str(int(counts[i, t]))}
+            grade_items.append(item)
+        # Grades first, flags second: a crash in between leaves the flags unset and
+        # the replay finds the grades already carrying this chunk
+        self._batch_put(grade_items)
+        # On a replay, evaluations written since the grade was (e.g. after the crash)
+        # are not in it: they stay pending for the next run
+        flagged = self._flag([item for item, i in zip(evaluations, group_index.tolist())
+                              if not applied[i] or folded[i].get(item['SK']['S']) == float(item['score']['N'])])
+        timings['write'] = time.perf_counter() - started
+        return {'groups': group_count, 'grades_written': len(grade_items), 'flagged': flagged,
+                'flags_skipped': len(evaluations) - flagged, 'timings': timings}
+
+    def _flag(self, evaluations: List[Dict]) -> int:
+        """Mark evaluations consolidated unless their score or type changed since they
+        were read; a changed evaluation keeps the newer write and stays pending. Returns
+        the number flagged
+
+        BatchWriteItem has no conditions, so each flag is its own UpdateItem; they go
+        out _PIPELINE_LIMIT at a time, one round trip each with a server connected.
+        """
+        flagged = 0
+        for start in range(0, len(evaluations), _PIPELINE_LIMIT):
+            outcomes = pipelined([(LocalDynamoDB.update_item, (
+                self.table_name, {'PK': evaluation['PK'], 'SK': evaluation['SK']}, 'SET consolidated = :true'
+            ), {
+                'expression_attribute_values': {':true': {'BOOL': True}, ':score': evaluation['score'],
+                                                ':type': evaluation['evaluation_type']},
+                'condition_expression': 'score = :score AND evaluation_type = :type'
+            }) for evaluation in evaluations[start:start + _PIPELINE_LIMIT]], return_exceptions=True)
+            for outcome in outcomes:
+                if isinstance(outcome, ConditionalCheckFailedException):
+                    continue
+                if isinstance(outcome, Exception):
+                    raise outcome
+                flagged += 1
+        return flagged
+
+    def run(self, time_budget: float = None, max_chunks: int = None) -> Dict:
+        """Consolidate pending evaluations from the checkpoint on; stops between chunks
+        once time_budget seconds have passed or max_chunks chunks are done
+        """
+        started = time.perf_counter()
+        checkpoint = self.load_checkpoint()
+        chunk = checkpoint['next_chunk']
+        # A finished run leaves no position: the next one scans from the start
+        last_key = checkpoint['last_key'] if checkpoint['status'] == 'RUNNING' else None
+        summary = {'evaluations': 0, 'scanned': 0, 'groups': 0, 'grades_written': 0, 'flags_skipped': 0,
+                   'chunks': 0, 'resumed': last_key is not None,
+                   'timings': {'scan': 0.0, 'load': 0.0, 'merge': 0.0, 'compute': 0.0, 'write': 0.0}}
+        self.rules_cache = {}
+
+        while True:
+            scan_started = time.perf_counter()
+            evaluations, next_key, scanned = self._read_chunk(last_key)
+            summary['timings']['scan'] += time.perf_counter() - scan_started
+            summary['scanned'] += scanned
+            if evaluations:
+                result = self.consolidate(evaluations, chunk)
+                summary['evaluations'] += len(evaluations)
+                summary['groups'] += result['groups']
+                summary['grades_written'] += result['grades_written']
+                summary['flags_skipped'] += result['flags_skipped']
+                for phase, seconds in result['timings'].items():
+                    summary['timings'][phase] += seconds
+            chunk += 1
+            summary['chunks'] += 1
+            last_key = next_key
+            self._save_checkpoint(chunk, last_key, 'RUNNING' if last_key else 'COMPLETE')
+            if last_key is None:
+                summary['status'] = 'COMPLETE'
+                break
+            if (time_budget is not None and time.perf_counter() - started >= time_budget) or \
+                    (max_chunks is not None and summary['chunks'] >= max_chunks):
+                summary['status'] = 'PARTIAL'
+                break
+        summary['seconds'] = time.perf_counter() - started
+        return summary
+
+class RunningGrades:
+    """Per-student weighted grades kept current from the table's change stream
+
+    Holds per-type sums and counts for every (student PK, GRADE#subject#period)
+    over the evaluations stored in the table. apply() is a StreamConsumer handler:
+    each evaluation record subtracts its old image and adds its new one, so
+    inserts, score corrections and deletes cost O(1) each instead of a rescan.
+    Removals by TTL expiry, eviction or tiering (a Service userIdentity) are
+    removals like any other, so the grades always match what rebuild(), the
+    fallback when a consumer has fallen behind the stream, computes from a full
+    scan. Records at or below the last sequence number applied for their shard
+    are skipped, so a batch handed over again (e.g. after a handler error, or
+    from a consumer resumed at an older checkpoint) is not counted twice.
+    """
+    def __init__(self, table_name: str, page_size: int = 1000):
+        self.table_name = table_name
+        self.page_size = page_size  # items read per Scan call by rebuild
+        self.totals = {}  # (pk, grade sk) -> {evaluation type: [sum, count]}
+        self.changed = set()  # groups whose grade may have changed since take_changed
+        self.applied = {}  # stream shard id -> sequence number of the last record applied
+        self.rules_cache = {}  # tenant -> rules
+
+    def _rules(self, tenant: str) -> Dict:
+        rules = self.rules_cache.get(tenant)
+        if rules is None:
+            rules = self.rules_cache[tenant] = load_rules(self.table_name, tenant)
+        return rules
+
+    def _add(self, image: Dict, sign: int):
+        """Fold one evaluation image in (sign 1) or out (sign -1); other items are ignored"""
+        sk = image['SK']['S']
+        if not sk.startswith('EVAL#') or 'score' not in image:
+            return
+        _, subject, period, _ = sk.split('#', 3)
+        group = (image['PK']['S'], f'GRADE#{subject}#{period}')
+        types = self.totals.setdefault(group, {})
+        evaluation_type = image['evaluation_type']['S']
+        totals = types.setdefault(evaluation_type, [0.0, 0])
+        totals[0] += sign * float(image['score']['N'])
+        totals[1] += sign
+        if not totals[1]:
+            del types[evaluation_type]
+            if not types:
+                del self.totals[group]
+        self.changed.add(group)
+
+    def apply(self, records: List[Dict]):
+        for record in records:
+            change = record['dynamodb']
+            shard_id = record['eventID'].rsplit('-', 1)[0]
+            sequence = int(change['SequenceNumber'])
+            if sequence <= self.applied.get(shard_id, -1):
+                continue  # applied from an earlier delivery of this batch
+            self.applied[shard_id] = sequence
+            old, new = change.get('OldImage'), change.get('NewImage')
+            if change['Keys']['SK'].get('S') == 'GRADING_RULES':
+                tenant = change['Keys']['PK']['S'].split('#', 2)[1]
+                self.rules_cache.pop(tenant, None)
+                self.changed.update(group for group in self.totals if group[0].startswith(f'TENANT#{tenant}#'))
+                continue
+            if old is not None and new is not None and old.get('score') == new.get('score') and \
+                    old.get('evaluation_type') == new.get('evaluation_type'):
+                continue  # e.g. the consolidated flag flipped: the grade is unchanged
+            if old is not None:
+                self._add(old, -1)
+            if new is not None:
+                self._add(new, 1)
+
+    def grade(self, pk: str, grade_sk: str) -> Optional[float]:
+        """Weighted grade of one group, as GradeConsolidationEngine computes it; None
+        when the group has no evaluations
+        """
+        types = self.totals.get((pk, grade_sk))
+        if not types:
+            return None
+        rules = self._rules(pk.split('#', 2)[1])
+        weighted = total_weight = 0.0
+        for name in sorted(types):
+            total, count = types[name]
+            weight = rules['weights'].get(name, 0.0)
+            weighted += weight * (total / count)
+            total_weight += weight
+        grade = weighted / total_weight if total_weight > 0 else 0.0
+        scale = 10.0 ** rules['decimals']
+        return round(grade * scale) / scale
+
+    def grades(self) -> Dict[Tuple[str, str], float]:
+        return {group: self.grade(*group) for group in self.totals}
+
+    def take_changed(self) -> Dict[Tuple[str, str], Optional[float]]:
+        """Current grades of the groups changed since the last call (None: no
+        evaluations left), e.g. to write only those GRADE items
+        """
+        changed, self.changed = self.changed, set()
+        return {group: self.grade(*group) for group in changed}
+
+    def rebuild(self) -> int:
+        """Recompute every group from a full scan of the table; returns the items scanned"""
+        self.totals = {}
+        self.rules_cache = {}
+        scanned, last_key = 0, None
+        while True:
+            response = LocalDynamoDB.scan(self.table_name, limit=self.page_size, exclusive_start_key=last_key)
+            for item in response['Items']:
+                self._add(item, 1)
+            scanned += response['ScannedCount']
+            last_key = response.get('LastEvaluatedKey')
+            if last_key is None:
+                break
+        self.changed = set(self.totals)
+        return scanned
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Metrics - Thread-safe counters, gauges and latency histograms with CloudWatch EMF
+and Prometheus export
+
+CRITICAL FEATURES IMPLEMENTED:
+
+1. LOW-OVERHEAD, THREAD-SAFE RECORDING:
+   - Counters and histograms are sharded per thread: each thread only writes
+     its own cell, so recording takes no lock; reads sum the shards
+   - Gauges are callbacks sampled at export time, never on the hot path
+   - Instrumentation checks one flag; with metrics disabled an instrumented
+     call costs a single attribute read
+
+2. HDR-STYLE LATENCY HISTOGRAMS:
+   - Fixed log-linear buckets (4 per power of two, about 19% wide) from 1us to
+     over an hour, indexed in O(1) with frexp
+   - p50 / p99 / p999 estimates without storing samples
+
+3. EXPORT:
+   - CloudWatch Embedded Metric Format: one JSON line per metric and label set
+   - Prometheus text exposition format (counters, gauges, cumulative buckets)
+
+HOW IT WORKS:
+- MetricsRegistry: named metrics with labels; METRICS is the process-wide one
+- CounterSet: dict-like view over a group of counters, for stats tables that
+  several threads update
+- The emulator clients (LocalSQS / LocalDynamoDB) record per-operation latency
+  and errors into METRICS; the demo workers add queue and batch metrics
+"""
+
+import json
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+_SUB_BUCKETS = 4  # per power of two
+_MIN_VALUE = 1e-6  # seconds; smaller values land in the first bucket
+_BUCKETS = 34 * _SUB_BUCKETS  # up to 2**33 us (about 2.4 hours)
+_INF_BOUND = 'le="+Inf"'
+
+def _bucket_index(value: float) -> int:
+    if value <= _MIN_VALUE:
+        return 0
+    mantissa, exponent = math.frexp(value / _MIN_VALUE)  # mantissa in [0.5, 1)
+    index = exponent * _SUB_BUCKETS + int((mantissa - 0.5) * 2 * _SUB_BUCKETS)
+    return index if index < _BUCKETS else _BUCKETS - 1
+
+def _bucket_upper_bound(index: int) -> float:
+    exponent, sub_bucket = divmod(index, _SUB_BUCKETS)
+    return (0.5 + (sub_bucket + 1) / (2 * _SUB_BUCKETS)) * 2.0 ** exponent * _MIN_VALUE
+
+def _labels_text(labels: Dict[str, str], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in labels.items()]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class Counter:
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self._cells = {}  # thread ident -> count; only the owning thread writes its cell
+
+    def inc(self, amount: float = 1):
+        ident = threading.get_ident()
+        cells = self._cells
+        cells[ident] = cells.get(ident, 0) + amount
+
+    @property
+    def value(self) -> float:
+        return sum(list(self._cells.values()))
+
+class Gauge:
+    def __init__(self, name: str, labels: Dict[str, str], callback: Callable[[], Optional[float]]):
+        self.name = name
+        self.labels = labels
+        self.callback = callback  # sampled at export; None means "no value right now"
+
+    @property
+    def value(self) -> Optional[float]:
+        try:
+            return self.callback()
+        except Exception:
+            return None
+
+class Histogram:
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self._shards = {}  # thread ident -> bucket counts, with the running sum in the last slot
+
+    def observe(self, value: float):
+        shard = self._shards.get(threading.get_ident())
+        if shard is None:
+            shard = self._shards[threading.get_ident()] = [0] * (_BUCKETS + 1)
+        shard[_bucket_index(value)] += 1
+        shard[_BUCKETS] += value
+
+    def time(self):
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+    def snapshot(self) -> List[float]:
+        """Merged bucket counts with the sum in the last slot"""
+        merged = [0] * (_BUCKETS + 1)
+        for shard in list(self._shards.values()):
+            for index, count in enumerate(shard):
+                if count:
+                    merged[index] += count
+        return merged
+
+    @staticmethod
+    def _quantile(counts: List[float], total: int, fraction: float) -> float:
+        rank = fraction * total
+        seen = 0
+        for index in range(_BUCKETS):
+            seen += counts[index]
+            if seen >= rank and seen:
+                return _bucket_upper_bound(index)
+        return 0.0
+
+    def summary(self) -> Dict[str, float]:
+        counts = self.snapshot()
+        total = int(sum(counts[:_BUCKETS]))
+        return {
+            'count': total,
+            'sum': counts[_BUCKETS],
+            'p50': self._quantile(counts, total, 0.50),
+            'p99': self._quantile(counts, total, 0.99),
+            'p999': self._quantile(counts, total, 0.999),
+        }
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+class MetricsRegistry:
+    def __init__(self, namespace: str = 'AntiStampedePOC', enabled: bool = False):
+        self.namespace = namespace
+        self.enabled = enabled  # checked by instrumentation before recording anything
+        self.metrics = {}  # (kind, name, sorted labels) -> metric
+        self.lock = threading.Lock()  # guards registration only
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def _get(self, kind, name: str, labels: Dict[str, str], *args):
+        key = (kind, name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = kind(name, dict(sorted(labels.items())), *args)
+        return metric
+
+    def register(self, metric):
+        """Add a metric, replacing any registered under the same name and labels"""
+        with self.lock:
+            self.metrics[(type(metric), metric.name, tuple(sorted(metric.labels.items())))] = metric
+        return metric
+
+    def counter(self, name: str, **labels) -> Counter:
+        return self._get(Counter, name, labels)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        return self._get(Histogram, name, labels)
+
+    def gauge(self, name: str, callback: Callable[[], Optional[float]], **labels) -> Gauge:
+        gauge = self._get(Gauge, name, labels, callback)
+        gauge.callback = callback  # re-registering replaces the callback
+        return gauge
+
+    def _sorted_metrics(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return sorted(metrics, key=lambda metric: (metric.name, tuple(metric.labels.items())))
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format (seconds for latencies)"""
+        lines = []
+        typed = set()
+        for metric in self._sorted_metrics():
+            kind = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}[type(metric)]
+            if metric.name not in typed:
+                lines.append(f'# TYPE {metric.name} {kind}')
+                typed.add(metric.name)
+            if isinstance(metric, Histogram):
+                counts = metric.snapshot()
+                cumulative = 0
+                for index in range(_BUCKETS):
+                    if not counts[index]:
+                        continue  # empty buckets add nothing to the cumulative series
+                    cumulative += counts[index]
+                    bound = f'le="{_bucket_upper_bound(index):.9g}"'
+                    lines.append(f'{metric.name}_bucket{_labels_text(metric.labels, bound)} {cumulative}')
+                lines.append(f'{metric.name}_bucket{_labels_text(metric.labels, _INF_BOUND)} {cumulative}')
+                lines.append(f'{metric.name}_sum{_labels_text(metric.labels)} {counts[_BUCKETS]:.9g}')
+                lines.append(f'{metric.name}_count{_labels_text(metric.labels)} {cumulative}')
+            else:
+                value = metric.value
+                if value is not None:
+                    lines.append(f'{metric.name}{_labels_text(metric.labels)} {value:.9g}')
+        return '\n'.join(lines) + '\n'
+
+    def to_emf(self) -> List[str]:
+        """CloudWatch Embedded Metric Format JSON lines, one per metric and label set;
+        histograms are emitted as count and p50/p99/p999 in milliseconds
+        """
+        timestamp = int(time.time() * 1000)
+        lines = []
+        for metric in self._sorted_metrics():
+            if isinstance(metric, Histogram):
+                summary = metric.summary()
+                if not summary['count']:
+                    continue
+                values = {f'{metric.name}_count': (summary['count'], 'Count')}
+                for quantile in ('p50', 'p99', 'p999'):
+                    values[f'{metric.name}_{quantile}'] = (summary[quantile] * 1000, 'Milliseconds')
+            else:
+                value = metric.value
+                if value is None:
+                    continue
+                values = {metric.name: (value, 'Count')}
+            document = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [list(metric.labels)],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in values.items()]
+                    }]
+                },
+                **metric.labels,
+                **{name: value for name, (value, _) in values.items()}
+            }
+            lines.append(json.dumps(document, separators=(',', ':')))
+        return lines
+
+class CounterSet:
+    """Dict-like group of counters: stats['x'] reads, stats.increment('x') records
+    
+    Each set starts from zero and takes over the registry entries of any
+    earlier set with the same prefix.
+    """
+    def __init__(self, registry: MetricsRegistry, prefix: str, names: List[str]):
+        self.counters = {name: registry.register(Counter(f'{prefix}_{name}_total', {})) for name in names}
+
+    def increment(self, name: str, amount: float = 1):
+        self.counters[name].inc(amount)
+
+    def __getitem__(self, name: str) -> float:
+        return self.counters[name].value
+
+    def keys(self):
+        return self.counters.keys()
+
+    def items(self):
+        return [(name, counter.value) for name, counter in self.counters.items()]
+
+# Process-wide registry used by the emulators and the demo workers
+METRICS = MetricsRegistry()
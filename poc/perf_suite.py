@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Performance Suite - Hot-path benchmarks for the emulators and the worker pipeline
+with JSON results and regression checks against a stored baseline
+
+CRITICAL FEATURES IMPLEMENTED:
+
+1. HOT-PATH COVERAGE:
+   - Queue: send_message_batch, receive_messages, delete_message
+   - Table: put_item, get_item
+   - Pipeline: producer -> idempotent worker -> DLQ worker, end to end
+   - Queue depths from 1e3 to 1e6 and 1-32 threads; processing sleeps stubbed out
+
+2. COMPARABLE MEASUREMENTS:
+   - Throughput plus p50 / p99 / p999 per-call latency
+   - Every case runs in a fresh process, so peak RSS belongs to that case alone
+   - Each case is repeated and its fastest run kept, damping scheduler noise
+   - Results are written as JSON with the interpreter and machine they came from
+
+3. REGRESSION BASELINES:
+   - Results are compared case by case with a stored baseline
+   - A throughput drop or p99 rise beyond --threshold fails the run (exit code 1)
+
+HOW IT WORKS:
+- Each case is (scenario, depth, threads); depth is the number of messages or
+  items the case works through, split evenly between the threads
+- Pipeline latency is measured per message from send to successful processing
+
+Usage:
+    python perf_suite.py [--profile quick|full] [--scenarios a,b] [--depths N,N] [--threads N,N]
+                         [--repeats N] [--output results.json] [--baseline perf_baseline.json]
+                         [--threshold 0.2] [--p99-floor-us 100] [--save-baseline]
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'perf_baseline.json')
+
+PROFILES = {
+    'quick': {'depths': [1000, 10000], 'threads': [1, 8], 'pipeline_depths': [1000], 'pipeline_threads': [1, 4]},
+    'full': {'depths': [1000, 10000, 100000, 1000000], 'threads': [1, 2, 4, 8, 16, 32],
+             'pipeline_depths': [1000, 10000, 100000], 'pipeline_threads': [1, 4, 16, 32]},
+}
+
+def _split(total, threads):
+    """Per-thread shares of total work"""
+    return [total // threads + (1 if i < total % threads else 0) for i in range(threads)]
+
+def _run_threads(threads, target, shares):
+    """Run target(share, latencies) on each thread after a common start; returns
+    (elapsed seconds, merged latencies in ns)
+    """
+    barrier = threading.Barrier(threads + 1)
+    latencies = [[] for _ in range(threads)]
+
+    def run(index):
+        barrier.wait()
+        target(shares[index], latencies[index])
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, [latency for thread_latencies in latencies for latency in thread_latencies]
+
+def _fresh_queue():
+    from robust_emulators import EmulatorRegistry
+    EmulatorRegistry.queues = {}
+    return EmulatorRegistry.create_queue('perf-queue', visibility_timeout=300)
+
+def _fill_queue(queue_url, depth):
+    from robust_emulators import LocalSQS
+    for start in range(0, depth, 10):
+        LocalSQS.send_message_batch(queue_url, [{'Id': str(i), 'MessageBody': f'message {i}'}
+                                                for i in range(start, min(start + 10, depth))])
+
+def bench_send_batch(depth, threads):
+    from robust_emulators import LocalSQS
+    queue_url = _fresh_queue()
+
+    def send(share, latencies):
+        for start in range(0, share, 10):
+            entries = [{'Id': str(i), 'MessageBody': f'message {i}'} for i in range(min(10, share - start))]
+            began = time.perf_counter_ns()
+            LocalSQS.send_message_batch(queue_url, entries)
+            latencies.append(time.perf_counter_ns() - began)
+
+    elapsed, latencies = _run_threads(threads, send, _split(depth, threads))
+    return depth, elapsed, latencies
+
+def bench_receive(depth, threads):
+    from robust_emulators import LocalSQS
+    queue_url = _fresh_queue()
+    _fill_queue(queue_url, depth)
+
+    def receive(share, latencies):
+        received = 0
+        while received < share:
+            began = time.perf_counter_ns()
+            messages = LocalSQS.receive_message(queue_url, max_messages=min(10, share - received)).get('Messages', [])
+            latencies.append(time.perf_counter_ns() - began)
+            received += len(messages)
+
+    elapsed, latencies = _run_threads(threads, receive, _split(depth, threads))
+    return depth, elapsed, latencies
+
+def bench_delete(depth, threads):
+    from robust_emulators import LocalSQS
+    queue_url = _fresh_queue()
+    _fill_queue(queue_url, depth)
+    handles = []
+    while len(handles) < depth:
+        handles.extend(message['ReceiptHandle'] for message in
+                       LocalSQS.receive_message(queue_url, max_messages=10).get('Messages', []))
+    shares = []
+    offset = 0
+    for share in _split(depth, threads):
+        shares.append(handles[offset:offset + share])
+        offset += share
+
+    def delete(share, latencies):
+        for receipt_handle in share:
+            began = time.perf_counter_ns()
+            LocalSQS.delete_message(queue_url, receipt_handle)
+            latencies.append(time.perf_counter_ns() - began)
+
+    elapsed, latencies = _run_threads(threads, delete, shares)
+    return depth, elapsed, latencies
+
+def _fresh_table():
+    from robust_emulators import EmulatorRegistry
+    EmulatorRegistry.tables = {}
+    EmulatorRegistry.create_table('perf-table')
+    return 'perf-table'
+
+def _item(i):
+    return {'idempotency_key': {'S': f'key_{i}'}, 'status': {'S': 'COMPLETED'},
+            'result': {'S': 'processed'}, 'ttl': {'N': str(int(time.time()) + 86400)}}
+
+def bench_put_item(depth, threads):
+    from robust_emulators import LocalDynamoDB
+    table_name = _fresh_table()
+    shares = []
+    offset = 0
+    for share in _split(depth, threads):
+        shares.append(range(offset, offset + share))
+        offset += share
+
+    def put(share, latencies):
+        for i in share:
+            item = _item(i)
+            began = time.perf_counter_ns()
+            LocalDynamoDB.put_item(table_name, item)
+            latencies.append(time.perf_counter_ns() - began)
+
+    elapsed, latencies = _run_threads(threads, put, shares)
+    return depth, elapsed, latencies
+
+def bench_get_item(depth, threads):
+    from robust_emulators import EmulatorRegistry, LocalDynamoDB
+    table_name = _fresh_table()
+    table = EmulatorRegistry.get_table(table_name)
+    for start in range(0, depth, 1000):
+        table.batch_write([{'PutRequest': {'Item': _item(i)}} for i in range(start, min(start + 1000, depth))])
+    rng = random.Random(7)
+    keys = [{'idempotency_key': {'S': f'key_{rng.randrange(depth)}'}} for _ in range(depth)]
+    shares = []
+    offset = 0
+    for share in _split(depth, threads):
+        shares.append(keys[offset:offset + share])
+        offset += share
+
+    def get(share, latencies):
+        for key in share:
+            began = time.perf_counter_ns()
+            LocalDynamoDB.get_item(table_name, key)
+            latencies.append(time.perf_counter_ns() - began)
+
+    elapsed, latencies = _run_threads(threads, get, shares)
+    return depth, elapsed, latencies
+
+def bench_pipeline(depth, threads):
+    """Producer -> idempotent workers -> DLQ worker with processing sleeps stubbed out;
+    10% of messages fail permanently and are discarded by the DLQ worker
+    """
+    from comprehensive_demo import ComprehensivePOC
+    from robust_emulators import EmulatorRegistry, LocalSQS
+
+    latencies = []
+
+    class StubbedPOC(ComprehensivePOC):
+        def process_message(self, message_data):
+            if message_data['processing_difficulty'] == 'error':
+                raise Exception(f"Intentional processing error for {message_data['event_type']}")
+            latencies.append(time.perf_counter_ns() - message_data['sent_at'])
+            return f"Processed {message_data['event_type']} for student {message_data['student_id']}"
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        poc = StubbedPOC(use_idempotency_cache=True, log_mode='quiet')
+        EmulatorRegistry.get_queue('anti-stampede-poc').visibility_timeout = 0.05
+        rng = random.Random(11)
+
+        workers = [threading.Thread(target=poc.idempotent_worker) for _ in range(threads)]
+        workers.append(threading.Thread(target=poc.dlq_recovery_worker))
+        for worker in workers:
+            worker.start()
+
+        start = time.perf_counter()
+        for batch_num in range(0, depth, 10):
+            entries = []
+            for i in range(batch_num, min(batch_num + 10, depth)):
+                message = {
+                    'student_id': f'student_{rng.randint(1000, 9999)}',
+                    'event_type': rng.choice(['login', 'submit_assignment', 'view_grade', 'chat_message']),
+                    'idempotency_key': f'perf_{i}',
+                    'processing_difficulty': 'error' if rng.random() < 0.10 else 'easy',
+                    'sent_at': time.perf_counter_ns()
+                }
+                entries.append({'Id': str(i), 'MessageBody': json.dumps(message)})
+            LocalSQS.send_message_batch(poc.main_queue, entries)
+
+        def drained():
+            for queue_url in (poc.main_queue, poc.dlq_queue):
+                attributes = LocalSQS.get_queue_attributes(queue_url)['Attributes']
+                if attributes['ApproximateNumberOfMessages'] != '0' or \
+                        attributes['ApproximateNumberOfMessagesNotVisible'] != '0':
+                    return False
+            return True
+
+        while not drained():
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        poc.running = False
+        for worker in workers:
+            worker.join()
+    return depth, elapsed, latencies
+
+SCENARIOS = {
+    'queue.send_batch': bench_send_batch,
+    'queue.receive': bench_receive,
+    'queue.delete': bench_delete,
+    'table.put_item': bench_put_item,
+    'table.get_item': bench_get_item,
+    'pipeline': bench_pipeline,
+}
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_case(scenario, depth, threads):
+    """Run one case (in its own process) and summarize it"""
+    operations, elapsed, latencies = SCENARIOS[scenario](depth, threads)
+    latencies.sort()
+    return {
+        'case': f'{scenario}/depth={depth}/threads={threads}',
+        'scenario': scenario,
+        'depth': depth,
+        'threads': threads,
+        'operations': operations,
+        'seconds': elapsed,
+        'throughput': operations / elapsed if elapsed else 0.0,
+        'calls': len(latencies),
+        'p50_us': _percentile(latencies, 0.50) / 1000,
+        'p99_us': _percentile(latencies, 0.99) / 1000,
+        'p999_us': _percentile(latencies, 0.999) / 1000,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def _cases(args):
+    profile = PROFILES[args.profile]
+    scenarios = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise Exception(f"Unknown scenario: {scenario}")
+        pipeline = scenario == 'pipeline'
+        depths = args.depths or profile['pipeline_depths' if pipeline else 'depths']
+        threads = args.threads or profile['pipeline_threads' if pipeline else 'threads']
+        for depth in depths:
+            for thread_count in threads:
+                yield scenario, depth, thread_count
+
+def compare(results, baseline, threshold, p99_floor_us=100.0):
+    """Regressions of results against baseline: throughput drops and p99 rises beyond threshold;
+    a p99 rise must also exceed p99_floor_us, as sub-millisecond tails jitter run to run
+    """
+    previous = {result['case']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(result['case'])
+        if before is None:
+            continue
+        if result['throughput'] < before['throughput'] * (1 - threshold):
+            regressions.append((result['case'], 'throughput', before['throughput'], result['throughput']))
+        if result['p99_us'] > before['p99_us'] * (1 + threshold) and \
+                result['p99_us'] - before['p99_us'] > p99_floor_us:
+            regressions.append((result['case'], 'p99_us', before['p99_us'], result['p99_us']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulator and pipeline hot-path benchmarks with regression checks")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    parser.add_argument('--scenarios', help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--depths', type=lambda value: [int(depth) for depth in value.split(',')])
+    parser.add_argument('--threads', type=lambda value: [int(count) for count in value.split(',')])
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per case; the fastest is reported")
+    parser.add_argument('--output', default='perf_results.json')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.20,
+                        help="Allowed relative throughput drop / p99 rise (default 0.20 = 20%%)")
+    parser.add_argument('--p99-floor-us', type=float, default=100.0,
+                        help="Ignore p99 rises smaller than this many microseconds")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    args = parser.parse_args()
+
+    results = []
+    spawn = multiprocessing.get_context('spawn')
+    print(f"{'case':<44} {'throughput/s':>12} {'p50 us':>9} {'p99 us':>9} {'p999 us':>9} {'peak RSS MB':>11}")
+    for scenario, depth, threads in _cases(args):
+        runs = []
+        for _ in range(args.repeats):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                runs.append(executor.submit(run_case, scenario, depth, threads).result())
+        result = max(runs, key=lambda run: run['throughput'])
+        results.append(result)
+        print(f"{result['case']:<44} {result['throughput']:>12.0f} {result['p50_us']:>9.1f} "
+              f"{result['p99_us']:>9.1f} {result['p999_us']:>9.1f} {result['peak_rss_mb']:>11.1f}")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'profile': args.profile,
+            'repeats': args.repeats,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.threshold, args.p99_floor_us)
+    if not regressions:
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+        return 0
+    print(f"REGRESSIONS beyond {args.threshold:.0%} against {args.baseline}:")
+    for case, metric, before, after in regressions:
+        print(f"   {case:<44} {metric:<10} {before:>12.1f} -> {after:>12.1f}")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Emulator Persistence - Write-ahead log and snapshots for queues and tables
+
+CRITICAL FEATURES IMPLEMENTED:
+
+1. GROUP-COMMITTED WRITE-AHEAD LOG:
+   - Every queue/table mutation is journaled under the resource's own lock
+   - A background committer writes and fsyncs everything buffered in one go
+   - At most commit_interval of acknowledged writes can be lost on a crash
+
+2. COMPACTED SNAPSHOTS:
+   - Periodic full snapshots, written to a temp file and renamed into place
+   - The log rotates at each snapshot and older segments are deleted
+   - Each resource records the log position it was captured at, so no
+     global pause is needed and replay skips records the snapshot covers
+
+3. FAST RESTART:
+   - Snapshots are loaded straight from a memory-mapped file
+   - Only the log written since the last snapshot is replayed
+   - In-flight messages come back visible, like an expired visibility timeout
+
+HOW IT WORKS:
+- WriteAheadLog: JSON-lines segments named after their first sequence number
+- EmulatorPersistence: recovery, journaling and snapshots for every queue
+  and table in EmulatorRegistry (sharded tables are persisted per shard)
+
+Snapshots are pickles of the emulator's own state: only load directories
+this process (or a trusted one) wrote.
+"""
+
+import gc
+import glob
+import json
+import mmap
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Tuple
+
+from robust_emulators import EmulatorRegistry, ShardedTable, SimpleQueue, pack_item
+
+SNAPSHOT_FILE = 'snapshot.pkl'
+
+class WriteAheadLog:
+    def __init__(self, directory: str, start_lsn: int, commit_interval: float = 0.005):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.next_lsn = start_lsn
+        self.buffer = []  # encoded records waiting for the next group commit
+        self.lock = threading.Lock()  # guards next_lsn and buffer
+        self.write_lock = threading.Lock()  # serializes commits and rotation
+        self.bytes_written = 0
+        self.commits = 0
+        self.segment_bytes = 0
+        self.file = self._open_segment(start_lsn)
+        self._stop = threading.Event()
+        self._committer = threading.Thread(target=self._run_committer, name='wal-committer', daemon=True)
+        self._committer.start()
+
+    @staticmethod
+    def segment_path(directory: str, first_lsn: int) -> str:
+        return os.path.join(directory, f'wal-{first_lsn:020d}.log')
+
+    @staticmethod
+    def segments(directory: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(directory, 'wal-*.log')))
+
+    def _open_segment(self, first_lsn: int):
+        self.segment_bytes = 0
+        return open(self.segment_path(self.directory, first_lsn), 'ab')
+
+    def append(self, resource: str, operation: str, payload) -> int:
+        """Buffer one record; it becomes durable at the next group commit"""
+        with self.lock:
+            lsn = self.next_lsn
+            self.next_lsn += 1
+            self.buffer.append(json.dumps([lsn, resource, operation, payload], separators=(',', ':')))
+            return lsn
+
+    def last_lsn(self) -> int:
+        with self.lock:
+            return self.next_lsn - 1
+
+    def commit(self):
+        """Write and fsync everything buffered so far with a single fsync"""
+        with self.write_lock:
+            with self.lock:
+                buffer, self.buffer = self.buffer, []
+            if not buffer:
+                return
+            data = ('\n'.join(buffer) + '\n').encode()
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.bytes_written += len(data)
+            self.segment_bytes += len(data)
+            self.commits += 1
+
+    def rotate(self) -> List[str]:
+        """Start a new segment at the next sequence number; returns the older segments"""
+        with self.write_lock:
+            with self.lock:
+                buffer, self.buffer = self.buffer, []
+                first_lsn = self.next_lsn
+            if buffer:
+                data = ('\n'.join(buffer) + '\n').encode()
+                self.file.write(data)
+                self.bytes_written += len(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = self._open_segment(first_lsn)
+        current = self.segment_path(self.directory, first_lsn)
+        return [path for path in self.segments(self.directory) if path < current]
+
+    def _run_committer(self):
+        while not self._stop.wait(self.commit_interval):
+            self.commit()
+
+    def close(self):
+        self._stop.set()
+        self._committer.join()
+        self.commit()
+        self.file.close()
+
+def read_segment(path: str) -> Iterator[list]:
+    """Records of one segment; a torn final record from a crash ends the segment"""
+    with open(path, 'rb') as segment:
+        for line in segment:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+class EmulatorPersistence:
+    def __init__(self, directory: str, commit_interval: float = 0.005,
+                 snapshot_interval: float = 60.0, snapshot_wal_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_wal_bytes = snapshot_wal_bytes  # snapshot early once a segment grows past this
+        self.wal = None
+        self.snapshot_bytes = 0
+        self.snapshots = 0
+        self.snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._snapshotter = None
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _resources() -> List[Tuple[str, object]]:
+        """Every persisted resource with a name that is stable across restarts"""
+        resources = []
+        for queue in EmulatorRegistry.queues.values():
+            resources.append((f'queue:{queue.name}', queue))
+        for name, table in EmulatorRegistry.tables.items():
+            if isinstance(table, ShardedTable):
+                # Shard routing uses a stable hash, so shards reload in place
+                # as long as the shard count is unchanged
+                resources.extend((f'table:{name}/shard-{i}', shard) for i, shard in enumerate(table.shards))
+            else:
+                resources.append((f'table:{name}', table))
+        return resources
+
+    def start(self) -> Dict:
+        """Recover existing state into the registry's resources, then journal every change"""
+        recovery = self.recover()
+        self.wal = WriteAheadLog(self.directory, recovery['next_lsn'], self.commit_interval)
+        for name, resource in self._resources():
+            resource.journal = self._journal_for(name)
+        self._snapshotter = threading.Thread(target=self._run_snapshotter, name='snapshotter', daemon=True)
+        self._snapshotter.start()
+        return recovery
+
+    def _journal_for(self, name: str):
+        wal = self.wal
+
+        def journal(operation, payload):
+            wal.append(name, operation, payload)
+        return journal
+
+    def recover(self) -> Dict:
+        """Load the latest snapshot and replay the log written after it"""
+        # Recovery allocates millions of long-lived containers; pausing the cyclic
+        # collector avoids repeated full-heap passes over objects that all survive
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._recover()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _recover(self) -> Dict:
+        started = time.perf_counter()
+        resources = dict(self._resources())
+        covered = {}  # resource name -> last sequence number included in the snapshot
+        states = {}
+        last_lsn = -1
+
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path) and os.path.getsize(snapshot_path) > 0:
+            with open(snapshot_path, 'rb') as snapshot_file, \
+                    mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                snapshot = pickle.loads(mapped)
+            last_lsn = snapshot['lsn']
+            for name, entry in snapshot['resources'].items():
+                covered[name] = entry['lsn']
+                states[name] = entry['state']
+
+        # Replay into plain dicts keyed by message id / primary key, then load once
+        working = {}
+        for name, resource in resources.items():
+            state = states.get(name)
+            if isinstance(resource, SimpleQueue):
+                messages = state['messages'] if state else []
+                working[name] = OrderedDict((fields[0], list(fields)) for fields in messages)
+            else:
+                working[name] = state['items'] if state else {}
+
+        replayed = 0
+        for path in WriteAheadLog.segments(self.directory):
+            for lsn, name, operation, payload in read_segment(path):
+                last_lsn = max(last_lsn, lsn)
+                if name not in working or lsn <= covered.get(name, -1):
+                    continue
+                self._apply(resources[name], working[name], operation, payload)
+                replayed += 1
+
+        for name, resource in resources.items():
+            if isinstance(resource, SimpleQueue):
+                resource.load_state({'messages': list(working[name].values())})
+            else:
+                resource.load_state({'items': working[name]})
+
+        return {
+            'next_lsn': last_lsn + 1,
+            'replayed_records': replayed,
+            'seconds': time.perf_counter() - started
+        }
+
+    @staticmethod
+    def _apply(resource, state, operation: str, payload):
+        if isinstance(resource, SimpleQueue):
+            # Queue state: message id -> [id, body, attributes, receive count(, group, sequence)]
+            if operation == 'send':
+                for message_id, body, attributes, *fifo in payload:
+                    state[message_id] = [message_id, body.encode(), attributes, 0, *fifo]
+            elif operation == 'receive':
+                received, moved_to_dlq = payload
+                for message_id in received:
+                    if message_id in state:
+                        state[message_id][3] += 1
+                for message_id in moved_to_dlq:
+                    state.pop(message_id, None)
+            elif operation == 'delete':
+                for message_id in payload:
+                    state.pop(message_id, None)
+        elif operation == 'put':
+            state[resource._primary_key(payload)] = pack_item(payload)
+        elif operation == 'delete':
+            state.pop(resource._primary_key(payload), None)
+
+    def snapshot(self):
+        """Write a compacted snapshot and drop the log segments it makes redundant"""
+        with self.snapshot_lock:
+            obsolete = self.wal.rotate()
+            entries = {}
+            for name, resource in self._resources():
+                # Capture state and log position together under the resource's lock
+                with resource.lock:
+                    entries[name] = {'lsn': self.wal.last_lsn(), 'state': resource.export_state()}
+            snapshot = {'lsn': self.wal.last_lsn(), 'resources': entries}
+
+            snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+            temp_path = snapshot_path + '.tmp'
+            with open(temp_path, 'wb') as snapshot_file:
+                pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+                self.snapshot_bytes += snapshot_file.tell()
+            os.replace(temp_path, snapshot_path)
+            self.snapshots += 1
+
+            for path in obsolete:
+                os.unlink(path)
+
+    def _run_snapshotter(self):
+        last_snapshot = time.time()
+        while not self._stop.wait(min(1.0, self.snapshot_interval)):
+            if time.time() - last_snapshot >= self.snapshot_interval or \
+                    self.wal.segment_bytes >= self.snapshot_wal_bytes:
+                self.snapshot()
+                last_snapshot = time.time()
+
+    def stats(self) -> Dict:
+        return {
+            'wal_bytes': self.wal.bytes_written if self.wal else 0,
+            'wal_commits': self.wal.commits if self.wal else 0,
+            'snapshot_bytes': self.snapshot_bytes,
+            'snapshots': self.snapshots
+        }
+
+    def close(self):
+        """Stop journaling; everything acknowledged so far is committed"""
+        self._stop.set()
+        if self._snapshotter:
+            self._snapshotter.join()
+        for _, resource in self._resources():
+            resource.journal = None
+        if self.wal:
+            self.wal.close()
+
+def enable_persistence(directory: str, **options) -> EmulatorPersistence:
+    """Recover and persist every resource currently in EmulatorRegistry"""
+    persistence = EmulatorPersistence(directory, **options)
+    recovery = persistence.start()
+    print(f"Persistence enabled in {directory}: recovered in {recovery['seconds']:.2f}s "
+          f"({recovery['replayed_records']} log records replayed)")
+    return persistence
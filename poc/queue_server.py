@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Local Emulator Server - Shares the in-memory emulators between processes over a Unix socket
+
+CRITICAL FEATURES IMPLEMENTED:
+
+1. MULTI-PROCESS CONSUMERS:
+   - One server process owns every SimpleQueue and SimpleTable
+   - Any number of worker processes consume the same queues, one core each
+   - Queue semantics (visibility timeouts, DLQ routing, long polling) are unchanged
+
+2. COMPACT FRAMING PROTOCOL:
+   - Each frame is a 4-byte big-endian length followed by compact JSON
+   - Requests: [request id, "service.method", args, kwargs]
+   - Responses: [request id, ok, result or [error type, message]]
+
+3. CLIENT BACKEND:
+   - LocalSQS / LocalDynamoDB / LocalDynamoDBStreams forward every call once connect() is called
+   - Pooled connections; long polls only tie up the connection they use
+   - pipeline() sends many requests before reading any response; the clients'
+     per-item batch paths (robust_emulators.pipelined) use it for one round trip
+
+HOW IT WORKS:
+- EmulatorServer: threaded Unix socket server, one thread per connection
+- EmulatorClient: connection pool with call() and pipeline()
+- connect(): installs an EmulatorClient as EmulatorRegistry.backend
+
+Usage:
+    python queue_server.py [socket_path] [--data-dir DIR]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from typing import List, Tuple
+
+from robust_emulators import (ConditionalCheckFailedException, EmulatorRegistry, LocalDynamoDB,
+                              LocalDynamoDBStreams, LocalSQS, TrimmedDataAccessException,
+                              setup_local_infrastructure)
+
+DEFAULT_SOCKET_PATH = '/tmp/luca-poc-emulators.sock'
+
+_HEADER = struct.Struct('!I')
+_SERVICES = {'sqs': LocalSQS, 'dynamodb': LocalDynamoDB, 'dynamodbstreams': LocalDynamoDBStreams}
+_ERRORS = {'ConditionalCheckFailedException': ConditionalCheckFailedException,
+           'TrimmedDataAccessException': TrimmedDataAccessException}
+
+def _encode(payload) -> bytes:
+    data = json.dumps(payload, separators=(',', ':')).encode()
+    return _HEADER.pack(len(data)) + data
+
+def _read_frame(rfile):
+    """Next decoded frame, or None when the peer closed the connection"""
+    header = rfile.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (length,) = _HEADER.unpack(header)
+    data = rfile.read(length)
+    if len(data) < length:
+        return None
+    return json.loads(data)
+
+def _dispatch(method: str, args: list, kwargs: dict):
+    service, _, name = method.partition('.')
+    api = _SERVICES.get(service)
+    if api is None or name.startswith('_') or not hasattr(api, name):
+        raise Exception(f"Unknown method: {method}")
+    return getattr(api, name)(*args, **kwargs)
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            request = _read_frame(self.rfile)
+            if request is None:
+                return
+            request_id, method, args, kwargs = request
+            try:
+                response = [request_id, True, _dispatch(method, args, kwargs)]
+            except Exception as e:
+                response = [request_id, False, [type(e).__name__, str(e)]]
+            self.wfile.write(_encode(response))
+
+class EmulatorServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _ConnectionHandler)
+        self.socket_path = socket_path
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+class EmulatorClient:
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, max_idle: int = 8):
+        self.socket_path = socket_path
+        self.max_idle = max_idle
+        self.idle = []  # pooled (socket, reader) pairs, most recently used last
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+
+    def _acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        return sock, sock.makefile('rb')
+
+    def _release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(connection)
+                return
+        self._close(connection)
+
+    @staticmethod
+    def _close(connection):
+        sock, reader = connection
+        reader.close()
+        sock.close()
+
+    def call(self, method: str, *args, **kwargs):
+        return self.pipeline([(method, args, kwargs)])[0]
+
+    def pipeline(self, calls: List[Tuple[str, tuple, dict]], return_exceptions: bool = False) -> list:
+        """Send every (method, args, kwargs) request on one connection, then read the
+        responses in order; the first failed call is raised after all are read, or with
+        return_exceptions, each failed call's exception takes its place in the results
+        """
+        request_ids = [next(self.request_ids) for _ in calls]
+        frames = b''.join(_encode([request_id, method, list(args), kwargs])
+                          for request_id, (method, args, kwargs) in zip(request_ids, calls))
+        connection = self._acquire()
+        try:
+            if len(calls) == 1:
+                connection[0].sendall(frames)
+                responses = [_read_frame(connection[1])]
+            else:
+                # Write from a helper thread so a long pipeline cannot deadlock with
+                # the server blocking on responses we have not started reading
+                writer = threading.Thread(target=connection[0].sendall, args=(frames,))
+                writer.start()
+                responses = [_read_frame(connection[1]) for _ in calls]
+                writer.join()
+        except Exception:
+            self._close(connection)
+            raise
+        if any(response is None for response in responses):
+            self._close(connection)
+            raise Exception(f"Emulator server closed the connection: {self.socket_path}")
+        self._release(connection)
+
+        results = []
+        for request_id, (response_id, ok, result) in zip(request_ids, responses):
+            if response_id != request_id:
+                raise Exception(f"Out of order response from emulator server: {response_id}")
+            if not ok:
+                error_type, message = result
+                error = _ERRORS.get(error_type, Exception)(message)
+                if not return_exceptions:
+                    raise error
+                result = error
+            results.append(result)
+        return results
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            self._close(connection)
+
+def connect(socket_path: str = DEFAULT_SOCKET_PATH) -> EmulatorClient:
+    """Route LocalSQS / LocalDynamoDB calls in this process to the emulator server"""
+    client = EmulatorClient(socket_path)
+    EmulatorRegistry.backend = client
+    return client
+
+def disconnect():
+    client, EmulatorRegistry.backend = EmulatorRegistry.backend, None
+    if client is not None:
+        client.close()
+
+def serve(socket_path: str = DEFAULT_SOCKET_PATH, data_dir: str = None):
+    """Create the POC infrastructure and serve it until interrupted; with a
+    data_dir, queues and tables survive restarts (see persistence.py)
+    """
+    setup_local_infrastructure()
+    persistence = None
+    if data_dir:
+        from persistence import enable_persistence
+        persistence = enable_persistence(data_dir)
+    with EmulatorServer(socket_path) as server:
+        print(f"Emulator server listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if persistence:
+                persistence.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the local emulators over a Unix socket")
+    parser.add_argument('socket_path', nargs='?', default=DEFAULT_SOCKET_PATH)
+    parser.add_argument('--data-dir', help="Persist queues and tables in this directory")
+    args = parser.parse_args()
+    serve(args.socket_path, args.data_dir)
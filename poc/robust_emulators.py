@@ -20,10 +20,27 @@ CRITICAL FEATURES IMPLEMENTED:
    - Ensures exactly-once processing semantics
 
 HOW IT WORKS:
-- SimpleQueue: In-memory message queue with DLQ routing logic
-- SimpleTable: Key-value store for idempotency tracking with TTL
-- EmulatorRegistry: Central coordination point for all resources
-- Clean APIs: Drop-in replacements for boto3 SQS and DynamoDB clients
+- SimpleQueue: In-memory message queue with DLQ routing logic; messages are
+  compact slotted records (bytes body, 128-bit int ids) turned into boto-shaped
+  dicts only when they leave the queue; DelaySeconds holds messages in a timer
+  wheel until due, and move_messages redrives a DLQ in bulk at a capped rate
+- FifoQueue: SimpleQueue with message group ordering and a deduplication window
+- FairQueue: SimpleQueue with per-tenant sub-queues served by weighted deficit
+  round-robin, optional per-tenant in-flight caps, and per-tenant depth gauges
+  and send-to-delivery latency histograms
+- SimpleTable: Key-value store for idempotency tracking with active TTL expiry
+  (min-heap swept in time-bounded slices), optional item cap, and optional
+  PK/SK schema and sorted per-partition index for range queries; items are
+  stored packed (S/N values as bare strings, see pack_item)
+- ShardedTable: SimpleTable split into lock-striped hash partitions
+- TableStream: optional change stream of a table (enable_stream): every put,
+  update, delete and expiry appends a record with its old and new images to a
+  bounded per-shard ring buffer, read by LocalDynamoDBStreams shard iterators
+- EmulatorRegistry: Central coordination point for all resources (copy-on-write,
+  lock-free lookups)
+- Clean APIs: Drop-in replacements for boto3 SQS, DynamoDB and DynamoDB Streams clients; with
+  metrics enabled (see metrics.py) every call records its latency and errors;
+  pipelined() runs many calls in one round trip when a server is connected
 
 PRODUCTION BENEFITS:
 - Zero external dependencies or accounts required
@@ -32,111 +49,1707 @@ PRODUCTION BENEFITS:
 - Comprehensive error handling and failure modes
 """
 
+import bisect
+import functools
+import hashlib
+import heapq
 import json
+import re
+import sys
+import threading
 import time
 import uuid
+import zlib
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Optional
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import METRICS
+from rate_control import TokenBucket
+
+class ConditionalCheckFailedException(Exception):
+    """Raised when a ConditionExpression does not hold for the stored item"""
+
+class TrimmedDataAccessException(Exception):
+    """Raised when a stream read starts at records already dropped from the ring buffer"""
+
+class _Message:
+    """Compact queued message; boto-shaped dicts are only built when it leaves the queue"""
+    __slots__ = ('id', 'body', 'attributes', 'receive_count', 'sent_at')
+    
+    def __init__(self, message_id: int, body: bytes, attributes: Optional[Dict], receive_count: int = 0):
+        self.id = message_id  # 128-bit UUID value
+        self.body = body  # UTF-8 encoded
+        self.attributes = attributes or None  # no dict for the common attribute-less message
+        self.receive_count = receive_count
+        self.sent_at = time.time()  # not persisted: restored messages count from the restart
+    
+    def to_dict(self, receipt_handle: int) -> Dict:
+        return {
+            'Id': str(uuid.UUID(int=self.id)),
+            'Body': self.body.decode(),
+            'ReceiptHandle': str(uuid.UUID(int=receipt_handle)),
+            'MessageAttributes': self.attributes or {}
+        }
+    
+    def journal_entry(self) -> list:
+        return [self.id, self.body.decode(), self.attributes]
+    
+    def export(self) -> tuple:
+        return self.id, self.body, self.attributes, self.receive_count
+
+class _FifoMessage(_Message):
+    __slots__ = ('group_id', 'sequence', 'deduplication_id')
+    
+    def __init__(self, message_id: int, body: bytes, attributes: Optional[Dict], receive_count: int = 0,
+                 group_id: str = None, sequence: int = 0, deduplication_id: str = None):
+        super().__init__(message_id, body, attributes, receive_count)
+        self.group_id = group_id
+        self.sequence = sequence  # assigned at enqueue; orders messages within a group
+        self.deduplication_id = deduplication_id  # only kept until the message is enqueued
+    
+    def to_dict(self, receipt_handle: int) -> Dict:
+        message = super().to_dict(receipt_handle)
+        message['Attributes'] = {'MessageGroupId': self.group_id, 'SequenceNumber': str(self.sequence)}
+        return message
+    
+    def journal_entry(self) -> list:
+        return super().journal_entry() + [self.group_id, self.sequence]
+    
+    def export(self) -> tuple:
+        return super().export() + (self.group_id, self.sequence)
+
+MAX_DELAY_SECONDS = 900  # SQS DelaySeconds limit
+
+class _TimerWheel:
+    """Hashed timing wheel holding delayed messages until they are due
+    
+    Scheduling appends to the slot of the due tick (O(1)); advancing visits
+    only the slots of ticks that elapsed, and nothing at all until the
+    earliest due tick. Entries more than one revolution ahead stay in their
+    slot until a later pass finds them due.
+    """
+    def __init__(self, tick: float = 0.05, slots: int = 1024):
+        self.tick = tick  # seconds per slot: delays are rounded up to a tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = int(time.time() / tick)  # last tick advanced to
+        self.count = 0
+        self.earliest = None  # no due tick is below this (a lower bound), None when empty
+    
+    def schedule(self, due: float, entry) -> bool:
+        """Hold entry until due; False (and nothing held) if it is due already"""
+        due_tick = -int(-due // self.tick)
+        if due_tick <= self.current:
+            return False
+        self.slots[due_tick % len(self.slots)].append((due_tick, entry))
+        self.count += 1
+        if self.earliest is None or due_tick < self.earliest:
+            self.earliest = due_tick
+        return True
+    
+    def next_due(self) -> Optional[float]:
+        """Time by which advance() may have something to return"""
+        return self.earliest * self.tick if self.count else None
+    
+    def advance(self, now: float) -> list:
+        """Remove and return the entries due by now, earliest first"""
+        target = int(now / self.tick)
+        if target <= self.current:
+            return []
+        if not self.count or self.earliest > target:
+            self.current = target
+            return []
+        slot_count = len(self.slots)
+        first = max(self.current + 1, self.earliest)
+        due = []
+        for tick in range(first, min(target, first + slot_count - 1) + 1):
+            slot = self.slots[tick % slot_count]
+            if slot:
+                ready = [entry for entry in slot if entry[0] <= target]
+                if ready:
+                    self.slots[tick % slot_count] = [entry for entry in slot if entry[0] > target]
+                    due.extend(ready)
+        self.current = target
+        self.count -= len(due)
+        self.earliest = None
+        if self.count:
+            # The first occupied slot ahead bounds the next due tick from below
+            for offset in range(1, slot_count + 1):
+                if self.slots[(target + offset) % slot_count]:
+                    self.earliest = target + offset
+                    break
+        due.sort(key=lambda entry: entry[0])
+        return [entry for _, entry in due]
+    
+    def entries(self) -> list:
+        return [entry for slot in self.slots for _, entry in slot]
+    
+    def clear(self):
+        self.slots = [[] for _ in self.slots]
+        self.count = 0
+        self.earliest = None
+
+def _receipt_value(receipt_handle: str) -> Optional[int]:
+    try:
+        return uuid.UUID(receipt_handle).int
+    except (ValueError, TypeError, AttributeError):
+        return None
 
 class SimpleQueue:
-    def __init__(self, name: str, dlq_name: str = None, max_receive_count: int = 3):
+    def __init__(self, name: str, dlq_name: str = None, max_receive_count: int = 3,
+                 visibility_timeout: float = 30, delay_seconds: float = 0):
         self.name = name
-        self.messages = []
+        self.messages = deque()  # visible _Message records, oldest first
         self.dlq_name = dlq_name
         self.max_receive_count = max_receive_count
-        self.receive_counts = {}  # track receive counts per message
-    
-    def send_message(self, body: str, attributes: Dict = None) -> str:
-        message_id = str(uuid.uuid4())
-        self.messages.append({
-            'Id': message_id,
-            'Body': body,
-            'ReceiptHandle': message_id,
-            'MessageAttributes': attributes or {}
-        })
-        return message_id
+        self.visibility_timeout = visibility_timeout
+        self.delay_seconds = self._check_delay(delay_seconds)  # default delay of every send
+        self.in_flight = {}  # receipt handle (int) -> message
+        self.visibility_heap = []  # (deadline, receipt handle), stale entries skipped lazily
+        self.delayed = _TimerWheel()  # messages sent with a delay, until they are due
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)  # signalled when messages become visible
+        self.listeners = set()  # non-blocking callbacks run on send (async long polling)
+        self.journal = None  # journal(operation, payload) called under the lock (persistence)
+    
+    def _new_message(self, body: str, attributes: Dict = None, group_id: str = None,
+                     deduplication_id: str = None) -> _Message:
+        # Standard queues ignore FIFO parameters
+        return _Message(uuid.uuid4().int, body.encode(), attributes)
+    
+    def _dead_letter(self, message: _Message) -> _Message:
+        """Copy of a message moved here from another queue (DLQ routing or a redrive)"""
+        dead_letter = _Message(uuid.uuid4().int, message.body, message.attributes)
+        dead_letter.sent_at = message.sent_at  # age counts from the original send, as in SQS
+        return dead_letter
+    
+    def _check_delay(self, delay_seconds: Optional[float]) -> float:
+        if delay_seconds is None:
+            return self.delay_seconds
+        if not 0 <= delay_seconds <= MAX_DELAY_SECONDS:
+            raise Exception(f"DelaySeconds must be between 0 and {MAX_DELAY_SECONDS}, got {delay_seconds}")
+        return delay_seconds
+    
+    def _enqueue(self, messages: List[_Message]) -> List[_Message]:
+        """Add messages to the visible set; returns the ones actually enqueued (lock held)"""
+        self.messages.extend(messages)
+        return messages
+    
+    def _take_visible(self, count: int, moving: bool = False) -> List[_Message]:
+        """Remove up to count deliverable messages in delivery order (lock held); moving:
+        they are settled at once to move them to another queue
+        """
+        messages = self.messages
+        return [messages.popleft() for _ in range(min(count, len(messages)))]
+    
+    def _settled(self, message: _Message):
+        """A taken message was deleted or dead-lettered (lock held)"""
+    
+    def _visible_count(self) -> int:
+        return len(self.messages)
+    
+    def _oldest_visible(self) -> Optional[_Message]:
+        return self.messages[0] if self.messages else None
+    
+    def oldest_message_age(self) -> float:
+        """Seconds since the oldest visible message was sent, 0 when empty, like SQS's
+        ApproximateAgeOfOldestMessage (messages returned by a visibility timeout rejoin
+        at the back, so this is approximate)
+        """
+        with self.lock:
+            oldest = self._oldest_visible()
+            return time.time() - oldest.sent_at if oldest is not None else 0.0
+    
+    def _append(self, messages: List[_Message], delays: List[float] = None):
+        """Enqueue messages (delays[i] > 0: hold message i in the timer wheel until due)
+        and wake consumers with one lock round-trip
+        """
+        with self.not_empty:
+            scheduled = []
+            earliest = self.delayed.next_due()
+            if delays and any(delays):
+                now = time.time()
+                ready = []
+                for message, delay in zip(messages, delays):
+                    if delay > 0 and self.delayed.schedule(now + delay, message):
+                        scheduled.append(message)
+                    else:
+                        ready.append(message)
+                messages = ready
+            enqueued = self._enqueue(messages) if messages else []
+            if self.journal and (enqueued or scheduled):
+                # Delayed messages are journaled as sent: after a restart they are visible at once
+                self.journal('send', [message.journal_entry() for message in enqueued + scheduled])
+            if scheduled and (earliest is None or self.delayed.next_due() < earliest):
+                # Sleeping receivers wait for the old earliest due time: have them recompute it
+                self.not_empty.notify_all()
+                self._notify_listeners()
+            if enqueued:
+                self.not_empty.notify(len(enqueued))
+                self._notify_listeners()
+    
+    def send_message(self, body: str, attributes: Dict = None, group_id: str = None,
+                     deduplication_id: str = None, delay_seconds: float = None) -> str:
+        delay = self._check_delay(delay_seconds)
+        message = self._new_message(body, attributes, group_id, deduplication_id)
+        self._append([message], [delay])
+        return str(uuid.UUID(int=message.id))
     
     def send_message_batch(self, entries: List[Dict]) -> Dict:
-        successful = []
         failed = []
+        messages = []
+        delays = []
         
         for entry in entries:
             try:
-                message_id = self.send_message(entry['MessageBody'], entry.get('MessageAttributes', {}))
-                successful.append({'Id': entry['Id'], 'MessageId': message_id})
+                delay = self._check_delay(entry.get('DelaySeconds'))
+                messages.append((entry['Id'], self._new_message(
+                    entry['MessageBody'], entry.get('MessageAttributes'),
+                    entry.get('MessageGroupId'), entry.get('MessageDeduplicationId')
+                )))
+                delays.append(delay)
             except Exception as e:
                 failed.append({'Id': entry['Id'], 'Code': 'Error', 'Message': str(e)})
         
+        # One lock round-trip per batch; wake as many consumers as there are new messages
+        if messages:
+            self._append([message for _, message in messages], delays)
+        
+        # Ids are read after enqueueing: a deduplicated message reports the original's id
+        successful = [{'Id': entry_id, 'MessageId': str(uuid.UUID(int=message.id))}
+                      for entry_id, message in messages]
         return {'Successful': successful, 'Failed': failed}
     
-    def receive_messages(self, max_messages: int = 1, wait_time: int = 0) -> List[Dict]:
-        if not self.messages:
-            return []
+    def add_listener(self, callback):
+        with self.lock:
+            self.listeners.add(callback)
+    
+    def remove_listener(self, callback):
+        with self.lock:
+            self.listeners.discard(callback)
+    
+    def _notify_listeners(self):
+        """Wake listeners registered by non-thread consumers (lock held; callbacks must not block)"""
+        for callback in self.listeners:
+            callback()
+    
+    def next_visibility_deadline(self) -> Optional[float]:
+        """Earliest time an in-flight or delayed message may become visible"""
+        with self.lock:
+            deadlines = [deadline for deadline in (self.visibility_heap[0][0] if self.visibility_heap else None,
+                                                   self.delayed.next_due()) if deadline is not None]
+            return min(deadlines) if deadlines else None
+    
+    def _release_delayed(self, now: float) -> int:
+        """Make delayed messages that are due visible (lock held)"""
+        due = self.delayed.advance(now)
+        if due:
+            self._enqueue(due)
+        return len(due)
+    
+    def _release_expired(self, now: float):
+        """Make in-flight messages whose visibility timeout elapsed visible again (lock held)"""
+        heap = self.visibility_heap
+        while heap and heap[0][0] <= now:
+            deadline, receipt_handle = heapq.heappop(heap)
+            message = self.in_flight.pop(receipt_handle, None)
+            if message is not None:  # otherwise already deleted
+                self.messages.append(message)
+    
+    def receive_messages(self, max_messages: int = 1, wait_time: int = 0,
+                         visibility_timeout: float = None) -> List[Dict]:
+        if visibility_timeout is None:
+            visibility_timeout = self.visibility_timeout
         
         result = []
-        for _ in range(min(max_messages, len(self.messages))):
-            if not self.messages:
-                break
-            
-            message = self.messages.pop(0)
-            message_id = message['ReceiptHandle']
+        to_dlq = []
+        with self.not_empty:
+            wait_until = time.time() + wait_time
+            while True:
+                now = time.time()
+                self._release_expired(now)
+                released = self._release_delayed(now)
+                if released > max_messages:
+                    self.not_empty.notify(released - max_messages)  # more than this receive takes
+                deadline = now + visibility_timeout
+                
+                while len(result) < max_messages:
+                    taken = self._take_visible(max_messages - len(result))
+                    if not taken:
+                        break
+                    for message in taken:
+                        message.receive_count += 1
+                        
+                        # Check if should go to DLQ
+                        if message.receive_count >= self.max_receive_count and self.dlq_name:
+                            to_dlq.append(message)
+                            self._settled(message)
+                            continue
+                        
+                        # Every receive hands out a fresh receipt handle, so a stale handle
+                        # from an earlier delivery cannot delete the redelivered copy
+                        receipt_handle = uuid.uuid4().int
+                        self.in_flight[receipt_handle] = message
+                        heapq.heappush(self.visibility_heap, (deadline, receipt_handle))
+                        result.append((message, receipt_handle))
+                
+                if result or to_dlq or now >= wait_until:
+                    break
+                
+                # Long poll: sleep until a send wakes us, the wait time runs out
+                # or the next in-flight or delayed message becomes visible
+                timeout = wait_until - now
+                if self.visibility_heap:
+                    timeout = min(timeout, self.visibility_heap[0][0] - now)
+                if self.delayed.count:
+                    timeout = min(timeout, max(0.0, self.delayed.next_due() - now))
+                self.not_empty.wait(timeout)
             
-            # Track receive count
-            self.receive_counts[message_id] = self.receive_counts.get(message_id, 0) + 1
-            
-            # Check if should go to DLQ
-            if self.receive_counts[message_id] >= self.max_receive_count and self.dlq_name:
-                # Move to DLQ
-                dlq = EmulatorRegistry.get_queue(self.dlq_name)
-                if dlq and dlq != self:
-                    dlq.send_message(message['Body'], message.get('MessageAttributes', {}))
-                continue
+            if self.journal and (result or to_dlq):
+                self.journal('receive', [[message.id for message, _ in result],
+                                         [message.id for message in to_dlq]])
             
-            result.append(message)
+            # Boto-shaped copies are built only for what leaves the queue
+            received = [message.to_dict(receipt_handle) for message, receipt_handle in result]
         
-        return result
+        # Move to DLQ outside our lock so two queues never hold each other's locks
+        if to_dlq:
+            dlq = EmulatorRegistry.get_queue(self.dlq_name)
+            if dlq and dlq != self:
+                dlq._append([dlq._dead_letter(message) for message in to_dlq])
+        
+        return received
     
     def delete_message(self, receipt_handle: str) -> bool:
-        # Clean up receive count tracking
-        if receipt_handle in self.receive_counts:
-            del self.receive_counts[receipt_handle]
+        with self.lock:
+            # The heap entry of a deleted message is skipped when it surfaces
+            message = self.in_flight.pop(_receipt_value(receipt_handle), None)
+            if message is None:
+                return False
+            self._settled(message)
+            if self.journal:
+                self.journal('delete', [message.id])
         return True
+    
+    def delete_message_batch(self, entries: List[Dict]) -> Dict:
+        successful = []
+        failed = []
+        deleted = []
+        with self.lock:
+            for entry in entries:
+                message = self.in_flight.pop(_receipt_value(entry['ReceiptHandle']), None)
+                if message is None:
+                    failed.append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid',
+                                   'Message': 'Message is not in flight'})
+                    continue
+                self._settled(message)
+                successful.append({'Id': entry['Id']})
+                deleted.append(message.id)
+            if self.journal and deleted:
+                self.journal('delete', deleted)
+        return {'Successful': successful, 'Failed': failed}
+    
+    def _queued(self) -> List[_Message]:
+        return list(self.messages)
+    
+    def export_state(self) -> Dict:
+        """Copy of the queue contents (lock held); in-flight and delayed messages are
+        included as visible
+        """
+        messages = self._queued() + list(self.in_flight.values()) + self.delayed.entries()
+        return {'messages': [message.export() for message in messages]}
+    
+    def load_state(self, state: Dict):
+        """Replace the queue contents with an exported state"""
+        messages = deque(_Message(*fields) for fields in state['messages'])
+        with self.not_empty:
+            self.messages = messages
+            self.in_flight = {}
+            self.visibility_heap = []
+            self.delayed.clear()
+            self.not_empty.notify_all()
+    
+    def attributes(self) -> Dict:
+        with self.lock:
+            self._release_delayed(time.time())
+            return {
+                'ApproximateNumberOfMessages': str(self._visible_count()),
+                'ApproximateNumberOfMessagesNotVisible': str(len(self.in_flight)),
+                'ApproximateNumberOfMessagesDelayed': str(self.delayed.count),
+                'VisibilityTimeout': str(self.visibility_timeout)
+            }
+    
+    def _take_for_move(self, count: int) -> List[_Message]:
+        """Remove up to count visible messages to move them to another queue"""
+        with self.lock:
+            now = time.time()
+            self._release_expired(now)
+            self._release_delayed(now)
+            taken = self._take_visible(count, moving=True)
+            for message in taken:
+                self._settled(message)
+            if self.journal and taken:
+                self.journal('receive', [[], [message.id for message in taken]])
+        return taken
+    
+    def move_messages(self, destination: 'SimpleQueue', max_messages: int = None,
+                      max_messages_per_second: float = None, delay_seconds: float = 0) -> int:
+        """Move visible messages to destination (a DLQ redrive), at most max_messages
+        (None: until empty) and at most max_messages_per_second; returns the number moved
+        
+        Messages are moved in slices of up to one second's worth, each slice one
+        lock round-trip per queue; delay_seconds holds them back at the destination.
+        """
+        if max_messages_per_second is not None and max_messages_per_second <= 0:
+            raise Exception(f"MaxNumberOfMessagesPerSecond must be positive, got {max_messages_per_second}")
+        slice_size = 1000 if max_messages_per_second is None else max(1, min(1000, int(max_messages_per_second)))
+        bucket = TokenBucket(max_messages_per_second, slice_size) if max_messages_per_second is not None else None
+        delay = destination._check_delay(delay_seconds)
+        moved = 0
+        while max_messages is None or moved < max_messages:
+            wanted = slice_size if max_messages is None else min(slice_size, max_messages - moved)
+            taken = self._take_for_move(wanted)
+            if taken:
+                destination._append([destination._dead_letter(message) for message in taken],
+                                    [delay] * len(taken))
+                moved += len(taken)
+            if len(taken) < wanted:
+                break  # nothing left to move
+            if bucket and (max_messages is None or moved < max_messages):
+                bucket.acquire(len(taken))  # paid after the slice: no wait once done
+        return moved
+
+class FifoQueue(SimpleQueue):
+    """SimpleQueue with SQS FIFO semantics
+    
+    Messages are ordered within their MessageGroupId. A group is locked while
+    any of its messages is in flight, so different groups are served in
+    parallel but one group never has two consumers at once. Sends repeating a
+    MessageDeduplicationId (or, with content-based deduplication, a body)
+    seen within the deduplication window are accepted but dropped.
+    """
+    def __init__(self, name: str, dlq_name: str = None, max_receive_count: int = 3,
+                 visibility_timeout: float = 30, content_based_deduplication: bool = False,
+                 deduplication_window: float = 300):
+        super().__init__(name, dlq_name, max_receive_count, visibility_timeout)
+        self.content_based_deduplication = content_based_deduplication
+        self.deduplication_window = deduplication_window
+        self.groups = {}  # group id -> deque of visible messages in sequence order
+        self.ready = deque()  # groups with visible messages and nothing in flight, round robin
+        self.group_in_flight = {}  # group id -> messages taken and not yet settled
+        self.visible = 0
+        self.next_sequence = 0
+        # Expiring hash index: deduplication id -> message id, plus (expires_at, id)
+        # in insertion order; a fixed window keeps that order sorted by expiry
+        self.deduplication_ids = {}
+        self.deduplication_expiry = deque()
+        self.duplicates_dropped = 0
+    
+    def _new_message(self, body: str, attributes: Dict = None, group_id: str = None,
+                     deduplication_id: str = None) -> _Message:
+        if not group_id:
+            raise Exception(f"MessageGroupId is required for FIFO queue {self.name}")
+        if not deduplication_id:
+            if not self.content_based_deduplication:
+                raise Exception(f"MessageDeduplicationId is required for FIFO queue {self.name} "
+                                f"without content-based deduplication")
+            deduplication_id = hashlib.sha256(body.encode()).hexdigest()
+        return _FifoMessage(uuid.uuid4().int, body.encode(), attributes, 0, group_id, 0, deduplication_id)
+    
+    def _check_delay(self, delay_seconds: Optional[float]) -> float:
+        if delay_seconds:
+            raise Exception(f"DelaySeconds is not supported on FIFO queue {self.name}")
+        return 0
+    
+    def _dead_letter(self, message: _Message) -> _Message:
+        # Dead letters keep their group so per-group order survives the move
+        dead_letter = _FifoMessage(uuid.uuid4().int, message.body, message.attributes, 0,
+                                   getattr(message, 'group_id', None) or 'dead-letter')
+        dead_letter.sent_at = message.sent_at
+        return dead_letter
+    
+    def _expire_deduplication_ids(self, now: float):
+        expiry = self.deduplication_expiry
+        while expiry and expiry[0][0] <= now:
+            self.deduplication_ids.pop(expiry.popleft()[1], None)
+    
+    def _enqueue(self, messages: List[_Message]) -> List[_Message]:
+        now = time.time()
+        self._expire_deduplication_ids(now)
+        enqueued = []
+        for message in messages:
+            deduplication_id = message.deduplication_id
+            if deduplication_id is not None:
+                original = self.deduplication_ids.get(deduplication_id)
+                if original is not None:
+                    # Accepted but not delivered again; the sender sees the original's id
+                    message.id = original
+                    self.duplicates_dropped += 1
+                    continue
+                self.deduplication_ids[deduplication_id] = message.id
+                self.deduplication_expiry.append((now + self.deduplication_window, deduplication_id))
+                message.deduplication_id = None
+            
+            message.sequence = self.next_sequence
+            self.next_sequence += 1
+            group = self.groups.get(message.group_id)
+            if group is None:
+                group = self.groups[message.group_id] = deque()
+            if not group and message.group_id not in self.group_in_flight:
+                self.ready.append(message.group_id)
+            group.append(message)
+            self.visible += 1
+            enqueued.append(message)
+        return enqueued
+    
+    def _take_visible(self, count: int, moving: bool = False) -> List[_Message]:
+        # Fill the batch from one group before moving to the next, like SQS FIFO
+        taken = []
+        while len(taken) < count and self.ready:
+            group_id = self.ready.popleft()
+            group = self.groups[group_id]
+            batch = [group.popleft() for _ in range(min(count - len(taken), len(group)))]
+            if not group:
+                del self.groups[group_id]
+            self.group_in_flight[group_id] = self.group_in_flight.get(group_id, 0) + len(batch)
+            taken.extend(batch)
+        self.visible -= len(taken)
+        return taken
+    
+    def _settled(self, message: _Message):
+        group_id = message.group_id
+        remaining = self.group_in_flight[group_id] - 1
+        if remaining:
+            self.group_in_flight[group_id] = remaining
+            return
+        del self.group_in_flight[group_id]
+        if group_id in self.groups:
+            self.ready.append(group_id)
+    
+    def _visible_count(self) -> int:
+        return self.visible
+    
+    def _oldest_visible(self) -> Optional[_Message]:
+        heads = [group[0] for group in self.groups.values()]
+        return min(heads, key=lambda message: message.sent_at) if heads else None
+    
+    def _release_expired(self, now: float):
+        heap = self.visibility_heap
+        released = {}
+        while heap and heap[0][0] <= now:
+            deadline, receipt_handle = heapq.heappop(heap)
+            message = self.in_flight.pop(receipt_handle, None)
+            if message is not None:
+                released.setdefault(message.group_id, []).append(message)
+        
+        # A locked group delivered nothing newer, so released messages go back
+        # to the head of their group in their original order
+        for group_id, messages in released.items():
+            messages.sort(key=lambda message: message.sequence)
+            group = self.groups.get(group_id)
+            if group is None:
+                group = self.groups[group_id] = deque()
+            group.extendleft(reversed(messages))
+            self.visible += len(messages)
+            for message in messages:
+                self._settled(message)
+    
+    def _queued(self) -> List[_Message]:
+        return [message for group in self.groups.values() for message in group]
+    
+    def load_state(self, state: Dict):
+        messages = sorted((_FifoMessage(*fields) for fields in state['messages']),
+                          key=lambda message: message.sequence)
+        groups = {}
+        for message in messages:
+            groups.setdefault(message.group_id, deque()).append(message)
+        with self.not_empty:
+            self.groups = groups
+            self.ready = deque(groups)
+            self.group_in_flight = {}
+            self.visible = len(messages)
+            # The deduplication index is not persisted: it is at most one window old
+            self.next_sequence = max(self.next_sequence, messages[-1].sequence + 1 if messages else 0)
+            self.in_flight = {}
+            self.visibility_heap = []
+            self.not_empty.notify_all()
+
+class _Tenant:
+    """One tenant's sub-queue in a FairQueue"""
+    __slots__ = ('name', 'messages', 'weight', 'in_flight_limit', 'deficit', 'in_flight', 'active', 'wait')
+    
+    def __init__(self, name: str, weight: float, in_flight_limit: Optional[int]):
+        self.name = name
+        self.messages = deque()  # visible messages, oldest first
+        self.weight = weight
+        self.in_flight_limit = in_flight_limit  # None: no cap
+        self.deficit = 0.0  # messages this tenant may still take in the current round
+        self.in_flight = 0  # taken and not yet settled
+        self.active = False  # in the queue's round-robin
+        self.wait = None  # histogram of seconds from send to delivery
+    
+    def servable(self) -> bool:
+        return bool(self.messages) and (self.in_flight_limit is None or self.in_flight < self.in_flight_limit)
+
+class FairQueue(SimpleQueue):
+    """SimpleQueue that serves tenants fairly instead of oldest-first
+    
+    Messages are kept in per-tenant sub-queues keyed by a message attribute
+    (school_id by default; messages without it share the '' tenant). Receives
+    take from the tenants by weighted deficit round-robin: each visit adds
+    quantum * weight to a tenant's deficit and the tenant may take that many
+    messages, so a tenant sending 100x the others' load gets its weighted
+    share, not 100x, and small tenants never wait behind its backlog. A tenant
+    at its in-flight limit is skipped until one of its messages is settled.
+    """
+    def __init__(self, name: str, dlq_name: str = None, max_receive_count: int = 3,
+                 visibility_timeout: float = 30, delay_seconds: float = 0,
+                 tenant_attribute: str = 'school_id', tenant_weights: Dict[str, float] = None,
+                 tenant_in_flight_limit: int = None, tenant_in_flight_limits: Dict[str, int] = None,
+                 quantum: float = 1):
+        super().__init__(name, dlq_name, max_receive_count, visibility_timeout, delay_seconds)
+        if quantum <= 0 or any(weight <= 0 for weight in (tenant_weights or {}).values()):
+            raise Exception(f"Quantum and tenant weights must be positive for fair queue {name}")
+        self.tenant_attribute = tenant_attribute
+        self.tenant_weights = dict(tenant_weights or {})  # tenant -> weight, default 1
+        self.tenant_in_flight_limit = tenant_in_flight_limit  # default cap, None: no cap
+        self.tenant_in_flight_limits = dict(tenant_in_flight_limits or {})  # tenant -> cap
+        self.quantum = quantum
+        self.tenants = {}  # tenant name -> _Tenant
+        self.active = deque()  # servable tenants in round-robin order
+        self.serving = False  # active[0] already received its quantum for this visit
+        self.visible = 0
+    
+    def _tenant(self, name: str) -> _Tenant:
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            tenant = self.tenants[name] = _Tenant(name, self.tenant_weights.get(name, 1),
+                                                  self.tenant_in_flight_limits.get(name, self.tenant_in_flight_limit))
+            tenant.wait = METRICS.histogram('queue_tenant_wait_seconds', queue=self.name, tenant=name)
+            METRICS.gauge('queue_tenant_visible_messages', lambda: len(tenant.messages),
+                          queue=self.name, tenant=name)
+            METRICS.gauge('queue_tenant_in_flight_messages', lambda: tenant.in_flight,
+                          queue=self.name, tenant=name)
+        return tenant
+    
+    def _tenant_of(self, message: _Message) -> _Tenant:
+        attributes = message.attributes
+        value = attributes.get(self.tenant_attribute) if attributes else None
+        if isinstance(value, dict):
+            value = value.get('StringValue')
+        return self._tenant(value or '')
+    
+    def _activate(self, tenant: _Tenant):
+        if not tenant.active and tenant.servable():
+            tenant.active = True
+            self.active.append(tenant)
+    
+    def configure_tenant(self, name: str, weight: float = None, in_flight_limit: Optional[int] = -1):
+        """Change a tenant's weight and/or in-flight limit (-1: keep it, None: no cap)"""
+        if weight is not None and weight <= 0:
+            raise Exception(f"Tenant weight must be positive, got {weight}")
+        with self.not_empty:
+            tenant = self._tenant(name)
+            if weight is not None:
+                tenant.weight = self.tenant_weights[name] = weight
+            if in_flight_limit != -1:
+                tenant.in_flight_limit = self.tenant_in_flight_limits[name] = in_flight_limit
+                if not tenant.active and tenant.servable():
+                    self._activate(tenant)
+                    self.not_empty.notify()
+    
+    def _enqueue(self, messages: List[_Message]) -> List[_Message]:
+        for message in messages:
+            tenant = self._tenant_of(message)
+            tenant.messages.append(message)
+            self._activate(tenant)
+        self.visible += len(messages)
+        return messages
+    
+    def _drain(self, count: int) -> List[_Message]:
+        # A move settles what it takes at once: no caps and no round-robin
+        taken = []
+        for tenant in self.tenants.values():
+            take = min(len(tenant.messages), count - len(taken))
+            taken.extend(tenant.messages.popleft() for _ in range(take))
+            tenant.in_flight += take
+            if len(taken) == count:
+                break
+        if self.active and not self.active[0].messages:
+            self.serving = False
+        for tenant in self.active:
+            if not tenant.messages:
+                tenant.active = False
+                tenant.deficit = 0.0
+        self.active = deque(tenant for tenant in self.active if tenant.active)
+        self.visible -= len(taken)
+        return taken
+    
+    def _take_visible(self, count: int, moving: bool = False) -> List[_Message]:
+        if moving:
+            return self._drain(count)
+        # Deficit round-robin: a visit that fills the batch stays open, so the
+        # next receive continues with the same tenant and its remaining deficit
+        taken = []
+        active = self.active
+        record = METRICS.enabled
+        now = time.time()
+        while len(taken) < count and active:
+            tenant = active[0]
+            if not self.serving:
+                tenant.deficit += self.quantum * tenant.weight
+                self.serving = True
+            take = min(int(tenant.deficit), len(tenant.messages), count - len(taken))
+            if tenant.in_flight_limit is not None:
+                take = min(take, tenant.in_flight_limit - tenant.in_flight)
+            for _ in range(take):
+                message = tenant.messages.popleft()
+                if record:
+                    tenant.wait.observe(now - message.sent_at)
+                taken.append(message)
+            tenant.deficit -= take
+            tenant.in_flight += take
+            if not tenant.servable():
+                # Empty or at its cap: leaves the round and forfeits its deficit
+                active.popleft()
+                tenant.active = False
+                tenant.deficit = 0.0
+                self.serving = False
+            elif tenant.deficit < 1:
+                active.rotate(-1)
+                self.serving = False
+        self.visible -= len(taken)
+        return taken
+    
+    def _settled(self, message: _Message):
+        tenant = self._tenant_of(message)
+        tenant.in_flight -= 1
+        if not tenant.active and tenant.servable():
+            self._activate(tenant)
+            self.not_empty.notify()  # a receiver may be waiting on this tenant's cap
+    
+    def _visible_count(self) -> int:
+        return self.visible
+    
+    def _oldest_visible(self) -> Optional[_Message]:
+        heads = [tenant.messages[0] for tenant in self.tenants.values() if tenant.messages]
+        return min(heads, key=lambda message: message.sent_at) if heads else None
+    
+    def _release_expired(self, now: float):
+        heap = self.visibility_heap
+        released = {}
+        while heap and heap[0][0] <= now:
+            deadline, receipt_handle = heapq.heappop(heap)
+            message = self.in_flight.pop(receipt_handle, None)
+            if message is not None:
+                released.setdefault(self._tenant_of(message), []).append(message)
+        
+        # Redeliveries are the tenant's oldest work: back to the head of its sub-queue
+        for tenant, messages in released.items():
+            messages.sort(key=lambda message: message.sent_at)
+            tenant.messages.extendleft(reversed(messages))
+            self.visible += len(messages)
+            for message in messages:
+                self._settled(message)
+    
+    def _queued(self) -> List[_Message]:
+        return [message for tenant in self.tenants.values() for message in tenant.messages]
+    
+    def tenant_stats(self) -> Dict[str, Dict]:
+        """Per-tenant depth: visible and in-flight messages, weight and in-flight limit"""
+        with self.lock:
+            return {name: {'visible': len(tenant.messages), 'in_flight': tenant.in_flight,
+                           'weight': tenant.weight, 'in_flight_limit': tenant.in_flight_limit}
+                    for name, tenant in self.tenants.items()}
+    
+    def load_state(self, state: Dict):
+        messages = [_Message(*fields) for fields in state['messages']]
+        with self.not_empty:
+            for tenant in self.tenants.values():
+                tenant.messages.clear()
+                tenant.in_flight = 0
+                tenant.deficit = 0.0
+                tenant.active = False
+            self.active.clear()
+            self.serving = False
+            self.visible = 0
+            self.in_flight = {}
+            self.visibility_heap = []
+            self.delayed.clear()
+            self._enqueue(messages)
+            self.not_empty.notify_all()
+
+class _Number(str):
+    """Packed N attribute: the number's string form, told apart from packed S values by type"""
+    __slots__ = ()
+
+def pack_item(item: Dict) -> Dict:
+    """Stored form of a wire item: S and N values are kept as bare strings instead of
+    one-entry type dicts; other attribute types are kept as they are
+    """
+    packed = {}
+    for name, value in item.items():
+        if 'S' in value:
+            value = value['S']
+        elif 'N' in value:
+            value = _Number(value['N'])
+        packed[sys.intern(name)] = value
+    return packed
+
+def unpack_item(packed: Dict) -> Dict:
+    """Wire (boto-shaped) copy of a stored item"""
+    item = {}
+    for name, value in packed.items():
+        if type(value) is str:
+            value = {'S': value}
+        elif type(value) is _Number:
+            value = {'N': str(value)}
+        item[name] = value
+    return item
+
+_SERVICE_IDENTITY = {'type': 'Service', 'principalId': 'dynamodb.amazonaws.com'}
+
+class _StreamShard:
+    """Bounded ring buffer of change records, one writer at a time (the table lock)
+    
+    The ring is kept as parallel columns (sequence, time, old image, new image,
+    removed by service) so appending allocates nothing: no per-record tuple for
+    the garbage collector to track. Stored items are never mutated in place, so
+    the images are shared with the table, not copied.
+    """
+    def __init__(self, shard_id: str, capacity: int):
+        self.shard_id = shard_id
+        self.capacity = capacity
+        self.sequences = [-1] * capacity
+        self.created = [0.0] * capacity
+        self.old_images = [None] * capacity
+        self.new_images = [None] * capacity
+        self.by_service = [False] * capacity
+        self.next_sequence = 0  # sequence of the next record appended
+    
+    def append(self, old: Optional[Dict], new: Optional[Dict], by_service: bool = False):
+        """Record a change: old None is an INSERT, new None a REMOVE, both a MODIFY"""
+        sequence = self.next_sequence
+        slot = sequence % self.capacity
+        self.sequences[slot] = sequence  # claimed first, so a reader can tell it was overwritten
+        self.created[slot] = time.time()
+        self.old_images[slot] = old
+        self.new_images[slot] = new
+        self.by_service[slot] = by_service
+        self.next_sequence = sequence + 1  # published after the slot is written
+    
+    def trim_horizon(self) -> int:
+        return max(0, self.next_sequence - self.capacity)
+    
+    def read(self, position: int, limit: int) -> list:
+        """(sequence, created, old, new, by service) records from sequence position on,
+        at most limit; lock-free: a read that overlaps the writer wrapping around the
+        ring is detected afterwards
+        """
+        end = min(self.next_sequence, position + limit)
+        if position < self.trim_horizon():
+            raise TrimmedDataAccessException(f"Records before sequence {self.trim_horizon()} of "
+                                             f"{self.shard_id} were trimmed; requested {position}")
+        if position >= end:
+            return []
+        start = position % self.capacity
+        stop = start + end - position
+        columns = (self.created, self.old_images, self.new_images, self.by_service)
+        if stop <= self.capacity:
+            records = list(zip(range(position, end), *(column[start:stop] for column in columns)))
+        else:
+            wrapped = stop - self.capacity
+            records = list(zip(range(position, end), *(column[start:] + column[:wrapped] for column in columns)))
+        # A writer claims a slot before filling it and publishes its sequence after:
+        # only the first slot can be overwritten without the horizon having moved past it
+        if self.sequences[start] != position or position < self.trim_horizon():
+            raise TrimmedDataAccessException(f"Records from {position} of {self.shard_id} were "
+                                             f"overwritten while being read")
+        return records
+
+class TableStream:
+    """Change stream of a table: NEW_AND_OLD_IMAGES records in sequence order per
+    shard; all changes to one partition key land in the same shard
+    """
+    def __init__(self, table_name: str, partition_key: str, sort_key: Optional[str], shards: int, capacity: int):
+        self.table_name = table_name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.shards = [_StreamShard(f'shardId-{index:05d}', capacity) for index in range(shards)]
+        self.by_id = {shard.shard_id: shard for shard in self.shards}
+    
+    def shard_for(self, primary_key) -> _StreamShard:
+        if len(self.shards) == 1:
+            return self.shards[0]
+        pk = primary_key if self.sort_key is None else primary_key[0]
+        return self.shards[hash(pk) % len(self.shards)]  # streams are not persisted: hash() is stable enough
+    
+    def shard(self, shard_id: str) -> _StreamShard:
+        shard = self.by_id.get(shard_id)
+        if shard is None:
+            raise Exception(f"Unknown shard {shard_id} in the stream of table {self.table_name}")
+        return shard
+    
+    def to_dict(self, shard: _StreamShard, record: tuple) -> Dict:
+        """Boto-shaped (DynamoDB Streams) copy of a record"""
+        sequence, created_at, old, new, by_service = record
+        event_name = 'INSERT' if old is None else 'REMOVE' if new is None else 'MODIFY'
+        image = new if new is not None else old
+        keys = {self.partition_key: image[self.partition_key]}
+        if self.sort_key is not None:
+            keys[self.sort_key] = image[self.sort_key]
+        change = {
+            'ApproximateCreationDateTime': created_at,
+            'Keys': unpack_item(keys),
+            'SequenceNumber': f'{sequence:021d}',
+            'StreamViewType': 'NEW_AND_OLD_IMAGES'
+        }
+        if old is not None:
+            change['OldImage'] = unpack_item(old)
+        if new is not None:
+            change['NewImage'] = unpack_item(new)
+        result = {'eventID': f'{shard.shard_id}-{sequence}', 'eventName': event_name,
+                  'eventSource': 'aws:dynamodb', 'dynamodb': change}
+        if by_service:
+            result['userIdentity'] = _SERVICE_IDENTITY  # TTL expiry, eviction or tiering, not a client
+        return result
 
 class SimpleTable:
-    def __init__(self, name: str):
+    EVICTION_POLICIES = ('soonest-expiry', 'oldest')
+    
+    def __init__(self, name: str, partition_key: str = 'idempotency_key', sort_key: str = None,
+                 batch_capacity: int = None, max_items: int = None, eviction_policy: str = 'soonest-expiry'):
+        if eviction_policy not in self.EVICTION_POLICIES:
+            raise Exception(f"Unknown eviction policy: {eviction_policy}")
         self.name = name
-        self.items = {}
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.batch_capacity = batch_capacity  # max requests served per batch call, None = unlimited
+        self.max_items = max_items  # hard cap on stored items, None = unbounded
+        self.eviction_policy = eviction_policy
+        self.items = {}  # primary key (pk, or (pk, sk) with a sort key) -> packed item, in insertion order
+        self.partitions = {}  # pk -> sort key values kept in order (sort key schema only)
+        self.scan_order = None  # sorted partition keys (or primary keys without a sort key), built by scan
+        self.expiry_heap = []  # (ttl, primary key), stale entries skipped lazily
+        self.pending_expiry = 0  # stored items carrying a ttl
+        self.age_attribute = None  # numeric attribute ordering items for tiering, see track_age
+        self.age_heap = []  # (timestamp, primary key), stale entries skipped lazily
+        self.expired_count = 0
+        self.evicted_count = 0
+        self.lock = threading.Lock()
+        self.journal = None  # journal(operation, payload) called under the lock (persistence)
+        self.stream = None  # TableStream recording every change, see enable_stream
+        self.stream_shard = None  # fixed stream shard (a ShardedTable shard), None: by partition key
+        self.delete_watcher = None  # delete_watcher(wire key) after each client delete (lock held), see watch_deletes
+        self._expiry_stop = None
+    
+    def _key_value(self, key: Dict, attribute: str):
+        """Comparable value of a key attribute; N keys sort numerically"""
+        if attribute not in key:
+            raise Exception(f"Missing key attribute {attribute} for table {self.name}")
+        value = key[attribute]
+        if 'N' in value:
+            return Decimal(value['N'])
+        return value.get('S')
+    
+    def _primary_key(self, key: Dict):
+        pk = self._key_value(key, self.partition_key)
+        if self.sort_key is None:
+            return pk
+        return pk, self._key_value(key, self.sort_key)
+    
+    def _key_of(self, item: Dict) -> Dict:
+        """Wire key of a stored (packed) item"""
+        key = {self.partition_key: item[self.partition_key]}
+        if self.sort_key is not None:
+            key[self.sort_key] = item[self.sort_key]
+        return unpack_item(key)
+    
+    @staticmethod
+    def _ttl_of(item: Dict) -> Optional[int]:
+        ttl = item.get('ttl')
+        if type(ttl) is _Number:
+            try:
+                return int(ttl)
+            except ValueError:
+                pass
+        return None
+    
+    def _timestamp_of(self, item: Dict) -> Optional[float]:
+        value = item.get(self.age_attribute)
+        if type(value) is _Number:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        return None
+    
+    @classmethod
+    def _is_expired(cls, item: Dict, now: float) -> bool:
+        ttl = cls._ttl_of(item)
+        return ttl is not None and now > ttl
+    
+    def _remove(self, primary_key, by_service: bool = False):
+        """Drop an item and its sort key index entry (lock held); by_service: removed by
+        TTL expiry, eviction or tiering rather than by a client
+        """
+        item = self.items.pop(primary_key, None)
+        if item is None:
+            return
+        if self.journal:
+            self.journal('delete', self._key_of(item))
+        if self.stream is not None:
+            (self.stream_shard or self.stream.shard_for(primary_key)).append(item, None, by_service)
+        if self._ttl_of(item) is not None:
+            self.pending_expiry -= 1
+        if self.sort_key is None:
+            self.scan_order = None
+            return
+        pk, sk = primary_key
+        sort_keys = self.partitions[pk]
+        del sort_keys[bisect.bisect_left(sort_keys, sk)]
+        if not sort_keys:
+            del self.partitions[pk]
+            self.scan_order = None
+    
+    def _current(self, primary_key, now: float) -> Optional[Dict]:
+        """Live item for a key; expired items count as absent (lock held)"""
+        item = self.items.get(primary_key)
+        if item is not None and self._is_expired(item, now):
+            self._expire(primary_key)
+            return None
+        return item
+    
+    def _check_condition(self, condition, current: Optional[Dict]):
+        """Evaluate a condition predicate against the stored item (lock held)"""
+        if condition is not None and not condition(unpack_item(current) if current is not None else None):
+            raise ConditionalCheckFailedException(f"The conditional request failed on table {self.name}")
     
-    def put_item(self, item: Dict):
-        key = item.get('idempotency_key', {}).get('S', 'unknown')
-        self.items[key] = item
+    def _store(self, primary_key, item: Dict):
+        """Insert or replace an item, indexing new sort keys and its expiry (lock held)"""
+        previous = self.items.get(primary_key)
+        if previous is None:
+            if self.max_items is not None and len(self.items) >= self.max_items:
+                self._evict()
+            if self.sort_key is None:
+                self.scan_order = None
+            else:
+                pk, sk = primary_key
+                sort_keys = self.partitions.get(pk)
+                if sort_keys is None:
+                    sort_keys = self.partitions[pk] = []
+                    self.scan_order = None  # only a new partition changes the scan order
+                bisect.insort(sort_keys, sk)
+        elif self._ttl_of(previous) is not None:
+            self.pending_expiry -= 1
+        
+        self.items[primary_key] = item
+        if self.journal:
+            self.journal('put', unpack_item(item))
+        if self.stream is not None:
+            (self.stream_shard or self.stream.shard_for(primary_key)).append(previous, item)
+        ttl = self._ttl_of(item)
+        if ttl is not None:
+            self.pending_expiry += 1
+            heapq.heappush(self.expiry_heap, (ttl, primary_key))
+            # Rewrites leave stale heap entries behind; rebuild before they dominate
+            if len(self.expiry_heap) > 2 * self.pending_expiry + 1024:
+                self._rebuild_expiry_heap()
+        if self.age_attribute is not None:
+            timestamp = self._timestamp_of(item)
+            if timestamp is not None:
+                heapq.heappush(self.age_heap, (timestamp, primary_key))
+                if len(self.age_heap) > 2 * len(self.items) + 1024:
+                    self._rebuild_age_heap()
+    
+    def _rebuild_expiry_heap(self):
+        self.expiry_heap = [(ttl, primary_key) for primary_key, ttl in
+                            ((primary_key, self._ttl_of(item)) for primary_key, item in self.items.items())
+                            if ttl is not None]
+        heapq.heapify(self.expiry_heap)
+    
+    def _rebuild_age_heap(self):
+        self.age_heap = [(timestamp, primary_key) for primary_key, timestamp in
+                         ((primary_key, self._timestamp_of(item)) for primary_key, item in self.items.items())
+                         if timestamp is not None]
+        heapq.heapify(self.age_heap)
+    
+    def _pop_expiry(self):
+        """Pop the live item expiring soonest as (ttl, primary key), or None (lock held)"""
+        while self.expiry_heap:
+            ttl, primary_key = heapq.heappop(self.expiry_heap)
+            item = self.items.get(primary_key)
+            if item is not None and self._ttl_of(item) == ttl:
+                return ttl, primary_key
+        return None
+    
+    def _evict(self):
+        """Make room for one item under the max_items cap (lock held)"""
+        entry = self._pop_expiry() if self.eviction_policy == 'soonest-expiry' else None
+        primary_key = entry[1] if entry else next(iter(self.items))
+        self._remove(primary_key, by_service=True)
+        self.evicted_count += 1
+    
+    def _expire(self, primary_key):
+        self._remove(primary_key, by_service=True)
+        self.expired_count += 1
+    
+    def export_state(self) -> Dict:
+        """Copy of the stored (packed) items by primary key (lock held)"""
+        return {'items': dict(self.items)}
+    
+    def load_state(self, state: Dict):
+        """Replace the table contents with an exported state, dropping expired items;
+        indexes are built in bulk rather than item by item (and no stream records are written)
+        """
+        now = time.time()
+        items = {}
+        partitions = {}
+        expiry_heap = []
+        for primary_key, item in state['items'].items():
+            ttl = self._ttl_of(item)
+            if ttl is not None:
+                if now > ttl:
+                    continue
+                expiry_heap.append((ttl, primary_key))
+            items[primary_key] = item
+            if self.sort_key is not None:
+                partitions.setdefault(primary_key[0], []).append(primary_key[1])
+        for sort_keys in partitions.values():
+            sort_keys.sort()
+        heapq.heapify(expiry_heap)
+        
+        with self.lock:
+            self.items = items
+            self.partitions = partitions
+            self.scan_order = None
+            self.expiry_heap = expiry_heap
+            self.pending_expiry = len(expiry_heap)
+            while self.max_items is not None and len(self.items) > self.max_items:
+                self._evict()
+            if self.age_attribute is not None:
+                self._rebuild_age_heap()
+    
+    def expire_items(self, time_budget: float = 0.005, slice_size: int = 100) -> int:
+        """Reclaim expired items in slices of slice_size, releasing the lock between
+        slices so writers are never paused for long; stops after time_budget seconds
+        """
+        started = time.perf_counter()
+        expired = 0
+        while True:
+            with self.lock:
+                now = time.time()
+                due = 0
+                while due < slice_size and self.expiry_heap and self.expiry_heap[0][0] < now:
+                    # Stale entries (rewritten or deleted items) are discarded as they surface
+                    ttl, primary_key = heapq.heappop(self.expiry_heap)
+                    due += 1
+                    item = self.items.get(primary_key)
+                    if item is not None and self._ttl_of(item) == ttl:
+                        self._expire(primary_key)
+                        expired += 1
+                more_due = bool(self.expiry_heap) and self.expiry_heap[0][0] < now
+            if not more_due or time.perf_counter() - started >= time_budget:
+                return expired
+    
+    def start_expiry(self, interval: float = 1.0, time_budget: float = 0.005):
+        """Run expire_items every interval seconds on a background thread"""
+        if self._expiry_stop is not None:
+            return
+        self._expiry_stop = threading.Event()
+        stop = self._expiry_stop
+        
+        def run():
+            while not stop.wait(interval):
+                self.expire_items(time_budget)
+        
+        threading.Thread(target=run, name=f"ttl-expiry-{self.name}", daemon=True).start()
+    
+    def stop_expiry(self):
+        if self._expiry_stop is not None:
+            self._expiry_stop.set()
+            self._expiry_stop = None
+    
+    def track_age(self, attribute: str):
+        """Index items by a numeric (epoch seconds) attribute so tier_out finds the
+        oldest ones without a scan; items without it are never tiered out
+        """
+        with self.lock:
+            self.age_attribute = attribute
+            self._rebuild_age_heap()
+    
+    def watch_deletes(self, watcher):
+        """Call watcher(wire key) for every client delete, whether or not the key is
+        stored here, e.g. to record tombstones for copies tiered out of the table
+        """
+        with self.lock:
+            self.delete_watcher = watcher
+    
+    def enable_stream(self, shards: int = 1, capacity: int = 100000) -> TableStream:
+        """Record every later put, update, delete and expiry in a change stream of
+        shards ring buffers holding the latest capacity records each (records keep
+        replaced and removed items alive until they are overwritten)
+        """
+        with self.lock:
+            if self.stream is None:
+                self.stream = TableStream(self.name, self.partition_key, self.sort_key, shards, capacity)
+            return self.stream
+    
+    def oldest_timestamp(self) -> Optional[float]:
+        """Lower bound of the age attribute over stored items (None when none has it)"""
+        with self.lock:
+            return self.age_heap[0][0] if self.age_heap else None  # stale entries only lower it
+    
+    def _take_aged(self, cutoff: float, limit: int, slice_size: int) -> List[tuple]:
+        """Pop up to limit live (timestamp, primary key, item) entries older than cutoff
+        off the age heap, in slices of slice_size per lock acquisition
+        """
+        candidates = []
+        seen = set()  # a rewrite with the same timestamp leaves a second heap entry
+        while len(candidates) < limit:
+            with self.lock:
+                taken = len(candidates)
+                while len(candidates) - taken < slice_size and len(candidates) < limit and \
+                        self.age_heap and self.age_heap[0][0] < cutoff:
+                    timestamp, primary_key = heapq.heappop(self.age_heap)
+                    item = self.items.get(primary_key)
+                    if item is not None and self._timestamp_of(item) == timestamp and primary_key not in seen:
+                        seen.add(primary_key)
+                        candidates.append((timestamp, primary_key, item))
+                more_due = bool(self.age_heap) and self.age_heap[0][0] < cutoff
+            if not more_due:
+                break
+        return candidates
+    
+    def _restore_aged(self, candidates: List[tuple]):
+        with self.lock:
+            for timestamp, primary_key, _ in candidates:
+                heapq.heappush(self.age_heap, (timestamp, primary_key))
+    
+    def _drop_aged(self, candidates: List[tuple], slice_size: int) -> int:
+        """Remove the taken items that were not rewritten since"""
+        dropped = 0
+        for start in range(0, len(candidates), slice_size):
+            with self.lock:
+                for _, primary_key, item in candidates[start:start + slice_size]:
+                    if self.items.get(primary_key) is item:
+                        self._remove(primary_key, by_service=True)
+                        dropped += 1
+        return dropped
+    
+    def tier_out(self, cutoff: float, write, limit: int = 50000, slice_size: int = 1000) -> int:
+        """Move up to limit items whose age attribute is below cutoff out of the table
+        
+        The items are collected in slices of slice_size (releasing the lock between
+        slices), handed to write(packed items) with no lock held, and only then
+        removed - unless they were rewritten meanwhile, in which case the table's
+        newer copy stays. If write raises, the items stay and are retried next time.
+        """
+        if self.age_attribute is None:
+            raise Exception(f"Age tracking is not enabled on table {self.name}")
+        candidates = self._take_aged(cutoff, limit, slice_size)
+        if not candidates:
+            return 0
+        try:
+            write([item for _, _, item in candidates])
+        except Exception:
+            self._restore_aged(candidates)
+            raise
+        return self._drop_aged(candidates, slice_size)
+    
+    def expiry_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'live': len(self.items),
+                'pending': self.pending_expiry,
+                'expired': self.expired_count,
+                'evicted': self.evicted_count,
+            }
+    
+    def put_item(self, item: Dict, condition=None):
+        """Store an item; condition(existing item or None) must hold or the put is rejected"""
+        primary_key = self._primary_key(item)
+        packed = pack_item(item)
+        with self.lock:
+            if condition is not None:
+                self._check_condition(condition, self._current(primary_key, time.time()))
+            self._store(primary_key, packed)
+    
+    def update_item(self, key: Dict, set_attributes: Dict = None, remove_attributes: List[str] = None,
+                    condition=None) -> Dict:
+        """Set/remove attributes of an item (creating it if absent) in one atomic step"""
+        primary_key = self._primary_key(key)
+        with self.lock:
+            current = self._current(primary_key, time.time())
+            self._check_condition(condition, current)
+            item = dict(current) if current is not None else pack_item(key)
+            item.update(pack_item(set_attributes or {}))
+            for attribute in remove_attributes or []:
+                item.pop(attribute, None)
+            self._store(primary_key, item)
+        return unpack_item(item)
     
     def get_item(self, key: Dict) -> Dict:
-        key_value = key.get('idempotency_key', {}).get('S', 'unknown')
-        if key_value in self.items:
-            item = self.items[key_value]
+        primary_key = self._primary_key(key)
+        with self.lock:
+            # Check TTL; expired items not yet swept count as absent
+            item = self._current(primary_key, time.time())
+        return {'Item': unpack_item(item)} if item is not None else {}
+    
+    def delete_item(self, key: Dict, condition=None):
+        primary_key = self._primary_key(key)
+        with self.lock:
+            if condition is not None:
+                self._check_condition(condition, self._current(primary_key, time.time()))
+            self._remove(primary_key)
+            if self.delete_watcher:
+                self.delete_watcher(key)
+    
+    def batch_get(self, keys: List[Dict]):
+        """Fetch many items under one lock acquisition; returns (items, unprocessed keys)"""
+        served = keys if self.batch_capacity is None else keys[:self.batch_capacity]
+        primary_keys = [self._primary_key(key) for key in served]
+        with self.lock:
+            now = time.time()
+            items = [self._current(primary_key, now) for primary_key in primary_keys]
+        return [unpack_item(item) for item in items if item is not None], keys[len(served):]
+    
+    def batch_write(self, requests: List[Dict]) -> List[Dict]:
+        """Apply PutRequest / DeleteRequest entries under one lock acquisition; returns unprocessed requests"""
+        served = requests if self.batch_capacity is None else requests[:self.batch_capacity]
+        operations = []
+        for request in served:
+            if 'PutRequest' in request:
+                item = request['PutRequest']['Item']
+                operations.append((self._primary_key(item), pack_item(item)))
+            elif 'DeleteRequest' in request:
+                operations.append((self._primary_key(request['DeleteRequest']['Key']), None))
+            else:
+                raise Exception(f"Invalid batch write request: {request}")
+        with self.lock:
+            for request, (primary_key, item) in zip(served, operations):
+                if item is None:
+                    self._remove(primary_key)
+                    if self.delete_watcher:
+                        self.delete_watcher(request['DeleteRequest']['Key'])
+                else:
+                    self._store(primary_key, item)
+        return requests[len(served):]
+    
+    def query(self, pk_value: Dict, sk_condition: tuple = None, limit: int = None,
+              exclusive_start_key: Dict = None, scan_forward: bool = True) -> Dict:
+        """Items of one partition in sort key order, O(log n + k) via bisect
+        
+        sk_condition is (operator, *values) with operator one of
+        '=', '<', '<=', '>', '>=', 'between' or 'begins_with'.
+        """
+        if self.sort_key is None:
+            item = self.get_item({self.partition_key: pk_value}).get('Item')
+            items = [item] if item else []
+            return {'Items': items, 'Count': len(items), 'ScannedCount': len(items)}
+        
+        pk = self._key_value({self.partition_key: pk_value}, self.partition_key)
+        with self.lock:
+            sort_keys = self.partitions.get(pk, [])
+            lo, hi = 0, len(sort_keys)
             
-            # Check TTL
-            if 'ttl' in item and 'N' in item['ttl']:
-                try:
-                    ttl = int(item['ttl']['N'])
-                    if time.time() > ttl:
-                        del self.items[key_value]
-                        return {}
-                except:
-                    pass
+            if sk_condition:
+                operator, *operands = sk_condition
+                values = [self._key_value({self.sort_key: operand}, self.sort_key) for operand in operands]
+                if operator == '=':
+                    lo, hi = bisect.bisect_left(sort_keys, values[0]), bisect.bisect_right(sort_keys, values[0])
+                elif operator == '<':
+                    hi = bisect.bisect_left(sort_keys, values[0])
+                elif operator == '<=':
+                    hi = bisect.bisect_right(sort_keys, values[0])
+                elif operator == '>':
+                    lo = bisect.bisect_right(sort_keys, values[0])
+                elif operator == '>=':
+                    lo = bisect.bisect_left(sort_keys, values[0])
+                elif operator == 'between':
+                    lo, hi = bisect.bisect_left(sort_keys, values[0]), bisect.bisect_right(sort_keys, values[1])
+                elif operator == 'begins_with':
+                    prefix = values[0]
+                    lo = bisect.bisect_left(sort_keys, prefix)
+                    if prefix:
+                        # Every key with the prefix sorts below the prefix with its last character bumped
+                        hi = bisect.bisect_left(sort_keys, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+                else:
+                    raise Exception(f"Unsupported sort key condition: {operator}")
             
-            return {'Item': item}
-        return {}
+            # Resume strictly after the last key of the previous page
+            if exclusive_start_key:
+                start = self._key_value(exclusive_start_key, self.sort_key)
+                if scan_forward:
+                    lo = max(lo, bisect.bisect_right(sort_keys, start))
+                else:
+                    hi = min(hi, bisect.bisect_left(sort_keys, start))
+            
+            positions = range(lo, hi) if scan_forward else range(hi - 1, lo - 1, -1)
+            has_more = limit is not None and len(positions) > limit
+            if limit is not None:
+                positions = positions[:limit]
+            
+            now = time.time()
+            page = [(pk, sort_keys[position]) for position in positions]
+            last_key = self._key_of(self.items[page[-1]]) if has_more and page else None
+            items = []
+            for primary_key in page:
+                item = self.items[primary_key]
+                if self._is_expired(item, now):
+                    self._expire(primary_key)
+                else:
+                    items.append(item)
+        
+        # Wire-format copies are built outside the lock
+        items = [unpack_item(item) for item in items]
+        result = {'Items': items, 'Count': len(items), 'ScannedCount': len(page)}
+        if last_key:
+            result['LastEvaluatedKey'] = last_key
+        return result
+    
+    def _scan_page(self, limit: Optional[int], exclusive_start_key: Optional[Dict]):
+        """Up to limit stored items in primary key order after the start key; returns
+        (live items, items read, wire key of the last item read, whether more remain)
+        """
+        with self.lock:
+            if self.scan_order is None:
+                self.scan_order = sorted(self.partitions if self.sort_key is not None else self.items)
+            order = self.scan_order
+            if self.sort_key is None:
+                start = bisect.bisect_right(order, self._primary_key(exclusive_start_key)) if exclusive_start_key else 0
+                page = order[start:] if limit is None else order[start:start + limit]
+                has_more = start + len(page) < len(order)
+            else:
+                index, position = 0, 0
+                if exclusive_start_key:
+                    start_pk, start_sk = self._primary_key(exclusive_start_key)
+                    index = bisect.bisect_left(order, start_pk)
+                    if index < len(order) and order[index] == start_pk:
+                        position = bisect.bisect_right(self.partitions[start_pk], start_sk)
+                page = []
+                while index < len(order) and (limit is None or len(page) < limit):
+                    pk = order[index]
+                    sort_keys = self.partitions[pk]
+                    end = len(sort_keys) if limit is None else min(len(sort_keys), position + limit - len(page))
+                    page.extend([(pk, sk) for sk in sort_keys[position:end]])
+                    position = end
+                    if position == len(sort_keys):
+                        index, position = index + 1, 0
+                has_more = index < len(order)
+            
+            now = time.time()
+            last_key = self._key_of(self.items[page[-1]]) if page else None
+            items = []
+            for primary_key in page:
+                item = self.items[primary_key]
+                if self._is_expired(item, now):
+                    self._expire(primary_key)
+                else:
+                    items.append(item)
+        return items, len(page), last_key, has_more
+    
+    def scan(self, limit: int = None, exclusive_start_key: Dict = None, condition=None) -> Dict:
+        """Every item in primary key order, limit items read per page
+        
+        As in DynamoDB, limit caps the items read rather than the items passing the
+        filter condition(wire item), and LastEvaluatedKey is set while items remain.
+        """
+        items, scanned, last_key, has_more = self._scan_page(limit, exclusive_start_key)
+        items = [unpack_item(item) for item in items]
+        if condition is not None:
+            items = [item for item in items if condition(item)]
+        result = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+        if has_more and last_key:
+            result['LastEvaluatedKey'] = last_key
+        return result
+
+class ShardedTable:
+    """SimpleTable split into hash partitions by partition key, each with its own lock
+    
+    A partition key always maps to the same shard, so single-item calls and
+    queries lock one shard and batch calls lock only the shards they touch.
+    """
+    def __init__(self, name: str, partition_key: str = 'idempotency_key', sort_key: str = None,
+                 batch_capacity: int = None, max_items: int = None,
+                 eviction_policy: str = 'soonest-expiry', shards: int = 16):
+        self.name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.batch_capacity = batch_capacity
+        # The item cap is enforced per shard, so the table-wide cap is approximate
+        shard_cap = -(-max_items // shards) if max_items is not None else None
+        self.shards = [SimpleTable(name, partition_key, sort_key, None, shard_cap, eviction_policy)
+                       for _ in range(shards)]
+    
+    def _shard_index(self, key: Dict) -> int:
+        # Stable across processes (unlike hash()), so persisted shards reload in place
+        pk = self.shards[0]._key_value(key, self.partition_key)
+        return zlib.crc32(str(pk).encode()) % len(self.shards)
+    
+    def _shard(self, key: Dict) -> SimpleTable:
+        return self.shards[self._shard_index(key)]
+    
+    def put_item(self, item: Dict, condition=None):
+        return self._shard(item).put_item(item, condition)
+    
+    def update_item(self, key: Dict, set_attributes: Dict = None, remove_attributes: List[str] = None,
+                    condition=None) -> Dict:
+        return self._shard(key).update_item(key, set_attributes, remove_attributes, condition)
+    
+    def get_item(self, key: Dict) -> Dict:
+        return self._shard(key).get_item(key)
+    
+    def delete_item(self, key: Dict, condition=None):
+        return self._shard(key).delete_item(key, condition)
+    
+    def batch_get(self, keys: List[Dict]):
+        served = keys if self.batch_capacity is None else keys[:self.batch_capacity]
+        by_shard = {}
+        for key in served:
+            by_shard.setdefault(self._shard_index(key), []).append(key)
+        items = []
+        for index, shard_keys in by_shard.items():
+            items.extend(self.shards[index].batch_get(shard_keys)[0])
+        return items, keys[len(served):]
+    
+    def batch_write(self, requests: List[Dict]) -> List[Dict]:
+        served = requests if self.batch_capacity is None else requests[:self.batch_capacity]
+        by_shard = {}
+        for request in served:
+            if 'PutRequest' in request:
+                key = request['PutRequest']['Item']
+            elif 'DeleteRequest' in request:
+                key = request['DeleteRequest']['Key']
+            else:
+                raise Exception(f"Invalid batch write request: {request}")
+            by_shard.setdefault(self._shard_index(key), []).append(request)
+        for index, shard_requests in by_shard.items():
+            self.shards[index].batch_write(shard_requests)
+        return requests[len(served):]
+    
+    def query(self, pk_value: Dict, sk_condition: tuple = None, limit: int = None,
+              exclusive_start_key: Dict = None, scan_forward: bool = True) -> Dict:
+        shard = self._shard({self.partition_key: pk_value})
+        return shard.query(pk_value, sk_condition, limit, exclusive_start_key, scan_forward)
+    
+    def scan(self, limit: int = None, exclusive_start_key: Dict = None, condition=None) -> Dict:
+        """Shards are read one after another; the start key's hash names its shard"""
+        index = self._shard_index(exclusive_start_key) if exclusive_start_key else 0
+        start_key = exclusive_start_key
+        items, scanned, last_key, has_more = [], 0, None, False
+        while index < len(self.shards):
+            shard_items, shard_scanned, shard_last_key, has_more = self.shards[index]._scan_page(
+                None if limit is None else limit - scanned, start_key)
+            items.extend(shard_items)
+            scanned += shard_scanned
+            last_key = shard_last_key or last_key
+            if has_more:
+                break
+            index, start_key = index + 1, None
+            if limit is not None and scanned >= limit:
+                has_more = index < len(self.shards)
+                break
+        items = [unpack_item(item) for item in items]
+        if condition is not None:
+            items = [item for item in items if condition(item)]
+        result = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+        if has_more and last_key:
+            result['LastEvaluatedKey'] = last_key
+        return result
+    
+    def expire_items(self, time_budget: float = 0.005, slice_size: int = 100) -> int:
+        budget = time_budget / len(self.shards)
+        return sum(shard.expire_items(budget, slice_size) for shard in self.shards)
+    
+    def start_expiry(self, interval: float = 1.0, time_budget: float = 0.005):
+        for shard in self.shards:
+            shard.start_expiry(interval, time_budget / len(self.shards))
+    
+    def stop_expiry(self):
+        for shard in self.shards:
+            shard.stop_expiry()
+    
+    def track_age(self, attribute: str):
+        for shard in self.shards:
+            shard.track_age(attribute)
+    
+    def watch_deletes(self, watcher):
+        for shard in self.shards:
+            shard.watch_deletes(watcher)
+    
+    def enable_stream(self, shards: int = None, capacity: int = 100000) -> TableStream:
+        """One stream shard per table shard, each appended to under its table shard's lock"""
+        if shards is not None and shards != len(self.shards):
+            raise Exception(f"Table {self.name} streams into its {len(self.shards)} shards, not {shards}")
+        if self.shards[0].stream is None:
+            stream = TableStream(self.name, self.partition_key, self.sort_key, len(self.shards), capacity)
+            for shard, stream_shard in zip(self.shards, stream.shards):
+                with shard.lock:
+                    shard.stream_shard = stream_shard
+                    shard.stream = stream
+        return self.shards[0].stream
+    
+    def oldest_timestamp(self) -> Optional[float]:
+        timestamps = [timestamp for timestamp in (shard.oldest_timestamp() for shard in self.shards)
+                      if timestamp is not None]
+        return min(timestamps) if timestamps else None
+    
+    def tier_out(self, cutoff: float, write, limit: int = 50000, slice_size: int = 1000) -> int:
+        """Items from every shard (up to its share of limit) go to one write call"""
+        if self.shards[0].age_attribute is None:
+            raise Exception(f"Age tracking is not enabled on table {self.name}")
+        share = -(-limit // len(self.shards))
+        taken = [shard._take_aged(cutoff, share, slice_size) for shard in self.shards]
+        if not any(taken):
+            return 0
+        try:
+            write([item for candidates in taken for _, _, item in candidates])
+        except Exception:
+            for shard, candidates in zip(self.shards, taken):
+                shard._restore_aged(candidates)
+            raise
+        return sum(shard._drop_aged(candidates, slice_size) for shard, candidates in zip(self.shards, taken))
+    
+    def expiry_stats(self) -> Dict:
+        totals = {}
+        for shard in self.shards:
+            for name, value in shard.expiry_stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
 
 class EmulatorRegistry:
+    # Copy-on-write maps: creation swaps in a new dict under a lock, so lookups
+    # from worker threads read a stable snapshot without taking any lock
     queues: Dict[str, SimpleQueue] = {}
     tables: Dict[str, SimpleTable] = {}
+    cold_tiers: Dict[str, object] = {}  # table name -> cold_storage.Tiering, see enable_tiering
+    _lock = threading.Lock()
+    backend = None  # client for an emulator server (queue_server.connect); None = in-process
     
     @classmethod
-    def create_queue(cls, name: str, dlq_name: str = None, max_receive_count: int = 3) -> str:
+    def create_queue(cls, name: str, dlq_name: str = None, max_receive_count: int = 3,
+                     visibility_timeout: float = 30, fifo: bool = False,
+                     content_based_deduplication: bool = False, deduplication_window: float = 300,
+                     delay_seconds: float = 0, fair: bool = False, tenant_attribute: str = 'school_id',
+                     tenant_weights: Dict[str, float] = None, tenant_in_flight_limit: int = None,
+                     tenant_in_flight_limits: Dict[str, int] = None) -> str:
         queue_url = f"local://sqs/{name}"
-        cls.queues[queue_url] = SimpleQueue(name, dlq_name, max_receive_count)
+        if fifo:
+            if delay_seconds:
+                raise Exception(f"DelaySeconds is not supported on FIFO queue {name}")
+            if fair:
+                raise Exception(f"Fair scheduling is not supported on FIFO queue {name}")
+            queue = FifoQueue(name, dlq_name, max_receive_count, visibility_timeout,
+                              content_based_deduplication, deduplication_window)
+        elif fair:
+            queue = FairQueue(name, dlq_name, max_receive_count, visibility_timeout, delay_seconds,
+                              tenant_attribute, tenant_weights, tenant_in_flight_limit, tenant_in_flight_limits)
+        else:
+            queue = SimpleQueue(name, dlq_name, max_receive_count, visibility_timeout, delay_seconds)
+        with cls._lock:
+            cls.queues = {**cls.queues, queue_url: queue}
         return queue_url
     
     @classmethod
@@ -145,76 +1758,497 @@ class EmulatorRegistry:
         return cls.queues.get(queue_url)
     
     @classmethod
-    def create_table(cls, name: str):
-        cls.tables[name] = SimpleTable(name)
+    def create_table(cls, name: str, partition_key: str = 'idempotency_key', sort_key: str = None,
+                     batch_capacity: int = None, max_items: int = None,
+                     eviction_policy: str = 'soonest-expiry', shards: int = 1) -> SimpleTable:
+        if shards > 1:
+            table = ShardedTable(name, partition_key, sort_key, batch_capacity, max_items, eviction_policy, shards)
+        else:
+            table = SimpleTable(name, partition_key, sort_key, batch_capacity, max_items, eviction_policy)
+        with cls._lock:
+            previous = cls.tables.get(name)
+            cls.tables = {**cls.tables, name: table}
+        if previous:
+            previous.stop_expiry()
+        return table
     
     @classmethod
     def get_table(cls, name: str) -> Optional[SimpleTable]:
         return cls.tables.get(name)
 
+def _remote(service: str):
+    """Static API method that is forwarded to the emulator server when one is connected;
+    with METRICS enabled, each call's latency and errors are recorded per operation
+    """
+    def decorate(func):
+        method = f"{service}.{func.__name__}"
+        latency = METRICS.histogram('emulator_call_seconds', service=service, operation=func.__name__)
+        errors = METRICS.counter('emulator_call_errors_total', service=service, operation=func.__name__)
+        
+        def call(args, kwargs):
+            backend = EmulatorRegistry.backend
+            if backend is not None:
+                return backend.call(method, *args, **kwargs)
+            return func(*args, **kwargs)
+        
+        @functools.wraps(func)
+        def forward(*args, **kwargs):
+            if not METRICS.enabled:
+                return call(args, kwargs)
+            started = time.perf_counter()
+            try:
+                return call(args, kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+        forward.remote_method = method
+        return staticmethod(forward)
+    return decorate
+
+def pipelined(calls: List[Tuple[Callable, tuple, Dict]], return_exceptions: bool = False) -> list:
+    """Run (client method, args, kwargs) calls, e.g. (LocalDynamoDB.update_item, (...), {...}),
+    in order; with an emulator server connected they go out as one pipeline, a single
+    round trip. With return_exceptions, a failed call's exception takes its place in
+    the results instead of being raised
+    """
+    backend = EmulatorRegistry.backend
+    if backend is not None:
+        return backend.pipeline([(method.remote_method, args, kwargs) for method, args, kwargs in calls],
+                                return_exceptions)
+    results = []
+    for method, args, kwargs in calls:
+        try:
+            results.append(method(*args, **kwargs))
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
 # Simple API classes
 class LocalSQS:
-    @staticmethod
-    def send_message(queue_url: str, message_body: str, message_attributes: Dict = None):
+    @_remote('sqs')
+    def send_message(queue_url: str, message_body: str, message_attributes: Dict = None,
+                     message_group_id: str = None, message_deduplication_id: str = None,
+                     delay_seconds: float = None):
         queue = EmulatorRegistry.queues.get(queue_url)
         if queue:
-            return queue.send_message(message_body, message_attributes)
+            return queue.send_message(message_body, message_attributes, message_group_id, message_deduplication_id,
+                                      delay_seconds)
         raise Exception(f"Queue not found: {queue_url}")
     
-    @staticmethod
+    @_remote('sqs')
     def send_message_batch(queue_url: str, entries: List[Dict]) -> Dict:
         queue = EmulatorRegistry.queues.get(queue_url)
         if queue:
             return queue.send_message_batch(entries)
         raise Exception(f"Queue not found: {queue_url}")
     
-    @staticmethod
-    def receive_message(queue_url: str, max_messages: int = 1, wait_time: int = 0) -> Dict:
+    @_remote('sqs')
+    def receive_message(queue_url: str, max_messages: int = 1, wait_time: int = 0,
+                        visibility_timeout: float = None) -> Dict:
         queue = EmulatorRegistry.queues.get(queue_url)
         if queue:
-            messages = queue.receive_messages(max_messages, wait_time)
+            messages = queue.receive_messages(max_messages, wait_time, visibility_timeout)
             return {'Messages': messages} if messages else {}
         raise Exception(f"Queue not found: {queue_url}")
     
-    @staticmethod
+    @_remote('sqs')
     def delete_message(queue_url: str, receipt_handle: str):
         queue = EmulatorRegistry.queues.get(queue_url)
         if queue:
             return queue.delete_message(receipt_handle)
         raise Exception(f"Queue not found: {queue_url}")
+    
+    @_remote('sqs')
+    def delete_message_batch(queue_url: str, entries: List[Dict]) -> Dict:
+        queue = EmulatorRegistry.queues.get(queue_url)
+        if queue:
+            return queue.delete_message_batch(entries)
+        raise Exception(f"Queue not found: {queue_url}")
+    
+    @_remote('sqs')
+    def redrive_messages(source_queue_url: str, destination_queue_url: str = None, max_messages: int = None,
+                         max_messages_per_second: float = None, delay_seconds: float = 0) -> Dict:
+        """Move messages out of a DLQ in bulk, by default back to the queue that
+        dead-letters into it, like SQS StartMessageMoveTask (but synchronous)
+        """
+        source = EmulatorRegistry.queues.get(source_queue_url)
+        if not source:
+            raise Exception(f"Queue not found: {source_queue_url}")
+        if destination_queue_url is None:
+            origins = [queue for queue in EmulatorRegistry.queues.values() if queue.dlq_name == source.name]
+            if len(origins) != 1:
+                raise Exception(f"Queue {source.name} is the DLQ of {len(origins)} queues: "
+                                f"a destination_queue_url is required")
+            destination = origins[0]
+        else:
+            destination = EmulatorRegistry.queues.get(destination_queue_url)
+            if not destination:
+                raise Exception(f"Queue not found: {destination_queue_url}")
+        moved = source.move_messages(destination, max_messages, max_messages_per_second, delay_seconds)
+        return {'MovedMessages': moved}
+    
+    @_remote('sqs')
+    def get_queue_attributes(queue_url: str) -> Dict:
+        queue = EmulatorRegistry.queues.get(queue_url)
+        if queue:
+            return {'Attributes': queue.attributes()}
+        raise Exception(f"Queue not found: {queue_url}")
 
 class LocalDynamoDB:
-    @staticmethod
-    def put_item(table_name: str, item: Dict):
+    @_remote('dynamodb')
+    def put_item(table_name: str, item: Dict, condition_expression: str = None,
+                 expression_attribute_values: Dict = None, expression_attribute_names: Dict = None):
         table = EmulatorRegistry.get_table(table_name)
         if table:
-            return table.put_item(item)
+            condition = _parse_condition(condition_expression, expression_attribute_values or {},
+                                         expression_attribute_names or {})
+            return table.put_item(item, condition)
         raise Exception(f"Table not found: {table_name}")
     
-    @staticmethod
+    @_remote('dynamodb')
+    def update_item(table_name: str, key: Dict, update_expression: str,
+                    expression_attribute_values: Dict = None, expression_attribute_names: Dict = None,
+                    condition_expression: str = None) -> Dict:
+        """Atomic update, e.g. 'SET #status = :done, version = :next REMOVE lease_expires_at'"""
+        table = EmulatorRegistry.get_table(table_name)
+        if not table:
+            raise Exception(f"Table not found: {table_name}")
+        values = expression_attribute_values or {}
+        names = expression_attribute_names or {}
+        set_attributes, remove_attributes = _parse_update(update_expression, values, names)
+        condition = _parse_condition(condition_expression, values, names)
+        item = table.update_item(key, set_attributes, remove_attributes, condition)
+        return {'Attributes': item}
+    
+    @_remote('dynamodb')
     def get_item(table_name: str, key: Dict) -> Dict:
         table = EmulatorRegistry.get_table(table_name)
         if table:
             return table.get_item(key)
         raise Exception(f"Table not found: {table_name}")
+    
+    @_remote('dynamodb')
+    def delete_item(table_name: str, key: Dict, condition_expression: str = None,
+                    expression_attribute_values: Dict = None, expression_attribute_names: Dict = None):
+        table = EmulatorRegistry.get_table(table_name)
+        if table:
+            condition = _parse_condition(condition_expression, expression_attribute_values or {},
+                                         expression_attribute_names or {})
+            return table.delete_item(key, condition)
+        raise Exception(f"Table not found: {table_name}")
+    
+    @_remote('dynamodb')
+    def batch_get_item(request_items: Dict) -> Dict:
+        """{table: {'Keys': [...]}} -> {'Responses': {table: [...]}, 'UnprocessedKeys': {...}}"""
+        responses = {}
+        unprocessed = {}
+        for table_name, request in request_items.items():
+            table = EmulatorRegistry.get_table(table_name)
+            if not table:
+                raise Exception(f"Table not found: {table_name}")
+            items, unprocessed_keys = table.batch_get(request['Keys'])
+            responses[table_name] = items
+            if unprocessed_keys:
+                unprocessed[table_name] = dict(request, Keys=unprocessed_keys)
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+    
+    @_remote('dynamodb')
+    def batch_write_item(request_items: Dict) -> Dict:
+        """{table: [{'PutRequest': {'Item': ...}} | {'DeleteRequest': {'Key': ...}}]} -> {'UnprocessedItems': {...}}"""
+        unprocessed = {}
+        for table_name, requests in request_items.items():
+            table = EmulatorRegistry.get_table(table_name)
+            if not table:
+                raise Exception(f"Table not found: {table_name}")
+            unprocessed_requests = table.batch_write(requests)
+            if unprocessed_requests:
+                unprocessed[table_name] = unprocessed_requests
+        return {'UnprocessedItems': unprocessed}
+    
+    @_remote('dynamodb')
+    def query(table_name: str, key_condition_expression: str, expression_attribute_values: Dict,
+              expression_attribute_names: Dict = None, limit: int = None,
+              exclusive_start_key: Dict = None, scan_index_forward: bool = True) -> Dict:
+        """Query one partition, e.g. 'PK = :pk AND begins_with(SK, :prefix)'"""
+        table = EmulatorRegistry.get_table(table_name)
+        if not table:
+            raise Exception(f"Table not found: {table_name}")
+        pk_value, sk_condition = _parse_key_condition(
+            table, key_condition_expression, expression_attribute_values, expression_attribute_names or {}
+        )
+        return table.query(pk_value, sk_condition, limit, exclusive_start_key, scan_index_forward)
+
+    @_remote('dynamodb')
+    def scan(table_name: str, filter_expression: str = None, expression_attribute_values: Dict = None,
+             expression_attribute_names: Dict = None, limit: int = None, exclusive_start_key: Dict = None) -> Dict:
+        """Read the whole table a page at a time, e.g. filter_expression='consolidated = :false'"""
+        table = EmulatorRegistry.get_table(table_name)
+        if not table:
+            raise Exception(f"Table not found: {table_name}")
+        condition = _parse_condition(filter_expression, expression_attribute_values or {},
+                                     expression_attribute_names or {})
+        return table.scan(limit, exclusive_start_key, condition)
+
+    @_remote('dynamodb')
+    def read_items(table_name: str, tenant: str = None, start_date: str = None, end_date: str = None,
+                   partition_key_value: Dict = None, filter_expression: str = None,
+                   expression_attribute_values: Dict = None, expression_attribute_names: Dict = None,
+                   projection_expression: str = None, limit: int = None) -> Dict:
+        """Hot table first, then its cold tier (see cold_storage.enable_tiering); dates are
+        inclusive YYYY-MM-DD bounds on the item's timestamp, e.g. start_date='2024-01-01'
+        """
+        tiering = EmulatorRegistry.cold_tiers.get(table_name)
+        if not tiering:
+            raise Exception(f"Tiering not enabled for table: {table_name}")
+        names = expression_attribute_names or {}
+        condition = _parse_condition(filter_expression, expression_attribute_values or {}, names)
+        projection = None
+        if projection_expression:
+            projection = [names.get(name.strip(), name.strip()) for name in projection_expression.split(',')]
+        return tiering.read(tenant, start_date, end_date, partition_key_value, condition,
+                            _condition_attributes(filter_expression, names), projection, limit)
+
+def _table_stream(table_name: str) -> TableStream:
+    table = EmulatorRegistry.get_table(table_name)
+    if not table:
+        raise Exception(f"Table not found: {table_name}")
+    stream = table.shards[0].stream if isinstance(table, ShardedTable) else table.stream
+    if stream is None:
+        raise Exception(f"Stream not enabled for table: {table_name}")
+    return stream
+
+class LocalDynamoDBStreams:
+    """DynamoDB Streams API over TableStream; streams are named by their table and
+    shard iterators are plain 'table/shard/sequence' strings
+    """
+    @_remote('dynamodbstreams')
+    def describe_stream(table_name: str) -> Dict:
+        stream = _table_stream(table_name)
+        shards = [{'ShardId': shard.shard_id,
+                   'SequenceNumberRange': {'StartingSequenceNumber': f'{shard.trim_horizon():021d}'}}
+                  for shard in stream.shards]
+        return {'StreamDescription': {'TableName': table_name, 'StreamStatus': 'ENABLED',
+                                      'StreamViewType': 'NEW_AND_OLD_IMAGES', 'Shards': shards}}
+    
+    @_remote('dynamodbstreams')
+    def get_shard_iterator(table_name: str, shard_id: str, shard_iterator_type: str = 'TRIM_HORIZON',
+                           sequence_number: str = None) -> Dict:
+        shard = _table_stream(table_name).shard(shard_id)
+        if shard_iterator_type == 'TRIM_HORIZON':
+            position = shard.trim_horizon()
+        elif shard_iterator_type == 'LATEST':
+            position = shard.next_sequence
+        elif shard_iterator_type in ('AT_SEQUENCE_NUMBER', 'AFTER_SEQUENCE_NUMBER'):
+            if sequence_number is None:
+                raise Exception(f"{shard_iterator_type} requires a sequence number")
+            position = int(sequence_number) + (shard_iterator_type == 'AFTER_SEQUENCE_NUMBER')
+        else:
+            raise Exception(f"Unknown shard iterator type: {shard_iterator_type}")
+        return {'ShardIterator': f'{table_name}/{shard_id}/{position}'}
+    
+    @_remote('dynamodbstreams')
+    def get_records(shard_iterator: str, limit: int = 1000) -> Dict:
+        """Up to limit records (at most 1000, as in DynamoDB Streams) and the iterator
+        to continue from; raises TrimmedDataAccessException when the iterator fell
+        behind the ring buffer
+        """
+        table_name, shard_id, position = shard_iterator.rsplit('/', 2)
+        stream = _table_stream(table_name)
+        shard = stream.shard(shard_id)
+        records = shard.read(int(position), min(limit, 1000))
+        next_position = int(position) + len(records)
+        return {'Records': [stream.to_dict(shard, record) for record in records],
+                'NextShardIterator': f'{table_name}/{shard_id}/{next_position}'}
+
+_PK_CONDITION = re.compile(r'^\s*(#?\w+)\s*=\s*(:\w+)\s*(?:AND\s+(.+?))?\s*$', re.IGNORECASE)
+_SK_CONDITIONS = [
+    ('begins_with', re.compile(r'^begins_with\s*\(\s*(#?\w+)\s*,\s*(:\w+)\s*\)$', re.IGNORECASE)),
+    ('between', re.compile(r'^(#?\w+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)$', re.IGNORECASE)),
+    (None, re.compile(r'^(#?\w+)\s*(<=|>=|<|>|=)\s*(:\w+)$')),
+]
+
+def _parse_key_condition(table: SimpleTable, expression: str, values: Dict, names: Dict):
+    """Split a KeyConditionExpression into a partition key value and a sort key condition"""
+    def value(placeholder):
+        if placeholder not in values:
+            raise Exception(f"Missing expression attribute value: {placeholder}")
+        return values[placeholder]
+    
+    def check_attribute(name, expected):
+        if names.get(name, name) != expected:
+            raise Exception(f"Query key condition not supported on attribute: {names.get(name, name)}")
+    
+    match = _PK_CONDITION.match(expression)
+    if not match:
+        raise Exception(f"Invalid KeyConditionExpression: {expression}")
+    pk_name, pk_placeholder, sk_expression = match.groups()
+    check_attribute(pk_name, table.partition_key)
+    if not sk_expression:
+        return value(pk_placeholder), None
+    
+    for operator, pattern in _SK_CONDITIONS:
+        sk_match = pattern.match(sk_expression)
+        if not sk_match:
+            continue
+        sk_name, *rest = sk_match.groups()
+        check_attribute(sk_name, table.sort_key)
+        if operator is None:
+            operator, rest = rest[0], rest[1:]
+        return value(pk_placeholder), (operator, *[value(placeholder) for placeholder in rest])
+    raise Exception(f"Invalid KeyConditionExpression: {expression}")
+
+_EXISTS_CONDITION = re.compile(r'^(attribute_exists|attribute_not_exists)\s*\(\s*(#?\w+)\s*\)$', re.IGNORECASE)
+_COMPARISON_CONDITION = re.compile(r'^(#?\w+)\s*(<>|<=|>=|<|>|=)\s*(:\w+)$')
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+def _comparable(value: Dict):
+    if 'N' in value:
+        return Decimal(value['N'])
+    if 'S' in value:
+        return value['S']
+    return json.dumps(value, sort_keys=True)
 
-def setup_local_infrastructure():
+@functools.lru_cache(maxsize=256)
+def _condition_plan(expression: str, names: tuple) -> tuple:
+    """OR-branches of AND-ed (attribute, operator, placeholder) clauses, parsed once per
+    expression and names; operator is 'exists' / 'not_exists' for the functions
+    """
+    names = dict(names)
+    
+    def clause(text):
+        text = text.strip()
+        match = _EXISTS_CONDITION.match(text)
+        if match:
+            function, name = match.groups()
+            exists = function.lower() == 'attribute_exists'
+            return names.get(name, name), 'exists' if exists else 'not_exists', None
+        match = _COMPARISON_CONDITION.match(text)
+        if match:
+            name, operator, placeholder = match.groups()
+            return names.get(name, name), operator, placeholder
+        raise Exception(f"Invalid ConditionExpression: {expression}")
+    
+    return tuple(
+        tuple(clause(part) for part in re.split(r'\s+AND\s+', branch, flags=re.IGNORECASE))
+        for branch in re.split(r'\s+OR\s+', expression, flags=re.IGNORECASE)
+    )
+
+def _parse_condition(expression: Optional[str], values: Dict, names: Dict):
+    """Compile a ConditionExpression into a predicate over the stored item (None if absent)
+    
+    Supports attribute_exists / attribute_not_exists and =, <>, <, <=, >, >=
+    comparisons joined with AND / OR (AND binds tighter, no parentheses).
+    """
+    if not expression:
+        return None
+    
+    def check(attribute, operator, placeholder):
+        if placeholder is None:
+            exists = operator == 'exists'
+            return lambda item: (item is not None and attribute in item) == exists
+        if placeholder not in values:
+            raise Exception(f"Missing expression attribute value: {placeholder}")
+        expected = _comparable(values[placeholder])
+        compare = _COMPARISONS[operator]
+        
+        def predicate(item):
+            if item is None or attribute not in item:
+                return False
+            try:
+                return compare(_comparable(item[attribute]), expected)
+            except TypeError:
+                return False  # mismatched types never satisfy a comparison
+        return predicate
+    
+    alternatives = [[check(*clause) for clause in branch]
+                    for branch in _condition_plan(expression, tuple(sorted(names.items())))]
+    return lambda item: any(all(check(item) for check in branch) for branch in alternatives)
+
+def _condition_attributes(expression: Optional[str], names: Dict) -> List[str]:
+    """Attribute names a ConditionExpression reads (to decide which columns to load)"""
+    attributes = []
+    for part in re.split(r'\s+(?:AND|OR)\s+', expression or '', flags=re.IGNORECASE):
+        match = _EXISTS_CONDITION.match(part.strip())
+        name = match.group(2) if match else None
+        if not match:
+            match = _COMPARISON_CONDITION.match(part.strip())
+            name = match.group(1) if match else None
+        if name is not None:
+            attributes.append(names.get(name, name))
+    return attributes
+
+_UPDATE_CLAUSE = re.compile(r'\b(SET|REMOVE)\s+', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=256)
+def _update_plan(expression: str, names: tuple) -> Tuple[tuple, tuple]:
+    """(attribute, placeholder) pairs to set and attributes to remove, parsed once per
+    expression and names
+    """
+    names = dict(names)
+    assignments = []
+    remove_attributes = []
+    parts = _UPDATE_CLAUSE.split(expression)
+    if parts[0].strip():
+        raise Exception(f"Invalid UpdateExpression: {expression}")
+    for action, body in zip(parts[1::2], parts[2::2]):
+        for assignment in body.split(','):
+            assignment = assignment.strip()
+            if action.upper() == 'REMOVE':
+                remove_attributes.append(names.get(assignment, assignment))
+                continue
+            match = re.match(r'^(#?\w+)\s*=\s*(:\w+)$', assignment)
+            if not match:
+                raise Exception(f"Invalid UpdateExpression: {expression}")
+            name, placeholder = match.groups()
+            assignments.append((names.get(name, name), placeholder))
+    return tuple(assignments), tuple(remove_attributes)
+
+def _parse_update(expression: str, values: Dict, names: Dict):
+    """Split an UpdateExpression into attributes to set and attributes to remove"""
+    assignments, remove_attributes = _update_plan(expression, tuple(sorted(names.items())))
+    set_attributes = {}
+    for attribute, placeholder in assignments:
+        if placeholder not in values:
+            raise Exception(f"Invalid UpdateExpression: {expression}")
+        set_attributes[attribute] = values[placeholder]
+    return set_attributes, list(remove_attributes)
+
+def setup_local_infrastructure(fair_scheduling: bool = False):
     """Initialize the local infrastructure"""
     # Create DLQ first
     EmulatorRegistry.create_queue("anti-stampede-poc-dlq")
     
-    # Create main queue with DLQ
+    # Create main queue with DLQ; a short visibility timeout lets failed
+    # messages reappear (and reach the DLQ) within the demo run. With fair
+    # scheduling, receives round-robin over the school_id attribute
     EmulatorRegistry.create_queue(
         "anti-stampede-poc", 
         dlq_name="anti-stampede-poc-dlq",
-        max_receive_count=3
+        max_receive_count=3,
+        visibility_timeout=2,
+        fair=fair_scheduling
     )
     
-    # Create DynamoDB table
-    EmulatorRegistry.create_table("poc-idempotency")
+    # Create DynamoDB table; batch calls serve at most 25 requests like BatchWriteItem
+    table = EmulatorRegistry.create_table("poc-idempotency", batch_capacity=25)
+    
+    # Reclaim expired idempotency keys in the background, not only when re-read
+    table.start_expiry(interval=1.0)
     
     print("Local infrastructure successfully created:")
-    print("   - SQS Main Queue: local://sqs/anti-stampede-poc (with DLQ routing)")
+    print("   - SQS Main Queue: local://sqs/anti-stampede-poc (with DLQ routing%s)"
+          % (", tenant-fair receives" if fair_scheduling else ""))
     print("   - SQS DLQ: local://sqs/anti-stampede-poc-dlq (recovery processing)")
     print("   - DynamoDB Table: poc-idempotency (idempotency key storage with TTL)")
 